@@ -8,3 +8,6 @@ class FoxCapsConfig(AppConfig):
     name = "fox.caps"
     label = "fox_caps"
     # url_prefix = 'fox/caps'
+
+    def ready(self):
+        from . import checks, receivers  # noqa: F401
@@ -0,0 +1,12 @@
+"""Benchmarks of the capability subsystem.
+
+Benchmarks are standalone scripts run on SQLite, for example:
+
+    python -m fox.caps.benchmarks.select_references --sizes 10000 100000
+
+Django is configured by the benchmark itself (see `setup_django`): models
+must not be imported at module level.
+"""
+from .standalone import setup_django
+
+__all__ = ("setup_django",)
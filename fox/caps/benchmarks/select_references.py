@@ -0,0 +1,150 @@
+"""Compare query plans used by `ObjectQuerySet._select_references` to
+filter objects having a reference for a receiver:
+
+- ``subquery``: previous plan, annotating objects with a correlated
+  ``Subquery(refs.values("id")[:1])`` then excluding nulls;
+- ``exists``: correlated ``EXISTS`` subquery;
+- ``in``: current plan, semi-join on ``pk IN (SELECT target_id ...)``.
+
+Only the filtering part is measured: references prefetch is the same for
+all plans. For each dataset size, it measures counting the objects and
+fetching the first and last pages of them (as a paginated list view
+does).
+
+Usage:
+
+    python -m fox.caps.benchmarks.select_references \\
+        --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+
+from . import setup_django
+
+__all__ = ("create_dataset", "get_plans", "run")
+
+
+AGENTS = 20
+"""Number of agents references are distributed over."""
+PAGE_SIZE = 50
+BATCH_SIZE = 10000
+
+
+def create_dataset(size: int):
+    """Create `size` objects, each one having a reference for an agent
+    (round robin over `AGENTS` agents), and every tenth one a second
+    reference for the next agent.
+
+    :return the first agent.
+    """
+    from fox.caps.models import Agent
+    from fox.caps.tests.app.models import ConcreteObject, ConcreteReference
+
+    for model in (ConcreteReference, ConcreteObject):
+        queryset = model.objects.all()
+        queryset._raw_delete(queryset.db)
+    if Agent.objects.count() < AGENTS:
+        Agent.objects.bulk_create(Agent() for _ in range(AGENTS))
+    agents = list(Agent.objects.all().order_by("pk")[:AGENTS])
+
+    for start in range(0, size, BATCH_SIZE):
+        count = min(BATCH_SIZE, size - start)
+        objects = ConcreteObject.objects.bulk_create(
+            ConcreteObject(name=str(start + i)) for i in range(count)
+        )
+        refs = []
+        for i, obj in enumerate(objects, start):
+            refs.append(
+                ConcreteReference(receiver=agents[i % AGENTS], target=obj)
+            )
+            if not i % 10:
+                receiver = agents[(i + 1) % AGENTS]
+                refs.append(ConcreteReference(receiver=receiver, target=obj))
+        ConcreteReference.objects.bulk_create(refs)
+    return agents[0]
+
+
+def get_plans(agent) -> dict:
+    """Return querysets by plan name, filtering objects for agent."""
+    from django.db.models import Exists, OuterRef, Subquery
+
+    from fox.caps.tests.app.models import ConcreteObject, ConcreteReference
+
+    queryset = ConcreteObject.objects.all()
+    refs = ConcreteReference.objects.receiver(agent)
+    refs = refs.filter(target=OuterRef("pk"))
+    return {
+        "subquery": queryset.annotate(
+            reference_id=Subquery(refs.values("id")[:1])
+        ).exclude(reference_id__isnull=True),
+        "exists": queryset.filter(Exists(refs)),
+        "in": queryset.filter(
+            pk__in=ConcreteReference.objects.receiver(agent).values(
+                "target_id"
+            )
+        ),
+    }
+
+
+def measure(func, repeat: int) -> float:
+    """Return best time of `repeat` calls to `func`, in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def run(sizes, repeat: int = 3, explain: bool = False) -> list[dict]:
+    """Run benchmark for provided dataset sizes and return results."""
+    results = []
+    for size in sizes:
+        agent = create_dataset(size)
+        for name, queryset in get_plans(agent).items():
+            page = queryset.order_by("pk").values_list("pk", flat=True)
+            result = {
+                "size": size,
+                "plan": name,
+                "count": queryset.count(),
+                "count_ms": measure(queryset.count, repeat),
+                "page_ms": measure(lambda q=page: list(q[:PAGE_SIZE]), repeat),
+                "last_page_ms": measure(
+                    lambda q=page: list(q.reverse()[:PAGE_SIZE]), repeat
+                ),
+            }
+            if explain:
+                result["explain"] = queryset.explain()
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--db", default=":memory:", help="SQLite database")
+    parser.add_argument("--explain", action="store_true")
+    args = parser.parse_args()
+
+    setup_django(args.db)
+    results = run(args.sizes, args.repeat, args.explain)
+
+    print(
+        "{:>9} {:>9} {:>9} {:>10} {:>10} {:>12}".format(
+            "size", "plan", "count", "count_ms", "page_ms", "last_page_ms"
+        )
+    )
+    for r in results:
+        print(
+            "{size:>9} {plan:>9} {count:>9} {count_ms:>10.2f} "
+            "{page_ms:>10.2f} {last_page_ms:>12.2f}".format(**r)
+        )
+        if args.explain:
+            print(r["explain"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Standalone Django setup, for code running outside of pytest-django
+such as benchmarks and worker processes.
+
+Django is configured by `setup_django`: callers must not import models
+at module level.
+"""
+
+__all__ = ("setup_django",)
+
+
+def setup_django(
+    path: str = ":memory:", migrate: bool = True, timeout: int = None
+):
+    """Configure Django with a SQLite database at `path`.
+
+    :param migrate: create tables.
+    :param timeout: SQLite lock timeout in seconds.
+    """
+    import django
+    from django.conf import settings
+
+    if settings.configured:
+        return
+    database = {"ENGINE": "django.db.backends.sqlite3", "NAME": path}
+    if timeout is not None:
+        database["OPTIONS"] = {"timeout": timeout}
+    settings.configure(
+        INSTALLED_APPS=[
+            "django.contrib.auth",
+            "django.contrib.contenttypes",
+            "fox.caps",
+            "fox.caps.tests.app",
+        ],
+        DATABASES={"default": database},
+        # create tables from models
+        MIGRATION_MODULES={"fox_caps": None, "caps_test": None},
+        DEFAULT_AUTO_FIELD="django.db.models.BigAutoField",
+        USE_TZ=True,
+    )
+    django.setup()
+
+    if migrate:
+        from django.core.management import call_command
+
+        call_command("migrate", run_syncdb=True, verbosity=0)
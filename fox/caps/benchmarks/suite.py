@@ -0,0 +1,445 @@
+"""Benchmark suite of the capability subsystem.
+
+It generates a synthetic dataset (users, groups, agents, objects and
+reference chains), then measures latency and query count of the hot
+paths: `AgentMiddleware`, `ObjectListMixin.get_queryset`,
+`ObjectDetailMixin.get_object`, `Reference.derive`,
+`CapabilityQuerySet.get_or_create_many` and permission classes.
+
+Results are written as JSON, such as runs on different commits can be
+compared:
+
+    python -m fox.caps.benchmarks.suite --output before.json
+    git checkout other-branch
+    python -m fox.caps.benchmarks.suite --output after.json \\
+        --baseline before.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+
+from . import setup_django
+
+__all__ = (
+    "Dataset",
+    "benchmark",
+    "benchmarks",
+    "create_dataset",
+    "measure",
+    "run",
+    "compare",
+)
+
+
+ACTIONS = ("list", "retrieve", "update", "destroy")
+"""Actions assigned to root references."""
+
+
+class Dataset:
+    """Synthetic dataset used by benchmarks."""
+
+    def __init__(self, users, groups, agents, objects, refs):
+        self.users = users
+        """Users, whose first one is used for requests."""
+        self.groups = groups
+        self.agents = agents
+        """Agents by user or group."""
+        self.objects = objects
+        self.refs = refs
+        """All references."""
+
+    @property
+    def user(self):
+        """User used to run requests."""
+        return self.users[0]
+
+    @property
+    def agent(self):
+        """Default agent of `user`."""
+        return self.agents[self.user]
+
+
+def create_dataset(
+    users: int = 100,
+    groups: int = 10,
+    objects: int = 1000,
+    depth: int = 2,
+    fanout: int = 3,
+    seed: int = 0,
+) -> Dataset:
+    """Create a synthetic dataset.
+
+    Each user has a default agent and belongs to one group (that has an
+    agent too). Each object has a root reference for a random user's
+    agent, from which references chains of `depth` levels are derived,
+    each reference being derived to `fanout` random agents.
+    """
+    from django.contrib.auth.models import Group, User
+
+    from fox.caps.models import Agent, Capability
+    from fox.caps.tests.app.models import ConcreteObject, ConcreteReference
+
+    rand = random.Random(seed)
+    group_list = Group.objects.bulk_create(
+        Group(name="group_{}".format(i)) for i in range(groups)
+    )
+    user_list = User.objects.bulk_create(
+        User(username="user_{}".format(i)) for i in range(users)
+    )
+    through = User.groups.through
+    through.objects.bulk_create(
+        through(user_id=user.pk, group_id=group_list[i % groups].pk)
+        for i, user in enumerate(user_list)
+    )
+
+    agents = {user: Agent(user=user, is_default=True) for user in user_list}
+    agents.update((group, Agent(group=group)) for group in group_list)
+    Agent.objects.bulk_create(agents.values())
+    agent_list = list(agents.values())
+
+    object_list = ConcreteObject.objects.bulk_create(
+        ConcreteObject(name=str(i)) for i in range(objects)
+    )
+    names = [Capability.get_name(ConcreteObject, a) for a in ACTIONS]
+    capabilities = Capability.objects.get_or_create_many(
+        Capability(name=name, max_derive=depth) for name in names
+    )
+    refs = ConcreteReference.objects.bulk_create(
+        (
+            ConcreteReference(
+                receiver=agents[rand.choice(user_list)], target=obj
+            )
+            for obj in object_list
+        ),
+        capabilities=capabilities,
+    )
+
+    level, all_refs = refs, list(refs)
+    for _ in range(depth):
+        pks = [r.pk for r in level]
+        receivers = rand.sample(agent_list, min(fanout, len(agent_list)))
+        queryset = ConcreteReference.objects.filter(pk__in=pks)
+        level = queryset.derive_many(receivers)
+        all_refs.extend(level)
+    return Dataset(user_list, group_list, agents, object_list, all_refs)
+
+
+benchmarks = {}
+"""Registered benchmarks by name."""
+
+
+def benchmark(name: str):
+    """Register decorated function as a benchmark.
+
+    Function takes a `Dataset` and returns the callable to measure.
+    """
+
+    def decorator(func):
+        benchmarks[name] = func
+        return func
+
+    return decorator
+
+
+def measure(func, repeat: int = 20, warmup: int = 1) -> dict:
+    """Call `func` `repeat` times and return timings (in milliseconds)
+    and query count statistics.
+
+    :param warmup: calls run before measures, filling caches (``*.cold`` \
+        benchmarks reset them on each call).
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    for _ in range(warmup):
+        func()
+    timings, queries = [], []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(context.captured_queries))
+    return {
+        "repeat": repeat,
+        "min_ms": min(timings),
+        "median_ms": statistics.median(timings),
+        "mean_ms": statistics.mean(timings),
+        "max_ms": max(timings),
+        "queries": statistics.median_low(queries),
+        "max_queries": max(queries),
+    }
+
+
+def get_request(dataset: Dataset, **attrs):
+    """Return a GET request of dataset's user."""
+    from django.test import RequestFactory
+
+    request = RequestFactory().get("/")
+    request.user = dataset.user
+    request.COOKIES = {}
+    for key, value in attrs.items():
+        setattr(request, key, value)
+    return request
+
+
+@benchmark("middleware.cold")
+def bench_middleware_cold(dataset):
+    from fox.caps.cache import agent_cache
+    from fox.caps.middleware import AgentMiddleware
+
+    middleware = AgentMiddleware(lambda request: request.agent.pk)
+
+    def func():
+        agent_cache.invalidate([dataset.user.pk])
+        middleware(get_request(dataset))
+
+    return func
+
+
+@benchmark("middleware.warm")
+def bench_middleware_warm(dataset):
+    from fox.caps.middleware import AgentMiddleware
+
+    middleware = AgentMiddleware(lambda request: request.agent.pk)
+    return lambda: middleware(get_request(dataset))
+
+
+def get_view_middleware(view, func):
+    """Return `AgentMiddleware` setting request to view, then calling
+    ``func(view)``: agent is resolved as for actual requests."""
+    from fox.caps.middleware import AgentMiddleware
+
+    def get_response(request):
+        view.request = request
+        return func(view)
+
+    return AgentMiddleware(get_response)
+
+
+@benchmark("views.list")
+def bench_list(dataset, page_size=50):
+    from django.views.generic.list import MultipleObjectMixin
+
+    from fox.caps.tests.app.models import ConcreteObject
+    from fox.caps.views.mixins import ObjectListMixin
+
+    class View(ObjectListMixin, MultipleObjectMixin):
+        model = ConcreteObject
+
+    middleware = get_view_middleware(
+        View(),
+        lambda view: list(view.get_queryset().order_by("pk")[:page_size]),
+    )
+    return lambda: middleware(get_request(dataset))
+
+
+@benchmark("views.detail")
+def bench_detail(dataset):
+    from django.views.generic.detail import SingleObjectMixin
+
+    from fox.caps.tests.app.models import ConcreteObject
+    from fox.caps.views.mixins import ObjectDetailMixin
+
+    class View(ObjectDetailMixin, SingleObjectMixin):
+        model = ConcreteObject
+
+    refs = [r for r in dataset.refs if r.receiver_id == dataset.agent.pk]
+    refs = itertools.cycle(refs)
+    view = View()
+    middleware = get_view_middleware(view, lambda view: view.get_object())
+
+    def func():
+        view.kwargs = {"ref": next(refs).ref}
+        middleware(get_request(dataset))
+
+    return func
+
+
+@benchmark("reference.derive")
+def bench_derive(dataset):
+    refs = itertools.cycle([r for r in dataset.refs if r.depth == 0])
+    agents = itertools.cycle(dataset.agents.values())
+
+    def func():
+        ref, receiver = next(refs), next(agents)
+        if receiver.pk != ref.receiver_id:
+            ref.derive(receiver, update=True)
+
+    return func
+
+
+@benchmark("capability.get_or_create_many.cold")
+def bench_get_or_create_many_cold(dataset, count=20):
+    from fox.caps.models import Capability
+
+    counter = itertools.count()
+
+    def func():
+        Capability.registry.clear()
+        index = next(counter)
+        Capability.objects.get_or_create_many(
+            Capability(name="bench_{}_{}".format(index, i), max_derive=1)
+            for i in range(count)
+        )
+
+    return func
+
+
+@benchmark("capability.get_or_create_many.warm")
+def bench_get_or_create_many_warm(dataset, count=20):
+    from fox.caps.models import Capability
+
+    def func():
+        Capability.objects.get_or_create_many(
+            Capability(name="bench_{}".format(i), max_derive=1)
+            for i in range(count)
+        )
+
+    return func
+
+
+def _bench_permission(dataset, permission):
+    from fox.caps.cache import capability_cache
+    from fox.caps.tests.app.models import ConcreteObject
+
+    class View:
+        action = "retrieve"
+
+    objects = list(ConcreteObject.objects.receiver(dataset.agent)[:50])
+
+    def func():
+        with capability_cache() as cache:
+            request = get_request(dataset, capability_cache=cache)
+            for obj in objects:
+                permission.has_object_permission(request, View, obj)
+
+    return func
+
+
+@benchmark("permissions.is_allowed")
+def bench_is_allowed(dataset):
+    from fox.caps.models import Capability
+    from fox.caps.permissions import IsAllowed
+    from fox.caps.tests.app.models import ConcreteObject
+
+    name = Capability.get_name(ConcreteObject, "retrieve")
+    return _bench_permission(dataset, IsAllowed(name))
+
+
+@benchmark("permissions.is_action_allowed")
+def bench_is_action_allowed(dataset):
+    from fox.caps.permissions import IsActionAllowed
+
+    return _bench_permission(dataset, IsActionAllowed())
+
+
+def run(dataset: Dataset, names=None, repeat: int = 20) -> dict:
+    """Run benchmarks on dataset, returning results by benchmark name.
+
+    :param names: if provided, only run benchmarks with those names.
+    """
+    results = {}
+    for name, func in benchmarks.items():
+        if names and name not in names:
+            continue
+        results[name] = measure(func(dataset), repeat)
+    return results
+
+
+def compare(results: dict, baseline: dict) -> dict:
+    """Return ``{name: (median ratio, queries delta)}`` of results
+    against baseline ones, for benchmarks present in both."""
+    return {
+        name: (
+            result["median_ms"] / (baseline[name]["median_ms"] or 1),
+            result["queries"] - baseline[name]["queries"],
+        )
+        for name, result in results.items()
+        if name in baseline
+    }
+
+
+def get_metadata(args) -> dict:
+    """Return metadata describing the run environment."""
+    import django
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "dataset": {
+            "users": args.users,
+            "groups": args.groups,
+            "objects": args.objects,
+            "depth": args.depth,
+            "fanout": args.fanout,
+            "seed": args.seed,
+        },
+        "repeat": args.repeat,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--groups", type=int, default=10)
+    parser.add_argument("--objects", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--fanout", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--db", default=":memory:", help="SQLite database")
+    parser.add_argument("--only", nargs="*", help="benchmarks to run")
+    parser.add_argument("--output", help="JSON results file")
+    parser.add_argument("--baseline", help="JSON results to compare to")
+    args = parser.parse_args()
+
+    setup_django(args.db)
+    dataset = create_dataset(
+        args.users,
+        args.groups,
+        args.objects,
+        args.depth,
+        args.fanout,
+        args.seed,
+    )
+    results = run(dataset, args.only, args.repeat)
+    if args.output:
+        with open(args.output, "w") as stream:
+            data = {"meta": get_metadata(args), "results": results}
+            json.dump(data, stream, indent=2)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)["results"]
+    diff = compare(results, baseline)
+
+    print(
+        "{:<40} {:>10} {:>10} {:>8}".format(
+            "name", "median_ms", "queries", "ratio"
+        )
+    )
+    for name, result in results.items():
+        ratio = "{:.2f}".format(diff[name][0]) if name in diff else ""
+        print(
+            "{:<40} {:>10.3f} {:>10} {:>8}".format(
+                name, result["median_ms"], result["queries"], ratio
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
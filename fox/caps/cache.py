@@ -0,0 +1,240 @@
+"""Provide caches used by capabilities.
+
+- capability cache: request-scoped capability resolution cache, activated
+  for the duration of a request by `fox.caps.middleware.AgentMiddleware`
+  (or manually using `capability_cache()`). While active, references
+  capabilities are loaded from database at most once.
+- agent cache: users' agents and effective agent ids stored in Django's
+  cache framework.
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Union
+
+from django.core.cache import caches
+from django.db import router
+
+from .instrumentation import incr
+
+__all__ = (
+    "CapabilityCache",
+    "capability_cache",
+    "get_capability_cache",
+    "AgentCache",
+    "agent_cache",
+)
+
+
+_current_cache = ContextVar("fox.caps.capability_cache", default=None)
+
+
+class CapabilityCache:
+    """Cache capabilities resolution for capability sets.
+
+    Capabilities are stored by capability set's key (for references:
+    receiver, reference model and id), then by capability name.
+    """
+
+    def __init__(self):
+        self.sets = {}
+
+    def get_capabilities(self, capability_set) -> dict:
+        """Return capabilities of the provided set as a dict by name,
+        loading them if required."""
+        key = capability_set.get_cache_key()
+        if key is None:
+            return {c.name: c for c in capability_set.get_capabilities()}
+
+        capabilities = self.sets.get(key)
+        if capabilities is None:
+            incr("capability_cache.misses")
+            capabilities = {
+                c.name: c for c in capability_set.get_capabilities()
+            }
+            self.sets[key] = capabilities
+        else:
+            incr("capability_cache.hits")
+        return capabilities
+
+    def get_capability(self, capability_set, name: str):
+        """Return capability of set by name or None."""
+        return self.get_capabilities(capability_set).get(name)
+
+    async def aget_capabilities(self, capability_set) -> dict:
+        """Async version of `get_capabilities`."""
+        key = capability_set.get_cache_key()
+        capabilities = self.sets.get(key) if key is not None else None
+        if capabilities is None:
+            if key is not None:
+                incr("capability_cache.misses")
+            capabilities = {
+                c.name: c for c in await capability_set.aget_capabilities()
+            }
+            if key is not None:
+                self.sets[key] = capabilities
+        else:
+            incr("capability_cache.hits")
+        return capabilities
+
+    async def aget_capability(self, capability_set, name: str):
+        """Async version of `get_capability`."""
+        return (await self.aget_capabilities(capability_set)).get(name)
+
+    def discard(self, capability_set):
+        """Remove capability set from cache."""
+        key = capability_set.get_cache_key()
+        if key is not None:
+            self.sets.pop(key, None)
+
+    def clear(self):
+        """Remove all entries from cache."""
+        self.sets.clear()
+
+
+def get_capability_cache() -> Union[CapabilityCache, None]:
+    """Return current capability cache if any."""
+    return _current_cache.get()
+
+
+@contextmanager
+def capability_cache(cache: CapabilityCache = None):
+    """Activate a capability cache for the current context.
+
+    Example:
+
+        ```
+        with capability_cache() as cache:
+            reference.get_capability("action")
+        ```
+    """
+    if cache is None:
+        cache = CapabilityCache()
+    token = _current_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        _current_cache.reset(token)
+
+
+class AgentCache:
+    """Cache users' agents in Django cache framework.
+
+    Agents are stored as field values by user id (anonymous users under
+    ``None``), along with the user's effective agent ids (see
+    `fox.caps.models.AgentIds`). Entries are invalidated by
+    `fox.caps.receivers` when agents or users' groups change.
+    """
+
+    cache_alias = "default"
+    """Django cache alias."""
+    key_prefix = "fox.caps.agents"
+    timeout = 300
+    """Entries timeout in seconds."""
+    version = 1
+    """Entries format version, passed to Django's cache."""
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_key(self, user_id, kind: str = "") -> str:
+        """Return cache key for user id and entry kind."""
+        prefix = kind and "{}.{}".format(self.key_prefix, kind)
+        return "{}:{}".format(
+            prefix or self.key_prefix, user_id or "anonymous"
+        )
+
+    def get(self, user) -> Union[list, None]:
+        """Return user's agents or None if not in cache."""
+        values = self.cache.get(self.get_key(user.pk), version=self.version)
+        incr("agent_cache.misses" if values is None else "agent_cache.hits")
+        return self.from_values(values)
+
+    async def aget(self, user) -> Union[list, None]:
+        """Async version of `get`."""
+        values = await self.cache.aget(
+            self.get_key(user.pk), version=self.version
+        )
+        incr("agent_cache.misses" if values is None else "agent_cache.hits")
+        return self.from_values(values)
+
+    def set(self, user, agents):
+        """Store user's agents."""
+        values = self.to_values(agents)
+        self.cache.set(
+            self.get_key(user.pk), values, self.timeout, version=self.version
+        )
+
+    async def aset(self, user, agents):
+        """Async version of `set`."""
+        values = self.to_values(agents)
+        await self.cache.aset(
+            self.get_key(user.pk), values, self.timeout, version=self.version
+        )
+
+    def get_ids(self, user):
+        """Return user's effective agent ids as `AgentIds`, computing
+        and storing them if required."""
+        from .models import Agent, AgentIds
+
+        key = self.get_key(user.pk, "ids")
+        values = self.cache.get(key, version=self.version)
+        if values is None:
+            ids = Agent.objects.ids(user)
+            values = (tuple(ids), ids.default)
+            self.cache.set(key, values, self.timeout, version=self.version)
+            return ids
+        return AgentIds(*values)
+
+    async def aget_ids(self, user):
+        """Async version of `get_ids`."""
+        from .models import Agent, AgentIds
+
+        key = self.get_key(user.pk, "ids")
+        values = await self.cache.aget(key, version=self.version)
+        if values is None:
+            ids = await Agent.objects.aids(user)
+            values = (tuple(ids), ids.default)
+            await self.cache.aset(
+                key, values, self.timeout, version=self.version
+            )
+            return ids
+        return AgentIds(*values)
+
+    def invalidate(self, user_ids):
+        """Remove agents and agent ids of provided users ids from
+        cache."""
+        keys = [
+            self.get_key(pk, kind) for pk in user_ids for kind in ("", "ids")
+        ]
+        self.cache.delete_many(keys, version=self.version)
+
+    def to_values(self, agents) -> list[tuple]:
+        """Return stored values for agents."""
+        field_names = self.get_field_names()
+        return [
+            tuple(getattr(agent, name) for name in field_names)
+            for agent in agents
+        ]
+
+    def from_values(self, values) -> Union[list, None]:
+        """Return agents from stored values (None if values is None)."""
+        from .models import Agent
+
+        if values is None:
+            return None
+        db = router.db_for_read(Agent)
+        field_names = self.get_field_names()
+        return [Agent.from_db(db, field_names, row) for row in values]
+
+    def get_field_names(self) -> list[str]:
+        """Return stored Agent field names, in concrete fields order."""
+        from .models import Agent
+
+        return [f.attname for f in Agent._meta.concrete_fields]
+
+
+agent_cache = AgentCache()
+"""Default agent cache instance."""
@@ -0,0 +1,97 @@
+"""System checks of the capability application."""
+from django.apps import apps
+from django.core import checks
+from django.db import models
+
+from .models import Reference
+
+__all__ = (
+    "check_reference_indexes",
+    "get_migration_state",
+    "get_missing_indexes",
+)
+
+
+def get_migration_state():
+    """Return project state built from migrations files, and labels of
+    applications having migrations."""
+    from django.db.migrations.loader import MigrationLoader
+
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    return loader.project_state(), loader.migrated_apps
+
+
+def get_missing_indexes(model, model_state) -> list[tuple[str]]:
+    """Return fields of `model.index_fields` not indexed by migration's
+    model state."""
+    items = [index.fields for index in model_state.options.get("indexes", ())]
+    items.extend(model_state.options.get("unique_together", ()))
+    items.extend(model_state.options.get("index_together", ()))
+    items.extend(
+        constraint.fields
+        for constraint in model_state.options.get("constraints", ())
+        if isinstance(constraint, models.UniqueConstraint)
+        and constraint.condition is None
+    )
+    single = {
+        name
+        for name, field in model_state.fields.items()
+        if field.primary_key or field.unique or field.db_index
+    }
+
+    missing = []
+    for fields in model.index_fields:
+        fields = tuple(fields)
+        if len(fields) == 1 and fields[0] in single:
+            continue
+        if not any(tuple(item[: len(fields)]) == fields for item in items):
+            missing.append(fields)
+    return missing
+
+
+@checks.register(checks.Tags.models)
+def check_reference_indexes(app_configs=None, **kwargs):
+    """Warn about concrete Reference models whose migrations miss indexes
+    declared by `Reference.index_fields`.
+
+    Indexes are added to models by
+    `fox.caps.models.reference.ReferenceBase`: running ``makemigrations``
+    creates them. Applications without migrations are skipped.
+    """
+    if app_configs is None:
+        models = apps.get_models()
+    else:
+        models = (m for c in app_configs for m in c.get_models())
+    models = [m for m in models if issubclass(m, Reference)]
+    if not models:
+        return []
+
+    state, migrated_apps = get_migration_state()
+    errors = []
+    for model in models:
+        opts = model._meta
+        if opts.app_label not in migrated_apps:
+            continue
+        model_state = state.models.get((opts.app_label, opts.model_name))
+        if model_state is None:
+            errors.append(
+                checks.Warning(
+                    "Reference model has no migration.",
+                    hint="Run makemigrations.",
+                    obj=model,
+                    id="fox_caps.W002",
+                )
+            )
+            continue
+        for fields in get_missing_indexes(model, model_state):
+            errors.append(
+                checks.Warning(
+                    "Reference model migrations are missing an index on "
+                    "({}).".format(", ".join(fields)),
+                    hint="Run makemigrations, or add it to the model's "
+                    "Meta.indexes.",
+                    obj=model,
+                    id="fox_caps.W001",
+                )
+            )
+    return errors
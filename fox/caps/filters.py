@@ -0,0 +1,97 @@
+"""Provide Django Rest Framework filter backends to work with
+capabilities."""
+import uuid
+
+from django.http import Http404
+from rest_framework.filters import BaseFilterBackend
+
+__all__ = ("ReceiverFilterBackend", "ActionAllowedFilterBackend")
+
+
+class ReceiverFilterBackend(BaseFilterBackend):
+    """Scope objects to the ones referenced for request's agent,
+    prefetching their reference and its capabilities (see
+    `ObjectQuerySet.receiver`).
+
+    When view's lookup keyword argument is provided (detail routes),
+    objects are looked up by reference's ref instead (see
+    `ObjectQuerySet.refs`). Permission checks then read prefetched
+    references: the number of queries does not depend on the number of
+    objects.
+
+    Queryset model must be a subclass of `fox.caps.models.Object`. Agent
+    is retrieved from ``view.get_agent()`` if any, otherwise
+    ``request.agent``. Capabilities are not prefetched when reference
+    model uses its capability map, unless view's
+    ``prefetch_capabilities`` is True.
+    """
+
+    def get_agent(self, request, view):
+        """Return agent used to filter queryset."""
+        if hasattr(view, "get_agent"):
+            return view.get_agent()
+        return request.agent
+
+    def get_ref(self, request, view):
+        """Return reference's ref from view's keyword arguments or None.
+
+        :raises Http404: ref is not a valid UUID.
+        """
+        lookup_field = getattr(view, "lookup_field", None)
+        lookup = getattr(view, "lookup_url_kwarg", None) or lookup_field
+        kwargs = getattr(view, "kwargs", None) or {}
+        ref = kwargs.get(lookup) if lookup else None
+        if ref is None or isinstance(ref, uuid.UUID):
+            return ref
+        try:
+            return uuid.UUID(str(ref))
+        except ValueError as err:
+            raise Http404 from err
+
+    def get_prefetch_capabilities(self, queryset, view):
+        """Return True if references' capabilities must be prefetched."""
+        prefetch = getattr(view, "prefetch_capabilities", None)
+        if prefetch is None:
+            return not queryset.model.Reference.use_capability_map
+        return prefetch
+
+    def filter_queryset(self, request, queryset, view):
+        agent = self.get_agent(request, view)
+        capabilities = self.get_prefetch_capabilities(queryset, view)
+        ref = self.get_ref(request, view)
+        if ref is not None:
+            return queryset.refs(agent, [ref], capabilities)
+        return queryset.receiver(agent, capabilities)
+
+
+class ActionAllowedFilterBackend(BaseFilterBackend):
+    """Filter objects on which request's agent is allowed to run view's
+    action, in database (see `ObjectQuerySet.allowed`).
+
+    It is the queryset counterpart of
+    `fox.caps.permissions.IsActionAllowed`. Queryset model must be a
+    subclass of `fox.caps.models.Object`. Action is retrieved from
+    ``view.action`` (defaults to self's `action`). Agent is retrieved from
+    ``view.get_agent()`` if any, otherwise ``request.agent``.
+    """
+
+    action = None
+
+    def __init__(self, action=None):
+        if action:
+            self.action = action
+
+    def get_agent(self, request, view):
+        """Return agent used to filter queryset."""
+        if hasattr(view, "get_agent"):
+            return view.get_agent()
+        return request.agent
+
+    def filter_queryset(self, request, queryset, view):
+        # same fallback as `IsActionAllowed`: a view whose action is None
+        # is denied.
+        action = getattr(view, "action", self.action)
+        if action is None:
+            return queryset.none()
+        agent = self.get_agent(request, view)
+        return queryset.allowed(agent, action)
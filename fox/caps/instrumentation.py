@@ -0,0 +1,212 @@
+"""Instrumentation of capabilities resolution.
+
+While metrics are collected (see `collect_metrics`), hooks of
+`fox.caps` update counters and timers of the current `Metrics`:
+
+- ``references``: references loaded from database;
+- ``capability_checks``: permission capability checks;
+- ``capability_cache.hits``, ``capability_cache.misses``;
+- ``agent_cache.hits``, ``agent_cache.misses``;
+- ``queries`` and ``queries.<section>``: database queries, in total and
+  by timed section (``middleware``, ``permissions``, ``objects``,
+  ``derive``).
+
+`fox.caps.middleware.AgentMiddleware` collects metrics for each request
+when it has a `metrics_reporter` (see `Reporter` subclasses). Otherwise,
+hooks only cost a context variable lookup.
+
+Queries are counted on the database connections of the thread running
+them: async code must use `acollect_metrics`.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from collections import Counter, defaultdict
+from contextlib import (
+    ExitStack,
+    asynccontextmanager,
+    contextmanager,
+    nullcontext,
+)
+from contextvars import ContextVar
+from typing import Union
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+__all__ = (
+    "Metrics",
+    "collect_metrics",
+    "acollect_metrics",
+    "get_metrics",
+    "incr",
+    "timer",
+    "Reporter",
+    "LoggingReporter",
+    "HeaderReporter",
+    "CallbackReporter",
+)
+
+
+_current_metrics = ContextVar("fox.caps.metrics", default=None)
+
+
+class Metrics:
+    """Counters and timers (in milliseconds) collected during a request."""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.timers = defaultdict(float)
+        self.sections = []
+        """Stack of currently timed sections."""
+
+    def incr(self, name: str, count: int = 1):
+        """Increment counter `name` by `count`."""
+        self.counters[name] += count
+
+    @contextmanager
+    def timer(self, name: str):
+        """Time the block's execution under section `name`.
+
+        Queries run inside the block are counted for this section.
+        """
+        self.sections.append(name)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.timers[name] += (time.perf_counter() - start) * 1000
+            self.sections.pop()
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """Database execute wrapper counting queries."""
+        self.counters["queries"] += 1
+        if self.sections:
+            self.counters["queries." + self.sections[-1]] += 1
+        return execute(sql, params, many, context)
+
+    def as_dict(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "timers": {k: round(v, 3) for k, v in self.timers.items()},
+        }
+
+
+def get_metrics() -> Union[Metrics, None]:
+    """Return metrics being collected if any."""
+    return _current_metrics.get()
+
+
+@contextmanager
+def collect_metrics(metrics: Metrics = None):
+    """Collect metrics for the current context.
+
+    Example:
+
+        ```
+        with collect_metrics() as metrics:
+            list(MyObject.objects.receiver(agent))
+        print(metrics.as_dict())
+        ```
+    """
+    if metrics is None:
+        metrics = Metrics()
+    token = _current_metrics.set(metrics)
+    try:
+        with ExitStack() as stack:
+            _enter_execute_wrappers(stack, metrics)
+            yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+@asynccontextmanager
+async def acollect_metrics(metrics: Metrics = None):
+    """Async version of `collect_metrics`.
+
+    Async ORM calls run in the thread of thread sensitive `sync_to_async`,
+    whose connections are not the event loop's ones: queries are counted
+    on this thread's connections.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    token = _current_metrics.set(metrics)
+    try:
+        stack = ExitStack()
+        await sync_to_async(_enter_execute_wrappers)(stack, metrics)
+        try:
+            yield metrics
+        finally:
+            await sync_to_async(stack.close)()
+    finally:
+        _current_metrics.reset(token)
+
+
+def _enter_execute_wrappers(stack: ExitStack, metrics: Metrics):
+    """Install metrics' execute wrapper on current thread's connections."""
+    for connection in connections.all():
+        wrapper = connection.execute_wrapper(metrics.execute_wrapper)
+        stack.enter_context(wrapper)
+
+
+def incr(name: str, count: int = 1):
+    """Increment counter of current metrics, if any."""
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.incr(name, count)
+
+
+def timer(name: str):
+    """Return a context manager timing a section on current metrics (if
+    any)."""
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return nullcontext()
+    return metrics.timer(name)
+
+
+class Reporter:
+    """Report metrics collected for a request."""
+
+    def report(self, request, response, metrics: Metrics):
+        raise NotImplementedError("not implemented")
+
+
+class LoggingReporter(Reporter):
+    """Log request's metrics."""
+
+    logger = logging.getLogger("fox.caps.metrics")
+    level = logging.INFO
+
+    def report(self, request, response, metrics):
+        self.logger.log(
+            self.level,
+            "%s %s: %s",
+            request.method,
+            request.path,
+            json.dumps(metrics.as_dict()),
+        )
+
+
+class HeaderReporter(Reporter):
+    """Set request's metrics as JSON response header, only when
+    ``settings.DEBUG`` is True."""
+
+    header = "X-Caps-Metrics"
+
+    def report(self, request, response, metrics):
+        if settings.DEBUG and response is not None:
+            response[self.header] = json.dumps(metrics.as_dict())
+
+
+class CallbackReporter(Reporter):
+    """Call provided function with request, response and metrics."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def report(self, request, response, metrics):
+        self.callback(request, response, metrics)
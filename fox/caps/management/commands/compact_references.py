@@ -0,0 +1,46 @@
+"""Merge redundant references (see `ReferenceQuerySet.compact`).
+
+Merged references are deleted: their public ``ref`` no longer resolves,
+and capability tokens of their targets are revoked.
+"""
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from fox.caps.models import Reference
+
+
+class Command(BaseCommand):
+    help = (
+        "Merge redundant references of Reference models. Merged "
+        "references are deleted: their ref no longer resolves, and "
+        "capability tokens of their targets are revoked."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "models",
+            nargs="*",
+            help="Reference models labels (default: all).",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def get_models(self, labels):
+        if not labels:
+            return [m for m in apps.get_models() if issubclass(m, Reference)]
+        try:
+            models = [apps.get_model(label) for label in labels]
+        except (LookupError, ValueError) as err:
+            raise CommandError(str(err)) from err
+        for model in models:
+            if not issubclass(model, Reference):
+                raise CommandError(
+                    "{} is not a Reference model".format(model._meta.label)
+                )
+        return models
+
+    def handle(self, *args, models=None, batch_size=1000, **options):
+        for model in self.get_models(models):
+            count = model.objects.all().compact(batch_size=batch_size)
+            self.stdout.write(
+                "{}: {} references merged".format(model._meta.label, count)
+            )
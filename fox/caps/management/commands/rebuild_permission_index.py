@@ -0,0 +1,42 @@
+"""Repopulate permission index (see `PermissionIndexQuerySet.rebuild`)."""
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from fox.caps.models import PermissionIndex, Reference
+
+
+class Command(BaseCommand):
+    help = "Rebuild permission index of Reference models."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "models",
+            nargs="*",
+            help="Reference models labels (default: all using the index).",
+        )
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def get_models(self, labels):
+        if not labels:
+            return [
+                m
+                for m in apps.get_models()
+                if issubclass(m, Reference) and m.use_permission_index
+            ]
+        try:
+            models = [apps.get_model(label) for label in labels]
+        except (LookupError, ValueError) as err:
+            raise CommandError(str(err)) from err
+        for model in models:
+            if not issubclass(model, Reference):
+                raise CommandError(
+                    "{} is not a Reference model".format(model._meta.label)
+                )
+        return models
+
+    def handle(self, *args, models=None, chunk_size=1000, **options):
+        for model in self.get_models(models):
+            count = PermissionIndex.objects.rebuild(model, chunk_size)
+            self.stdout.write(
+                "{}: {} permissions indexed".format(model._meta.label, count)
+            )
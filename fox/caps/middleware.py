@@ -1,45 +1,168 @@
+from contextlib import nullcontext
+
+from asgiref.sync import (
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async,
+)
 from django.http import HttpRequest
+from django.utils.functional import SimpleLazyObject
 
-from .models import Agent, AgentQuerySet
+from .cache import agent_cache, capability_cache
+from .instrumentation import (
+    Metrics,
+    Reporter,
+    acollect_metrics,
+    collect_metrics,
+    timer,
+)
+from .models import Agent
 
 __all__ = ("AgentMiddleware",)
 
 
 class AgentMiddleware:
     """Fetch request user's active agent, and assign it to
-    ``request.agent``."""
+    ``request.agent``.
+
+    Agent is resolved lazily, only when ``request.agent`` is accessed.
+    User's agents are kept in `agent_cache`.
+
+    The middleware supports both sync and async requests. In async
+    context, agent is resolved using the async ORM by awaiting
+    ``request.aagent()``.
+
+    It also activates a capability cache for the request's duration,
+    assigned to ``request.capability_cache``.
+
+    When `metrics_reporter` is set, capability metrics are collected
+    for each request (see `fox.caps.instrumentation`), assigned to
+    ``request.caps_metrics`` and reported once response is returned.
+    """
+
+    sync_capable = True
+    async_capable = True
 
     agent_class = Agent
     """Agent model class to use."""
     agent_cookie_key = "fox.caps.agent"
     """Cookie used to get agent."""
+    agent_cache = agent_cache
+    """Cache of users' agents. If None, agents are always fetched from
+    database."""
+    metrics_reporter: Reporter = None
+    """If provided, collect and report requests' metrics."""
 
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request: HttpRequest):
-        agents = self.get_agents(request)
-        request.agent = self.get_agent(request, agents)
-        return self.get_response(request)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        request.agent = SimpleLazyObject(lambda: self.resolve_agent(request))
+        with self.collect_metrics(request) as metrics:
+            with capability_cache() as cache:
+                request.capability_cache = cache
+                response = self.get_response(request)
+        if metrics is not None:
+            self.metrics_reporter.report(request, response, metrics)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        request.agent = SimpleLazyObject(lambda: self.resolve_agent(request))
+        request.aagent = lambda: self.aresolve_agent(request)
+        if self.metrics_reporter is None:
+            return await self._aget_response(request)
+
+        request.caps_metrics = Metrics()
+        async with acollect_metrics(request.caps_metrics) as metrics:
+            response = await self._aget_response(request)
+        self.metrics_reporter.report(request, response, metrics)
+        return response
 
-    def get_agents(self, request: HttpRequest) -> AgentQuerySet:
-        """Return queryset for user's agents, ordered by ``-is_default``."""
-        return Agent.objects.user(request.user, strict=False).order_by(
+    async def _aget_response(self, request: HttpRequest):
+        """Return response, with an active capability cache."""
+        with capability_cache() as cache:
+            request.capability_cache = cache
+            return await self.get_response(request)
+
+    def collect_metrics(self, request: HttpRequest):
+        """Return context manager collecting request's metrics if there is
+        a `metrics_reporter`."""
+        if self.metrics_reporter is None:
+            return nullcontext()
+        request.caps_metrics = Metrics()
+        return collect_metrics(request.caps_metrics)
+
+    def resolve_agent(self, request: HttpRequest) -> Agent:
+        """Return request's agent, resolving it once."""
+        if not hasattr(request, "_cached_agent"):
+            with timer("middleware"):
+                agents = self.get_agents(request)
+                request._cached_agent = self.get_agent(request, agents)
+        return request._cached_agent
+
+    async def aresolve_agent(self, request: HttpRequest) -> Agent:
+        """Async version of `resolve_agent`."""
+        if not hasattr(request, "_cached_agent"):
+            with timer("middleware"):
+                agents = await self.aget_agents(request)
+                request._cached_agent = self.get_agent(request, agents)
+        return request._cached_agent
+
+    def get_agents(self, request: HttpRequest) -> list[Agent]:
+        """Return user's agents, ordered by ``-is_default``."""
+        cache = self.agent_cache
+        agents = cache.get(request.user) if cache else None
+        if agents is None:
+            agents = list(self.get_agents_queryset(request.user))
+            if cache:
+                cache.set(request.user, agents)
+        return agents
+
+    async def aget_agents(self, request: HttpRequest) -> list[Agent]:
+        """Async version of `get_agents`."""
+        user = await self.aget_user(request)
+        cache = self.agent_cache
+        agents = await cache.aget(user) if cache else None
+        if agents is None:
+            agents = [r async for r in self.get_agents_queryset(user)]
+            if cache:
+                await cache.aset(user, agents)
+        return agents
+
+    def get_agents_queryset(self, user):
+        """Return queryset of user's agents, ordered by ``-is_default``."""
+        return self.agent_class.objects.user(user, strict=False).order_by(
             "-is_default"
         )
 
-    def get_agent(self, request: HttpRequest, agents: AgentQuerySet) -> Agent:
+    async def aget_user(self, request: HttpRequest):
+        """Return request's user, loading it from session if required."""
+        if hasattr(request, "auser"):
+            return await request.auser()
+
+        def get_user():
+            # evaluate lazy user
+            request.user.is_anonymous
+            return request.user
+
+        # FIXME: request.auser() is only available since Django 5.0
+        return await sync_to_async(get_user)()
+
+    def get_agent(self, request: HttpRequest, agents: list[Agent]) -> Agent:
         """Return user's active agent."""
         cookie = request.COOKIES.get(self.agent_cookie_key)
         if cookie:
-            # we iterate over agents instead of fetching extra queryset
-            # this keeps cache for further operations.
-            agent = next((r for r in agents if r.ref == cookie), None)
+            agent = next((r for r in agents if str(r.ref) == cookie), None)
             if agent:
                 return agent
 
         if request.user.is_anonymous:
-            return next(agents, None)
+            return next(iter(agents), None)
 
         # agents are sorted such as default are first:
         # predicates order ensure that we return first on is_default
@@ -48,7 +171,7 @@ class AgentMiddleware:
             (
                 r
                 for r in agents
-                if agent.is_default or agent.user_id == request.user.id
+                if r.is_default or r.user_id == request.user.id
             ),
             None,
         )
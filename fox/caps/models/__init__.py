@@ -1,16 +1,27 @@
-from .agent import Agent, AgentQuerySet
+from .agent import Agent, AgentIds, AgentQuerySet, get_agents_filter
 from .capability import Capability, CapabilityQuerySet
-from .capability_set import CapabilitySet
+from .capability_set import (
+    CapabilitySet,
+    CapabilityValue,
+    FrozenCapabilitySet,
+)
 from .object import Object
+from .permission_index import PermissionIndex, PermissionIndexQuerySet
 from .reference import Reference, ReferenceQuerySet
 
 __all__ = (
     "Agent",
+    "AgentIds",
     "AgentQuerySet",
     "Capability",
     "CapabilityQuerySet",
     "CapabilitySet",
+    "CapabilityValue",
+    "FrozenCapabilitySet",
     "Object",
+    "PermissionIndex",
+    "PermissionIndexQuerySet",
     "Reference",
     "ReferenceQuerySet",
+    "get_agents_filter",
 )
@@ -1,14 +1,40 @@
 from __future__ import annotations
 
 import uuid
+from collections.abc import Iterable
+from typing import Union
 
 from django.contrib.auth.models import Group, User
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import Q
+from django.utils.functional import LazyObject
 from django.utils.translation import gettext_lazy as _
 
-__all__ = ("AgentQuerySet", "Agent")
+__all__ = ("AgentIds", "AgentQuerySet", "Agent", "get_agents_filter")
+
+
+class AgentIds(frozenset):
+    """Immutable set of agents' primary keys a user can act as.
+
+    It can be used directly in lookups such as ``receiver_id__in``.
+    """
+
+    default: Union[int, None] = None
+    """User's default agent primary key."""
+
+    def __new__(cls, ids: Iterable[int] = (), default: int = None):
+        obj = super().__new__(cls, ids)
+        obj.default = default
+        return obj
+
+    def __reduce__(self):
+        return (type(self), (tuple(self), self.default))
+
+    def __repr__(self):
+        return "{}({}, default={})".format(
+            type(self).__name__, sorted(self), self.default
+        )
 
 
 class AgentQuerySet(models.QuerySet):
@@ -26,10 +52,35 @@ class AgentQuerySet(models.QuerySet):
             Q(user=user) | Q(group__in=user.groups.all())
         ).distinct()
 
+    def ids(self, user: User) -> AgentIds:
+        """Return ids of all agents user can act as (non strict `user`).
+
+        Default agent is the user's one flagged as `is_default`.
+        """
+        items = self.user(user, strict=False).values_list("pk", "is_default")
+        return self._get_ids(items)
+
+    async def aids(self, user: User) -> AgentIds:
+        """Async version of `ids`."""
+        items = self.user(user, strict=False).values_list("pk", "is_default")
+        return self._get_ids([r async for r in items])
+
+    def _get_ids(self, items: Iterable[tuple[int, bool]]) -> AgentIds:
+        ids, default = [], None
+        for pk, is_default in items:
+            ids.append(pk)
+            if is_default and default is None:
+                default = pk
+        return AgentIds(ids, default)
+
     def group(self, group: Group) -> AgentQuerySet:
         """Filter by group."""
         return self.filter(group=group)
 
+    def members(self, group: Group) -> AgentQuerySet:
+        """Filter user agents of group's members."""
+        return self.filter(user__groups=group)
+
 
 class Agent(models.Model):
     """An agent is the one that actually execute an action.
@@ -67,3 +118,31 @@ class Agent(models.Model):
                 _("Agent can be set as default only when " "targeting user.")
             )
         super().clean()
+
+
+IntoAgents = Union[Agent, AgentQuerySet, Iterable[Agent], Iterable[int], None]
+"""Agents accepted by `get_agents_filter`."""
+
+
+def get_agents_filter(field: str, agents: IntoAgents) -> Q:
+    """Return a lookup on `field` (foreign key to Agent) matching agents.
+
+    :param agents: single Agent (possibly lazy, such as \
+        ``request.agent``), `AgentQuerySet`, iterable of agents or agent \
+        ids (such as `AgentIds`), or None (matching nothing).
+    """
+    # lazy objects proxy `__class__`: checked first as they also proxy
+    # `__iter__`.
+    if isinstance(agents, Agent):
+        return Q(**{field: agents.pk})
+    if isinstance(agents, models.QuerySet):
+        return Q(**{field + "__in": agents})
+    if isinstance(agents, AgentIds):
+        return Q(**{field + "_id__in": agents})
+    if agents is None or isinstance(agents, LazyObject) and not agents:
+        # no agent, e.g. a lazy request's agent resolved to None
+        return Q(pk__in=[])
+    if isinstance(agents, Iterable):
+        ids = [getattr(r, "pk", r) for r in agents]
+        return Q(**{field + "_id__in": ids})
+    return Q(**{field: agents})
@@ -1,53 +1,184 @@
 from __future__ import annotations
 
 import functools
-import operator
+import threading
+from collections import OrderedDict
 from collections.abc import Iterable
 from typing import Union
 
 from asgiref.sync import sync_to_async
 from django.core.exceptions import PermissionDenied
 from django.db import models, transaction
-from django.db.models import Q
 from django.utils.translation import gettext as __
 from django.utils.translation import gettext_lazy as _
 
-__all__ = ("CapabilityQuerySet", "Capability")
+__all__ = ("CapabilityRegistry", "CapabilityQuerySet", "Capability")
+
+
+class CapabilityRegistry:
+    """Process-wide registry of saved capabilities' primary keys, by
+    database alias, name and max_derive.
+
+    Capability rows are immutable ``(name, max_derive)`` couples: once
+    known, their primary key can be reused without database access. The
+    registry is bounded to `max_size` items (least recently used are
+    discarded first).
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, using: str, name: str, max_derive: int):
+        """Return capability's primary key or None."""
+        key = (using, name, max_derive)
+        with self.lock:
+            pk = self.items.get(key)
+            if pk is not None:
+                self.items.move_to_end(key)
+            return pk
+
+    def resolve(
+        self, using: str, items: Iterable[Capability]
+    ) -> list[Capability]:
+        """Assign primary key to items found in registry.
+
+        :return items missing from the registry.
+        """
+        missing = []
+        for item in items:
+            if item.pk is None:
+                item.pk = self.get(using, item.name, item.max_derive)
+                if item.pk is None:
+                    missing.append(item)
+        return missing
+
+    def add(self, using: str, items: Iterable[Capability]):
+        """Register saved capabilities."""
+        with self.lock:
+            for item in items:
+                if item.pk is None:
+                    continue
+                key = (using, item.name, item.max_derive)
+                self.items[key] = item.pk
+                self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def discard(self, using: str, name: str, max_derive: int):
+        """Remove a capability from registry."""
+        with self.lock:
+            self.items.pop((using, name, max_derive), None)
+
+    def clear(self):
+        """Remove all items from registry."""
+        with self.lock:
+            self.items.clear()
 
 
 class CapabilityQuerySet(models.QuerySet):
-    def _get_items_queryset(self, items) -> Union[models.QuerySet, None]:
-        """Get or create capabilities from database."""
-        q_objects = (Q(name=r.name, max_derive=r.max_derive) for r in items)
-        query = functools.reduce(operator.or_, q_objects)
-        return self.filter(query)
+    def _get_items_queryset(self, items) -> models.QuerySet:
+        """Return queryset of capabilities having items' names.
+
+        It may return capabilities of other `max_derive`: callers match
+        ``(name, max_derive)`` couples themselves, which keeps the query
+        size linear whatever the items count.
+        """
+        return self.filter(name__in={r.name for r in items})
 
     def get_or_create_many(
         self, items: Iterable[Capability]
-    ) -> models.Queryset:
+    ) -> list[Capability]:
         """Retrieve capabilities from database, create it if missing.
 
-        Subset's items are updated.
+        Primary keys are first looked up in `Capability.registry`, such as
+        no database access is done when all items are known. Missing ones
+        are upserted then fetched in two queries, whatever their count: it
+        is safe when concurrent callers create the same capabilities.
+
+        :return provided items, updated with their primary key.
         """
+        items = list(items) if items else []
         if not items:
-            return self.none()
-
-        queryset = self._get_items_queryset(items)
-        # force queryset to use a different cache, in order to return it
-        # unevaluated
-        names = {r.name for r in queryset.all()}
-        missing = (item for item in items if item.name not in names)
-        with transaction.atomic(queryset.db):
-            Capability.objects.bulk_create(missing)
-        return queryset
-
-    # FIXME: awaits for django.transaction async support
+            return items
+
+        registry = self.model.registry
+        missing = registry.resolve(self.db, items)
+        if missing:
+            self._upsert_many(missing)
+            transaction.on_commit(
+                functools.partial(registry.add, self.db, missing),
+                using=self.db,
+            )
+        for item in items:
+            item._state.adding = False
+            item._state.db = self.db
+        return items
+
+    def _upsert_many(self, items: list[Capability]):
+        """Insert capabilities ignoring existing ones, then fetch them in
+        order to assign items' primary key."""
+        by_key = {}
+        for item in items:
+            by_key.setdefault((item.name, item.max_derive), []).append(item)
+
+        capabilities = [
+            self.model(name=name, max_derive=max_derive)
+            for name, max_derive in by_key
+        ]
+        self.model.objects.using(self.db).bulk_create(
+            capabilities, ignore_conflicts=True
+        )
+        queryset = self._get_items_queryset(capabilities)
+        for name, max_derive, pk in queryset.values_list(
+            "name", "max_derive", "pk"
+        ):
+            for item in by_key.get((name, max_derive), ()):
+                item.pk = pk
+
     async def aget_or_create_many(
         self, items: Iterable[Capability]
-    ) -> models.Queryset:
+    ) -> list[Capability]:
         """Async version of `get_or_create_many`."""
-        func = sync_to_async(self.get_or_create_many)
-        return await func(items)
+        items = list(items) if items else []
+        if not items:
+            return items
+
+        registry = self.model.registry
+        missing = registry.resolve(self.db, items)
+        if missing:
+            await self._aupsert_many(missing)
+            # async ORM calls run on the caller's thread (thus may be in
+            # its atomic block): register only once committed.
+            await sync_to_async(transaction.on_commit)(
+                functools.partial(registry.add, self.db, missing),
+                using=self.db,
+            )
+        for item in items:
+            item._state.adding = False
+            item._state.db = self.db
+        return items
+
+    async def _aupsert_many(self, items: list[Capability]):
+        """Async version of `_upsert_many`."""
+        by_key = {}
+        for item in items:
+            by_key.setdefault((item.name, item.max_derive), []).append(item)
+
+        capabilities = [
+            self.model(name=name, max_derive=max_derive)
+            for name, max_derive in by_key
+        ]
+        await self.model.objects.using(self.db).abulk_create(
+            capabilities, ignore_conflicts=True
+        )
+        queryset = self._get_items_queryset(capabilities)
+        async for name, max_derive, pk in queryset.values_list(
+            "name", "max_derive", "pk"
+        ):
+            for item in by_key.get((name, max_derive), ()):
+                item.pk = pk
 
 
 class Capability(models.Model):
@@ -68,13 +199,20 @@ class Capability(models.Model):
 
     objects = CapabilityQuerySet.as_manager()
 
+    registry = CapabilityRegistry()
+    """Registry of saved capabilities used by `get_or_create_many()`."""
+
     class Meta:
         unique_together = (("name", "max_derive"),)
 
     @staticmethod
     def get_name(model, action):
-        """Return capability name for a specific model and action."""
-        return model._meta.db_alias + "_" + action
+        """Return capability name for a specific model and action.
+
+        Capabilities are assigned to model specific references, thus
+        model's name is enough to scope them.
+        """
+        return model._meta.model_name + "_" + action
 
     @classmethod
     def into(cls, value: IntoValue):
@@ -129,3 +267,6 @@ class Capability(models.Model):
         if self.pk and other.pk:
             return self.pk == other.pk
         return self.name == other.name and self.max_derive == other.max_derive
+
+    def __hash__(self):
+        return hash((self.name, self.max_derive))
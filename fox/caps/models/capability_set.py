@@ -1,19 +1,29 @@
 from __future__ import annotations
 
-from collections.abc import Iterable
-from typing import Union
+from collections.abc import Iterable, Mapping
+from types import MappingProxyType
+from typing import NamedTuple, Union
 
 from django.core.exceptions import PermissionDenied
+from django.db import models
 from django.utils.translation import gettext as __
 
+from ..cache import get_capability_cache
 from .capability import Capability
 
-__all__ = ("BaseCapabilitySet", "CapabilitySet")
+__all__ = (
+    "BaseCapabilitySet",
+    "CapabilitySet",
+    "CapabilityValue",
+    "FrozenCapabilitySet",
+)
 
 
 class BaseCapabilitySet:
     """Base class to handle set of capabilities."""
 
+    __slots__ = ()
+
     DeriveItems: Capability.IntoValue
     """Type from which set can be derived from."""
     capabilities = None
@@ -21,13 +31,62 @@ class BaseCapabilitySet:
     def get_capabilities(self):
         return self.capabilities
 
+    async def aget_capabilities(self):
+        """Async version of `get_capabilities`."""
+        return self.get_capabilities()
+
+    def get_cache_key(self):
+        """Return key used by `fox.caps.cache.CapabilityCache`, or None
+        when set can not be cached."""
+        return None
+
     # TODO: test
     def get_capability(self, name: str) -> Union[Capability, None]:
-        """Get capability by name or None."""
+        """Get capability by name or None.
+
+        Use current capability cache when there is one.
+        """
+        cache = get_capability_cache()
+        if cache is not None and self.get_cache_key() is not None:
+            return cache.get_capability(self, name)
         return next(
             (r for r in self.get_capabilities() if r.name == name), None
         )
 
+    async def aget_capability(self, name: str) -> Union[Capability, None]:
+        """Async version of `get_capability`."""
+        cache = get_capability_cache()
+        if cache is not None and self.get_cache_key() is not None:
+            return await cache.aget_capability(self, name)
+        return next(
+            (r for r in await self.aget_capabilities() if r.name == name),
+            None,
+        )
+
+    def get_token(
+        self,
+        target,
+        receiver: int = None,
+        depth: int = 0,
+        expires: int = None,
+        signer=None,
+    ) -> str:
+        """Return a signed capability token for this set's capabilities
+        (see `fox.caps.tokens`).
+
+        :param target: target object.
+        :param receiver: receiver agent's primary key.
+        :param depth: references' chain depth.
+        :param expires: token lifetime in seconds.
+        :param signer: `TokenSigner` (defaults to `token_signer`).
+        """
+        if signer is None:
+            from ..tokens import token_signer as signer
+
+        return signer.sign(
+            target, self.get_capabilities(), receiver, depth, expires
+        )
+
     def is_derived(self, other: BaseCapabilitySet) -> bool:
         """Return True if `capabilities` iterable is a subset of self.
 
@@ -44,6 +103,15 @@ class BaseCapabilitySet:
                 return False
         return True
 
+    def derive_items(self, items: DeriveItems = None) -> list[Capability]:
+        """Return capabilities derived from this set using provided
+        optionnal iterator, without saving them.
+
+        If `items` is not provided, derive capabilities from self, without
+        allowing them to be shared.
+        """
+        return self._derive_items(self.get_capabilities(), items)
+
     def derive_caps(self, items: DeriveItems = None) -> list[Capability]:
         """Derive all capabilities from this set using provided optionnal
         iterator.
@@ -52,27 +120,26 @@ class BaseCapabilitySet:
         allowing them to be shared.
         :return an array of saved Capability instances.
         """
-        if items is None:
-            items = [
-                r.derive(max_derive=0)
-                for r in self.get_capabilities()
-                if r.can_derive(0)
-            ]
-        else:
-            items = self._derive_caps(self.get_capabilities(), items)
+        items = [Capability.into(item) for item in self.derive_items(items)]
         return Capability.objects.get_or_create_many(items) if items else None
 
-    # async def aderive_caps(self, items: DeriveItems = None)
-    #       -> list[Capability]:
-    #     """
-    #     Async version of `derive_caps`.
-    #     """
-    #     if items is None:
-    #         items = [r.derive(max_derive=0) for r in self.get_capabilities()
-    #                  if r.can_derive(0)]
-    #     else:
-    #         items = self._derive_caps(self.get_capabilities(), items)
-    #     return Capability.objects.get_or_create_many(items)
+    async def aderive_caps(
+        self, items: DeriveItems = None
+    ) -> list[Capability]:
+        """Async version of `derive_caps`."""
+        items = self._derive_items(await self.aget_capabilities(), items)
+        if not items:
+            return None
+        items = [Capability.into(item) for item in items]
+        return await Capability.objects.aget_or_create_many(items)
+
+    def _derive_items(
+        self, source: Iterable[Capability], items: DeriveItems = None
+    ) -> list[Capability]:
+        """Derive items from `source` capabilities (see `derive_items`)."""
+        if items is None:
+            return [r.derive(max_derive=0) for r in source if r.can_derive(0)]
+        return self._derive_caps(source, items)
 
     def _derive_caps(
         self, source: Iterable[Capability], items: DeriveItems
@@ -113,11 +180,174 @@ class CapabilitySet(BaseCapabilitySet):
         return type(self)(capabilities, **init_kwargs)
 
     async def aderive(
-        self, items: Capability.DeriveItems = None, **init_kwargs
+        self, items: BaseCapabilitySet.DeriveItems = None, **init_kwargs
     ) -> CapabilitySet:
         """Async version of `derive`."""
         capabilities = await self.aderive_caps(items)
-        # capabilities = await Capability.objects \
-        #                                .abulk_create_many(capabilities)
-        # capabilities = (r async for r in capabilities)
         return type(self)(capabilities, **init_kwargs)
+
+
+class CapabilityValue(NamedTuple):
+    """Lightweight, immutable and hashable capability, not bound to
+    database.
+
+    It follows `Capability` derivation rules, and can be provided where a
+    `Capability.IntoValue` is expected.
+    """
+
+    name: str
+    max_derive: int = 0
+
+    @classmethod
+    def into(cls, value: Capability.IntoValue) -> CapabilityValue:
+        """Return a CapabilityValue based on value (see
+        `Capability.into`)."""
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, (list, tuple)):
+            return cls(value[0], value[1])
+        if isinstance(value, Capability):
+            return cls(value.name, value.max_derive)
+        if isinstance(value, str):
+            return cls(value, 0)
+        raise NotImplementedError("Provided values are not supported")
+
+    def can_derive(self, max_derive: Union[None, int] = None) -> bool:
+        """Return True if this capability can be derived."""
+        return self.max_derive > 0 and (
+            max_derive is None or max_derive < self.max_derive
+        )
+
+    def is_derived(self, capability: CapabilityValue) -> bool:
+        """Return True if `capability` is derived from this one."""
+        return self.name == capability.name and self.can_derive(
+            capability.max_derive
+        )
+
+    def derive(self, max_derive: Union[None, int] = None) -> CapabilityValue:
+        """Derive a new capability value from self."""
+        if not self.can_derive(max_derive):
+            raise PermissionDenied(
+                __("can not derive capability {name}").format(name=self.name)
+            )
+        if max_derive is None:
+            max_derive = self.max_derive - 1
+        return CapabilityValue(self.name, max_derive)
+
+
+class FrozenCapabilitySet(BaseCapabilitySet):
+    """Immutable set of capabilities, stored as a mapping of
+    ``{name: max_derive}``.
+
+    Lookups by name are done in constant time, derivation checks in
+    linear time. It can be built from database rows without
+    instantiating `Capability` models (see `from_queryset`).
+
+    Sets are hashable and compared by value. Capabilities are provided as
+    `CapabilityValue`.
+    """
+
+    __slots__ = ("_map", "_hash")
+
+    def __init__(self, items: Iterable[Capability.IntoValue] = ()):
+        items = (CapabilityValue.into(item) for item in items)
+        self._set_map(self._get_map(items))
+
+    def _set_map(self, capability_map: dict):
+        self._map = MappingProxyType(capability_map)
+        self._hash = None
+
+    @staticmethod
+    def _get_map(values: Iterable[tuple[str, int]]) -> dict:
+        """Return ``{name: max_derive}`` dict from values, keeping the
+        highest `max_derive` of each name."""
+        capability_map = {}
+        for name, max_derive in values:
+            if capability_map.get(name, -1) < max_derive:
+                capability_map[name] = max_derive
+        return capability_map
+
+    @classmethod
+    def from_map(cls, capability_map: Mapping[str, int]):
+        """Create set from a ``{name: max_derive}`` mapping (such as
+        `Reference.capability_map`)."""
+        obj = cls.__new__(cls)
+        obj._set_map(dict(capability_map))
+        return obj
+
+    @classmethod
+    def from_values(cls, values: Iterable[tuple[str, int]]):
+        """Create set from ``(name, max_derive)`` rows."""
+        obj = cls.__new__(cls)
+        obj._set_map(cls._get_map(values))
+        return obj
+
+    @classmethod
+    def from_queryset(cls, queryset: models.QuerySet):
+        """Create set from a `Capability` queryset, fetching only names and
+        max_derive values."""
+        return cls.from_values(queryset.values_list("name", "max_derive"))
+
+    @property
+    def capabilities(self):
+        return [CapabilityValue(*item) for item in self._map.items()]
+
+    @property
+    def map(self) -> Mapping[str, int]:
+        """Read-only ``{name: max_derive}`` mapping."""
+        return self._map
+
+    def get_capability(self, name: str) -> Union[CapabilityValue, None]:
+        """Get capability by name or None."""
+        max_derive = self._map.get(name)
+        if max_derive is None:
+            return None
+        return CapabilityValue(name, max_derive)
+
+    def is_derived(self, other: BaseCapabilitySet) -> bool:
+        if isinstance(other, FrozenCapabilitySet):
+            items = other._map.items()
+        else:
+            items = ((c.name, c.max_derive) for c in other.get_capabilities())
+        get = self._map.get
+        for name, max_derive in items:
+            parent = get(name)
+            if parent is None or not (0 < parent and max_derive < parent):
+                return False
+        return True
+
+    def derive(self, items: BaseCapabilitySet.DeriveItems = None):
+        """Derive a new set from self, without accessing database (see
+        `derive_items`)."""
+        return type(self)(self.derive_items(items))
+
+    def issubset(self, other: FrozenCapabilitySet) -> bool:
+        """Return True if all capabilities of self are in `other` with a
+        greater or equal `max_derive`."""
+        get = other._map.get
+        return all(
+            get(name, -1) >= max_derive
+            for name, max_derive in self._map.items()
+        )
+
+    def __len__(self):
+        return len(self._map)
+
+    def __iter__(self):
+        return (CapabilityValue(*item) for item in self._map.items())
+
+    def __contains__(self, name: str):
+        return name in self._map
+
+    def __eq__(self, other):
+        if not isinstance(other, FrozenCapabilitySet):
+            return NotImplemented
+        return self._map == other._map
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(self._map.items()))
+        return self._hash
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, dict(self._map))
@@ -1,19 +1,27 @@
 from __future__ import annotations
 
 from collections.abc import Iterable
+from typing import Union
 from uuid import UUID
 
 from django.db import models
-from django.db.models import OuterRef, Prefetch, Subquery
+from django.db.models import Exists, OuterRef, Prefetch
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
+from ..instrumentation import timer
 from .agent import Agent
+from .capability import Capability
+from .permission_index import PermissionIndex
 from .reference import Reference
 
 __all__ = ("ObjectBase", "ObjectQuerySet", "Object")
 
 
+IntoReceivers = Union[Agent, Iterable[Agent], Iterable[int]]
+"""Receivers accepted by `ObjectQuerySet` methods."""
+
+
 class ObjectBase(models.base.ModelBase):
     """Metaclass for Object model classes.
 
@@ -76,35 +84,117 @@ class ObjectBase(models.base.ModelBase):
 class ObjectQuerySet(models.QuerySet):
     """QuerySet for Objects."""
 
-    def receiver(self, receiver: Agent) -> ObjectQuerySet:
-        """Filter object for provided."""
-        refs = self.models.Reference.objects.receiver(receiver)
-        return self._select_references(refs)
+    def receiver(
+        self, receiver: IntoReceivers, capabilities: bool = True
+    ) -> ObjectQuerySet:
+        """Filter object for provided receiver.
+
+        When multiple receivers are provided, only one reference per
+        object is selected (see `ReferenceQuerySet.best`).
+
+        :param receiver: references' receiver, or receivers (see \
+            `ReferenceQuerySet.receiver`).
+        :param bool capabilities: prefetch references' capabilities
+        """
+        refs = self.model.Reference.objects.receiver(receiver)
+        return self._select_references(refs, capabilities)
 
-    def ref(self, receiver: Agent, ref: UUID) -> ObjectQuerySet:
+    def ref(
+        self, receiver: IntoReceivers, ref: UUID, capabilities: bool = True
+    ) -> ObjectQuerySet:
         """Return reference for provided receiver and ref."""
         refs = self.model.Reference.objects.refs(receiver, [ref])
-        return self._select_references(refs).get()
+        return self._select_references(refs, capabilities).get()
 
-    def refs(self, receiver: Agent, refs: Iterable[UUID]) -> ObjectQuerySet:
+    def refs(
+        self,
+        receiver: IntoReceivers,
+        refs: Iterable[UUID],
+        capabilities: bool = True,
+    ) -> ObjectQuerySet:
         """Return references for provided receiver and refs."""
         refs = self.model.Reference.objects.refs(receiver, refs)
-        return self._select_references(refs)
+        return self._select_references(refs, capabilities)
+
+    def _fetch_all(self):
+        with timer("objects"):
+            super()._fetch_all()
+
+    def allowed(
+        self,
+        receiver: IntoReceivers,
+        action: Union[str, Iterable[str]],
+    ) -> ObjectQuerySet:
+        """Filter objects on which receiver has a capability.
+
+        Check is done in database using an ``EXISTS`` subquery over
+        references (see `ReferenceQuerySet.capabilities`). When reference
+        model's `use_permission_index` is True, a single lookup on
+        `PermissionIndex` is used instead.
+
+        :param receiver: references' receiver, or receivers (see \
+            `ReferenceQuerySet.receiver`).
+        :param action: action name (capability name is then given by \
+            `Capability.get_name`), or capability names: objects matching \
+            any of them are kept.
+        """
+        if isinstance(action, str):
+            names = [Capability.get_name(self.model, action)]
+        else:
+            names = list(action)
+        if self.model.Reference.use_permission_index:
+            rows = PermissionIndex.objects.using(self.db).lookup(
+                receiver, self.model, names
+            )
+            return self.filter(pk__in=rows.values("target_id"))
+        refs = self.model.Reference.objects.capabilities(receiver, names)
+        return self.filter(Exists(refs.filter(target=OuterRef("pk"))))
+
+    async def areceiver(
+        self, receiver: IntoReceivers, capabilities: bool = True
+    ) -> list[Object]:
+        """Async version of `receiver`, returning a list of objects."""
+        return [r async for r in self.receiver(receiver, capabilities)]
+
+    async def aref(
+        self, receiver: IntoReceivers, ref: UUID, capabilities: bool = True
+    ) -> Object:
+        """Async version of `ref`."""
+        refs = self.model.Reference.objects.refs(receiver, [ref])
+        return await self._select_references(refs, capabilities).aget()
+
+    async def arefs(
+        self,
+        receiver: IntoReceivers,
+        refs: Iterable[UUID],
+        capabilities: bool = True,
+    ) -> list[Object]:
+        """Async version of `refs`, returning a list of objects."""
+        return [r async for r in self.refs(receiver, refs, capabilities)]
 
     def _select_references(
-        self, refs_queryset: models.QuerySet
+        self, refs_queryset: models.QuerySet, capabilities: bool = True
     ) -> ObjectQuerySet:
-        """Add references prefetch for objects."""
+        """Add references prefetch for objects.
+
+        Only the best reference of each object is prefetched (see
+        `ReferenceQuerySet.best`). When `capabilities` is True,
+        references' capabilities are prefetched too: objects, references
+        and capabilities are then loaded in a fixed number of queries.
+        """
         fk_field = self.model.Reference._meta.get_field("target")
         lookup = fk_field.remote_field.get_accessor_name()
-        prefetch = Prefetch(lookup, refs_queryset, "_agent_reference_set")
+        prefetch_queryset = refs_queryset.best()
+        if capabilities:
+            prefetch_queryset = prefetch_queryset.prefetch_related(
+                "capabilities"
+            )
+        prefetch = Prefetch(lookup, prefetch_queryset, "_agent_reference_set")
 
-        refs = refs_queryset.filter(target=OuterRef("pk"))
-        return (
-            self.annotate(reference_id=Subquery(refs.values("id")[:1]))
-            .exclude(reference_id__isnull=True)
-            .prefetch_related(prefetch)
-        )
+        # semi-join: planners resolve it from the receiver index instead
+        # of running a correlated subquery per object row.
+        refs = refs_queryset.values("target_id")
+        return self.filter(pk__in=refs).prefetch_related(prefetch)
 
 
 class Object(models.Model, metaclass=ObjectBase):
@@ -131,6 +221,5 @@ class Object(models.Model, metaclass=ObjectBase):
     def reference(self):
         """Return Reference to this object for receiver provided to
         ObjectQuerySet's `ref()` or `refs()`."""
-        return (
-            self._agent_reference_set and self._agent_reference_set[0] or None
-        )
+        refs = getattr(self, "_agent_reference_set", None)
+        return refs[0] if refs else None
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
+from typing import Union
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction
+from django.utils.translation import gettext_lazy as _
+
+from .agent import Agent, IntoAgents, get_agents_filter
+from .capability_set import CapabilityValue
+
+__all__ = ("PermissionIndexQuerySet", "PermissionIndex")
+
+
+class PermissionIndexQuerySet(models.QuerySet):
+    """QuerySet for PermissionIndex."""
+
+    def agent(self, agents: IntoAgents) -> PermissionIndexQuerySet:
+        """Rows of the provided agent(s) (see `get_agents_filter`)."""
+        return self.filter(get_agents_filter("agent", agents))
+
+    def target_model(self, model) -> PermissionIndexQuerySet:
+        """Rows targeting objects of the provided model."""
+        content_type = ContentType.objects.db_manager(self.db).get_for_model(
+            model, for_concrete_model=False
+        )
+        return self.filter(content_type=content_type)
+
+    def lookup(
+        self,
+        agents: IntoAgents,
+        model,
+        names: Iterable[str],
+    ) -> PermissionIndexQuerySet:
+        """Rows of agent(s) having any of the capabilities names on objects
+        of model. Lookup is resolved by the unique index."""
+        return self.agent(agents).target_model(model).filter(name__in=names)
+
+    def get_capability(
+        self,
+        agents: IntoAgents,
+        obj,
+        name: str,
+    ) -> Union[CapabilityValue, None]:
+        """Return capability of agent(s) on object by name, or None."""
+        max_derive = (
+            self.lookup(agents, type(obj), [name])
+            .filter(target_id=obj.pk)
+            .aggregate(max_derive=models.Max("max_derive"))["max_derive"]
+        )
+        if max_derive is None:
+            return None
+        return CapabilityValue(name, max_derive)
+
+    def refresh(
+        self,
+        reference_model,
+        targets: Iterable[int],
+        receivers: Iterable[int] = None,
+    ) -> int:
+        """Recompute rows from references of `reference_model`, for the
+        provided target ids, and receiver ids when provided.
+
+        Existing rows are replaced by effective capabilities (see
+        `ReferenceQuerySet.effective_capabilities`) of those references,
+        using three queries.
+
+        :return the number of inserted rows.
+        """
+        targets = list(targets)
+        if not targets:
+            return 0
+        model = reference_model._meta.get_field("target").related_model
+        content_type = ContentType.objects.db_manager(self.db).get_for_model(
+            model, for_concrete_model=False
+        )
+        rows = self.filter(content_type=content_type, target_id__in=targets)
+        refs = reference_model.objects.using(self.db).filter(
+            target_id__in=targets
+        )
+        if receivers is not None:
+            receivers = list(receivers)
+            rows = rows.filter(agent_id__in=receivers)
+            refs = refs.filter(receiver_id__in=receivers)
+
+        with transaction.atomic(using=self.db):
+            rows._raw_delete(self.db)
+            items = [
+                self.model(
+                    agent_id=receiver_id,
+                    content_type=content_type,
+                    target_id=target_id,
+                    name=name,
+                    max_derive=max_derive,
+                )
+                for receiver_id, target_id, name, max_derive in (
+                    refs.capability_rows("receiver_id", "target_id")
+                )
+            ]
+            self.bulk_create(items)
+        return len(items)
+
+    def rebuild(self, reference_model, chunk_size: int = 1000) -> int:
+        """Repopulate rows of `reference_model` from its references.
+
+        References' targets are streamed by chunks of `chunk_size` ids,
+        such as memory usage does not depend on the references count. Each
+        chunk's rows are replaced atomically (see `refresh`): rows of
+        other targets remain available while rebuilding. Rows of targets
+        without references are deleted at last.
+
+        :return the number of inserted rows.
+        """
+        model = reference_model._meta.get_field("target").related_model
+        refs = reference_model.objects.using(self.db)
+        targets = (
+            refs.order_by("target_id")
+            .values_list("target_id", flat=True)
+            .distinct()
+        )
+        count = 0
+        last = None
+        while True:
+            chunk = (
+                targets if last is None else targets.filter(target_id__gt=last)
+            )
+            chunk = list(chunk[:chunk_size])
+            if not chunk:
+                break
+            count += self.refresh(reference_model, chunk)
+            last = chunk[-1]
+
+        stale = self.target_model(model).filter(
+            ~models.Exists(refs.filter(target_id=models.OuterRef("target_id")))
+        )
+        stale._raw_delete(self.db)
+        return count
+
+
+class PermissionIndex(models.Model):
+    """Materialized effective permissions: one row per agent, target object
+    and capability name, with the greatest `max_derive` granted by
+    agent's references on this object.
+
+    Rows are maintained for reference models whose `use_permission_index`
+    is True (see `fox.caps.receivers` and `ReferenceQuerySet`), and can be
+    rebuilt using the ``rebuild_permission_index`` management command.
+    Checking a permission is then a single lookup on the unique index.
+    """
+
+    agent = models.ForeignKey(
+        Agent, models.CASCADE, related_name="+", verbose_name=_("Agent")
+    )
+    content_type = models.ForeignKey(
+        ContentType,
+        models.CASCADE,
+        related_name="+",
+        verbose_name=_("Target Type"),
+    )
+    target_id = models.PositiveBigIntegerField(_("Target"))
+    name = models.CharField(_("Action"), max_length=32)
+    max_derive = models.PositiveIntegerField(
+        _("Maximum Derivation"), default=0
+    )
+
+    objects = PermissionIndexQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (("agent", "content_type", "name", "target_id"),)
+        indexes = [models.Index(fields=["content_type", "target_id"])]
@@ -1,17 +1,38 @@
 from __future__ import annotations
 
+import itertools
 import uuid
 from collections.abc import Iterable
+from typing import Union
 
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import (
+    Count,
+    Exists,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    prefetch_related_objects,
+)
+from django.db.models.functions import Cast, Concat
+from django.db.models.lookups import StartsWith
 from django.utils.translation import gettext_lazy as _
 
-from .agent import Agent
+from ..cache import get_capability_cache
+from ..instrumentation import incr, timer
+from ..signals import references_revoked
+from .agent import Agent, AgentQuerySet, IntoAgents, get_agents_filter
 from .capability import Capability
-from .capability_set import BaseCapabilitySet
+from .capability_set import BaseCapabilitySet, FrozenCapabilitySet
+from .permission_index import PermissionIndex
 
 __all__ = (
     "ReferenceQuerySet",
+    "ReferenceBase",
     "Reference",
 )
 
@@ -30,17 +51,74 @@ class ReferenceQuerySet(models.QuerySet):
         """
         return self.filter(origin__receiver=agents)
 
-    def receiver(self, agents: Agent) -> ReferenceQuerySet:
-        """References for the provided Agent receiver.
+    def emitted_by(
+        self, agent: Agent, transitive: bool = True
+    ) -> ReferenceQuerySet:
+        """References emitted by agent.
 
-        :param Agent agents: single Agent.
+        :param Agent agent: single Agent.
+        :param bool transitive: if True, include all references derived \
+            from a reference received by agent, not only direct ones.
         """
-        return self.filter(receiver=agents)
+        if not transitive:
+            return self.emitter(agent)
+
+        prefix = Concat(
+            "path",
+            Cast("pk", models.CharField()),
+            Value(self.model.PATH_SEPARATOR),
+            output_field=models.CharField(),
+        )
+        refs = self.model.objects.filter(
+            StartsWith(OuterRef("path"), prefix),
+            receiver=agent,
+            target_id=OuterRef("target_id"),
+        )
+        return self.filter(Exists(refs))
+
+    def descendants(self, reference: Reference) -> ReferenceQuerySet:
+        """References derived from `reference`, directly or not."""
+        return self.filter(
+            target_id=reference.target_id,
+            path__startswith=reference.get_descendants_path(),
+        )
+
+    def ancestors(self, reference: Reference) -> ReferenceQuerySet:
+        """References from which `reference` is derived, directly or
+        not."""
+        return self.filter(pk__in=reference.get_ancestor_ids())
+
+    def receiver(self, agents: IntoAgents) -> ReferenceQuerySet:
+        """References for the provided Agent receiver(s).
+
+        :param agents: single Agent, `AgentQuerySet`, or iterable of \
+            agents or agent ids (such as `AgentIds` returned by \
+            `AgentCache.get_ids`). See `get_agents_filter`.
+        """
+        return self.filter(get_agents_filter("receiver", agents))
+
+    def best(self) -> ReferenceQuerySet:
+        """Keep only one reference per target among the queryset's ones:
+        the closest to origin (lowest depth, then lowest id).
+
+        Selection is done in SQL, such as when references are fetched for
+        multiple receivers.
+        """
+        best = (
+            self.filter(target_id=OuterRef("target_id"))
+            .order_by("depth", "pk")
+            .values("pk")[:1]
+        )
+        return self.filter(pk=Subquery(best))
 
     def ref(self, receiver: Agent, ref: uuid.UUID) -> ReferenceQuerySet:
         """Reference by ref and receiver."""
         return self.receiver(receiver).get(ref=ref)
 
+    async def aref(self, receiver: Agent, ref: uuid.UUID) -> Reference:
+        """Async version of `ref`."""
+        return await self.receiver(receiver).aget(ref=ref)
+
     def refs(
         self, receiver: Agent, refs: Iterable[uuid.UUID]
     ) -> ReferenceQuerySet:
@@ -48,24 +126,621 @@ class ReferenceQuerySet(models.QuerySet):
         return self.receiver(receiver).filter(ref__in=refs)
 
     def capability(self, receiver: Agent, name: str) -> ReferenceQuerySet:
-        return self.receiver(receiver).filter(capability_set__name=name)
+        """References of receiver having the provided capability."""
+        return self.receiver(receiver).filter(self._has_capabilities([name]))
 
     def capabilities(
         self, receiver: Agent, names: Iterable[str]
     ) -> ReferenceQuerySet:
-        return self.receiver(receiver).filter(capability_set__name__in=names)
+        """References of receiver having any of the provided
+        capabilities."""
+        names = list(names)
+        return self.receiver(receiver).filter(self._has_capabilities(names))
+
+    def _has_capabilities(self, names: list[str]) -> Q:
+        """Return condition on references having any of the capabilities
+        names.
+
+        When `use_capability_map` is True, references without capability
+        map are looked up through `capabilities` relation.
+        """
+        field = self.model._meta.get_field("capabilities")
+        through = field.remote_field.through
+        source = field.m2m_field_name()
+        target = field.m2m_reverse_field_name()
+        relation = Exists(
+            through.objects.filter(
+                **{source: OuterRef("pk"), target + "__name__in": names}
+            )
+        )
+        if not self.model.use_capability_map:
+            return Q(relation)
+        return Q(capability_map__has_any_keys=names) | Q(
+            relation, capability_map__isnull=True
+        )
+
+    def bulk_create(self, objs, *a, capabilities=None, **kw):
+        """Validate and create references.
+
+        :param capabilities: if provided, saved capabilities assigned to \
+            all created references.
+        """
+        objs = list(objs)
+        if capabilities is not None:
+            capabilities = list(capabilities)
+            if self.model.use_capability_map:
+                capability_map = self.model.get_capability_map(capabilities)
+                for obj in objs:
+                    obj.capability_map = dict(capability_map)
 
-    def bulk_create(self, objs, *a, **kw):
         for obj in objs:
             obj.is_valid()
-        return super().bulk_create(objs, *a, **kw)
+            obj.path = obj.get_path()
+        objs = super().bulk_create(objs, *a, **kw)
+        if capabilities:
+            self._add_capabilities(
+                ((obj, capabilities) for obj in objs),
+                batch_size=kw.get("batch_size"),
+            )
+        return objs
+
+    def derive_many(
+        self,
+        receivers: Iterable[Agent],
+        items: BaseCapabilitySet.DeriveItems = None,
+        update: bool = False,
+        batch_size: int = None,
+    ) -> list[Reference]:
+        """Derive each reference of this queryset for all receivers.
+
+        Derivation is checked for each reference, then references and
+        their capabilities are saved in bulk, using a constant number of
+        queries.
+
+        :param receivers: receivers as Agent instances or primary keys.
+        :param DeriveItems items: if provided, only derive those capabilities
+        :param bool update: update existing references if they exist
+        :return the list of created and updated references.
+        """
+        sources = list(self)
+        if not self.model.use_capability_map:
+            prefetch_related_objects(sources, "capabilities")
+        sources = [(r, r.derive_items(items)) for r in sources]
+        Capability.objects.get_or_create_many(
+            item for _, capabilities in sources for item in capabilities
+        )
+        created, updated = self._bulk_derive(
+            sources, receivers, update, batch_size
+        )
+        return created + updated
+
+    def _bulk_derive(self, sources, receivers, update=False, batch_size=None):
+        """Derive references for receivers, saving them in bulk.
+
+        :param sources: iterable of ``(reference, capabilities)``, where \
+            capabilities are saved derived capabilities.
+        :param receivers: receivers as Agent instances or primary keys.
+        :param bool update: update existing references if they exist
+        :return a tuple of created and updated references lists.
+        """
+        sources = list(sources)
+        receivers = [getattr(r, "pk", r) for r in receivers]
+        if not sources or not receivers:
+            return [], []
+
+        existing = {}
+        if update:
+            queryset = self.model.objects.using(self.db).filter(
+                origin__in=[source.pk for source, _ in sources],
+                receiver_id__in=receivers,
+            )
+            if self.model.use_capability_map:
+                # used for references missing capability map
+                queryset = queryset.prefetch_related("capabilities")
+            existing = {(r.origin_id, r.receiver_id): r for r in queryset}
+
+        created, updated, relations = [], [], []
+        for source, capabilities in sources:
+            for receiver in receivers:
+                subset = existing.get((source.pk, receiver))
+                if subset is None:
+                    subset = self.model(
+                        origin=source,
+                        depth=source.depth + 1,
+                        receiver_id=receiver,
+                        target_id=source.target_id,
+                    )
+                    created.append(subset)
+                else:
+                    updated.append(subset)
+                relations.append((subset, capabilities))
+
+        if self.model.use_capability_map:
+            for subset, capabilities in relations:
+                initial = list(subset.get_capabilities()) if subset.pk else []
+                subset.capability_map = self.model.get_capability_map(
+                    initial + list(capabilities)
+                )
+
+        for subset in created:
+            subset.is_valid()
+            subset.path = subset.get_path()
+        with transaction.atomic(using=self.db):
+            super().bulk_create(created, batch_size=batch_size)
+            if updated and self.model.use_capability_map:
+                self.model.objects.using(self.db).bulk_update(
+                    updated, ["capability_map"], batch_size
+                )
+            self._add_capabilities(relations, batch_size=batch_size)
+
+        cache = get_capability_cache()
+        for subset in updated:
+            # capabilities prefetched above are outdated
+            prefetched = getattr(subset, "_prefetched_objects_cache", {})
+            prefetched.pop("capabilities", None)
+            if cache is not None:
+                cache.discard(subset)
+        return created, updated
+
+    def _get_through_items(self, relations):
+        """Return through model and its instances relating references to
+        capabilities.
+
+        :param relations: iterable of ``(reference, capabilities)``.
+        """
+        field = self.model._meta.get_field("capabilities")
+        through = field.remote_field.through
+        source = field.m2m_field_name() + "_id"
+        target = field.m2m_reverse_field_name() + "_id"
+        items = [
+            through(**{source: obj.pk, target: capability.pk})
+            for obj, capabilities in relations
+            for capability in capabilities
+        ]
+        return through, items
+
+    def _add_capabilities(self, relations, batch_size=None):
+        """Insert capabilities relations of references in bulk, ignoring
+        existing ones.
+
+        :param relations: iterable of ``(reference, capabilities)``.
+        """
+        relations = list(relations)
+        through, items = self._get_through_items(relations)
+        through.objects.using(self.db).bulk_create(
+            items, batch_size=batch_size, ignore_conflicts=True
+        )
+        if self.model.use_permission_index:
+            self._update_relations_index(relations)
+
+    async def _aadd_capabilities(self, relations):
+        """Async version of `_add_capabilities`."""
+        relations = list(relations)
+        through, items = self._get_through_items(relations)
+        await through.objects.using(self.db).abulk_create(
+            items, ignore_conflicts=True
+        )
+        if self.model.use_permission_index:
+            await sync_to_async(self._update_relations_index)(relations)
+
+    def _update_relations_index(self, relations):
+        """Update permission index of references from relations."""
+        targets = {obj.target_id for obj, _ in relations}
+        receivers = {obj.receiver_id for obj, _ in relations}
+        self.update_permission_index(targets, receivers)
+
+    def subtree(self, reference: Reference) -> ReferenceQuerySet:
+        """Reference and all references derived from it."""
+        return self.filter(
+            Q(pk=reference.pk)
+            | Q(path__startswith=reference.get_descendants_path()),
+            target_id=reference.target_id,
+        )
+
+    def revoke(
+        self, reference: Reference, capabilities: Iterable[str] = None
+    ) -> int:
+        """Revoke a reference and all references derived from it, using
+        set-based queries instead of the deletion collector.
+
+        Only references and their capabilities relations are removed:
+        other models relating to references are not handled. Signal
+        `fox.caps.signals.references_revoked` is sent once (no deletion
+        signal is sent per reference).
+
+        :param Reference reference: root reference of the revoked subtree.
+        :param capabilities: if provided, only remove capabilities with \
+            those names from subtree references, without deleting them.
+        :return the number of affected references.
+        """
+        model = self.model
+        subtree = model.objects.using(self.db).subtree(reference)
+        field = model._meta.get_field("capabilities")
+        through = field.remote_field.through.objects.using(self.db)
+        source = field.m2m_field_name() + "__in"
+
+        with transaction.atomic(using=self.db):
+            if capabilities is None:
+                through.filter(**{source: subtree.values("pk")})._raw_delete(
+                    self.db
+                )
+                # related objects are handled above: the deletion collector
+                # is bypassed.
+                count = subtree._raw_delete(self.db)
+            else:
+                capabilities = list(capabilities)
+                relations = through.filter(
+                    **{source: subtree.values("pk")},
+                    capability__name__in=capabilities,
+                )
+                count = (
+                    relations.values(field.m2m_field_name()).distinct().count()
+                )
+                relations._raw_delete(self.db)
+                if model.use_capability_map:
+                    subtree.filter(
+                        capability_map__has_any_keys=capabilities
+                    )._revoke_capability_map(capabilities)
+
+        cache = get_capability_cache()
+        if cache is not None:
+            cache.clear()
+        references_revoked.send(
+            sender=model,
+            reference=reference,
+            capabilities=capabilities,
+            count=count,
+        )
+        return count
+
+    def _revoke_capability_map(self, names, batch_size=500):
+        """Remove names from references' `capability_map`."""
+        objs = []
+        objects = self.model.objects.using(self.db)
+        for obj in self.only("pk", "capability_map").iterator(batch_size):
+            for name in names:
+                obj.capability_map.pop(name, None)
+            objs.append(obj)
+            if len(objs) >= batch_size:
+                objects.bulk_update(objs, ["capability_map"])
+                objs = []
+        if objs:
+            objects.bulk_update(objs, ["capability_map"])
+
+    def update_path(self) -> int:
+        """Update references' `path` from their origin, level by level.
+
+        :return the number of updated references.
+        """
+        model = self.model
+        count = self.filter(origin__isnull=True).update(path="")
+        queryset = self.filter(origin__isnull=False)
+        depths = queryset.order_by("depth").values_list("depth", flat=True)
+        origins = model.objects.filter(pk=OuterRef("origin_id"))
+        for depth in depths.distinct():
+            count += queryset.filter(depth=depth).update(
+                path=Concat(
+                    Subquery(origins.values("path")[:1]),
+                    Cast("origin_id", models.CharField()),
+                    Value(model.PATH_SEPARATOR),
+                    output_field=models.CharField(),
+                )
+            )
+        return count
+
+    def update_capability_map(self, batch_size: int = 500) -> int:
+        """Update references' `capability_map` from their capabilities.
+
+        :return the number of updated references.
+        """
+        count = 0
+        queryset = self.prefetch_related("capabilities")
+        objs = []
+        for obj in queryset.iterator(chunk_size=batch_size):
+            obj.capability_map = obj.get_capability_map(obj.capabilities.all())
+            objs.append(obj)
+            if len(objs) >= batch_size:
+                count += self.bulk_update(objs, ["capability_map"])
+                objs = []
+        if objs:
+            count += self.bulk_update(objs, ["capability_map"])
+        return count
+
+    def validate(
+        self,
+        references: Iterable[Reference] = None,
+        batch_size: int = 1000,
+    ) -> list[Reference]:
+        """Check derivation rules of references in bulk, and return the
+        invalid ones.
+
+        A derived reference is invalid when its origin does not share its
+        target, has a greater or equal depth, or does not derive its
+        capabilities. Checks are done on ids and ``(name, max_derive)``
+        values only: a couple of queries are run per batch, whatever the
+        references count.
+
+        :param references: references to check; if not provided, \
+            check queryset's ones.
+        :param batch_size: number of references checked per batch.
+        """
+        fields = ("pk", "origin_id", "target_id", "depth", "capability_map")
+        if references is None:
+            objs = None
+            rows = self.values_list(*fields).iterator(chunk_size=batch_size)
+        else:
+            objs = {obj.pk: obj for obj in references}
+            rows = iter(
+                [tuple(getattr(r, f) for f in fields) for r in objs.values()]
+            )
+
+        invalid = []
+        while chunk := list(itertools.islice(rows, batch_size)):
+            invalid.extend(self._get_invalid(chunk, fields))
+
+        if objs is not None:
+            return [objs[pk] for pk in invalid]
+        queryset = self.model.objects.using(self.db).filter(pk__in=invalid)
+        return list(queryset.order_by("pk"))
+
+    def _get_invalid(self, rows: list[tuple], fields) -> list[int]:
+        """Return ids of invalid references among provided rows."""
+        origin_ids = {row[1] for row in rows if row[1] is not None}
+        parents = self.model.objects.using(self.db).filter(pk__in=origin_ids)
+        parents = {row[0]: row for row in parents.values_list(*fields)}
+        maps = self._get_capability_maps(rows + list(parents.values()))
+
+        invalid = []
+        for pk, origin_id, target_id, depth, _map in rows:
+            if origin_id is None:
+                continue
+            parent = parents.get(origin_id)
+            if (
+                parent is None
+                or parent[2] != target_id
+                or parent[3] >= depth
+                or not self._is_derived_map(maps[origin_id], maps[pk])
+            ):
+                invalid.append(pk)
+        return invalid
+
+    def _get_capability_maps(self, rows: Iterable[tuple]) -> dict:
+        """Return ``{pk: {name: max_derive}}`` for provided
+        ``(pk, ..., capability_map)`` rows, reading missing maps from
+        capabilities relation in one query."""
+        maps, missing = {}, []
+        for row in rows:
+            if self.model.use_capability_map and row[-1] is not None:
+                maps[row[0]] = row[-1]
+            else:
+                maps[row[0]] = {}
+                missing.append(row[0])
+
+        if missing:
+            field = self.model._meta.get_field("capabilities")
+            through = field.remote_field.through
+            source = field.m2m_field_name() + "_id"
+            target = field.m2m_reverse_field_name()
+            items = through.objects.using(self.db).filter(
+                **{source + "__in": missing}
+            )
+            items = items.values_list(
+                source, target + "__name", target + "__max_derive"
+            )
+            for pk, name, max_derive in items:
+                capability_map = maps[pk]
+                if capability_map.get(name, -1) < max_derive:
+                    capability_map[name] = max_derive
+        return maps
+
+    @staticmethod
+    def _is_derived_map(parent: dict, child: dict) -> bool:
+        """Return True if `child` capabilities map is derived from
+        `parent` one."""
+        for name, max_derive in child.items():
+            parent_max = parent.get(name)
+            if parent_max is None or max_derive >= parent_max:
+                return False
+        return True
+
+    def effective_capabilities(
+        self,
+        receiver: Union[Agent, Iterable[Agent], Iterable[int]],
+        targets: Iterable = None,
+    ) -> dict[int, FrozenCapabilitySet]:
+        """Return effective capabilities by target of receiver(s).
+
+        Several references can grant capabilities to the same receiver on
+        a target (from different origins or through different agents).
+        Effective capabilities are the union of their capabilities,
+        keeping the greatest `max_derive` per name. They are computed in a
+        single grouped query over capabilities relation.
+
+        :param receiver: receiver or receivers (see `receiver`).
+        :param targets: if provided, only for those targets (objects, \
+            ids or queryset).
+        :return a dict of ``{target_id: FrozenCapabilitySet}``.
+        """
+        refs = self.receiver(receiver)
+        if targets is not None:
+            refs = refs.filter(target__in=targets)
+        maps = {}
+        for target_id, name, max_derive in refs.capability_rows("target_id"):
+            maps.setdefault(target_id, {})[name] = max_derive
+        return {
+            pk: FrozenCapabilitySet.from_map(capability_map)
+            for pk, capability_map in maps.items()
+        }
+
+    def capability_rows(self, *fields: str) -> models.QuerySet:
+        """Return capabilities of queryset's references grouped by the
+        provided reference fields, as ``(*fields, name, max_derive)``
+        tuples keeping the greatest `max_derive` per name.
+
+        They are computed in a single grouped query over capabilities
+        relation.
+        """
+        field = self.model._meta.get_field("capabilities")
+        through = field.remote_field.through
+        source = field.m2m_field_name()
+        target = field.m2m_reverse_field_name()
+        return (
+            through.objects.using(self.db)
+            .filter(**{source + "__in": self.values("pk")})
+            .values_list(
+                *(source + "__" + f for f in fields), target + "__name"
+            )
+            .annotate(max_derive=Max(target + "__max_derive"))
+            .order_by()
+        )
+
+    def update_permission_index(
+        self, targets: Iterable[int], receivers: Iterable[int] = None
+    ) -> int:
+        """Refresh `PermissionIndex` rows of the provided target ids (and
+        receiver ids), when model's `use_permission_index` is True.
+
+        :return the number of inserted rows.
+        """
+        if not self.model.use_permission_index:
+            return 0
+        return PermissionIndex.objects.using(self.db).refresh(
+            self.model, targets, receivers
+        )
+
+    def compact(self, batch_size: int = 1000) -> int:
+        """Merge redundant references of queryset, and return their count.
+
+        A reference is redundant when another one of the same receiver and
+        target has a lower or equal depth and a superset of its
+        capabilities (see `FrozenCapabilitySet.issubset`). References
+        derived from it are then attached to the latter, and it is
+        deleted.
+
+        A reference is kept when one of its derived references would
+        conflict with one derived from the latter (same receiver).
+
+        Groups of references are processed by batches of `batch_size`.
+
+        Merged references are deleted: their public `ref` no longer
+        resolves (e.g. API URLs handed out using it return 404), and
+        capability tokens of their targets are revoked (see
+        `fox.caps.tokens`). Only compact references whose `ref` is not
+        exposed, or when clients can reach the kept reference.
+        """
+        groups = (
+            self.values_list("receiver_id", "target_id")
+            .annotate(count=Count("pk"))
+            .filter(count__gt=1)
+            .order_by()
+        )
+        groups = groups.iterator(chunk_size=batch_size)
+        count = 0
+        while chunk := list(itertools.islice(groups, batch_size)):
+            count += self._compact(chunk)
+
+        if count:
+            cache = get_capability_cache()
+            if cache is not None:
+                cache.clear()
+        return count
+
+    def _compact(self, groups: list[tuple]) -> int:
+        """Merge redundant references of provided ``(receiver_id,
+        target_id, count)`` groups."""
+        model = self.model
+        keys = {
+            (receiver_id, target_id) for receiver_id, target_id, _ in groups
+        }
+        rows = (
+            self.filter(
+                receiver_id__in={k[0] for k in keys},
+                target_id__in={k[1] for k in keys},
+            )
+            .order_by("depth", "pk")
+            .values_list(
+                "pk", "receiver_id", "target_id", "depth", "capability_map"
+            )
+        )
+        rows = [row for row in rows if (row[1], row[2]) in keys]
+        maps = self._get_capability_maps(rows)
+
+        kept, removed = {}, {}
+        for pk, receiver_id, target_id, depth, _map in rows:
+            capabilities = FrozenCapabilitySet.from_map(maps[pk])
+            candidates = kept.setdefault((receiver_id, target_id), [])
+            parent = next(
+                (
+                    other_pk
+                    for other_pk, other in candidates
+                    if capabilities.issubset(other)
+                ),
+                None,
+            )
+            if parent is None:
+                candidates.append((pk, capabilities))
+            else:
+                removed[pk] = parent
+
+        if not removed:
+            return 0
+
+        objects = model.objects.using(self.db)
+        children = {}
+        origins = set(removed) | set(removed.values())
+        for origin_id, receiver_id in objects.filter(
+            origin_id__in=origins
+        ).values_list("origin_id", "receiver_id"):
+            children.setdefault(origin_id, set()).add(receiver_id)
+        for pk, parent in list(removed.items()):
+            receivers = children.get(pk, set())
+            parent_receivers = children.setdefault(parent, set())
+            if receivers & parent_receivers:
+                del removed[pk]
+            else:
+                parent_receivers.update(receivers)
+
+        if not removed:
+            return 0
+        with transaction.atomic(using=self.db):
+            for pk, parent in removed.items():
+                objects.filter(origin_id=pk).update(origin_id=parent)
+            targets = {target_id for _, target_id in keys}
+            objects.filter(target_id__in=targets).update_path()
+            objects.filter(pk__in=removed).delete()
+        return len(removed)
 
     # TODO: bulk_update -> is_valid()
 
 
-# TODO:
-# - merge existing references
-class Reference(BaseCapabilitySet, models.Model):
+class ReferenceBase(models.base.ModelBase):
+    """Metaclass for Reference model classes.
+
+    It adds missing indexes (see `Reference.get_indexes`) to concrete
+    classes, both declared ones and the ones generated for `Object`
+    models.
+    """
+
+    def __new__(cls, name, bases, attrs, **kwargs):
+        new_class = super().__new__(cls, name, bases, attrs, **kwargs)
+        if not new_class._meta.abstract:
+            cls.add_indexes(new_class)
+        return new_class
+
+    @classmethod
+    def add_indexes(cls, new_class):
+        """Add missing indexes to the provided reference class."""
+        indexes = new_class.get_indexes()
+        for index in indexes:
+            index.set_name_with_model(new_class)
+        if indexes:
+            opts = new_class._meta
+            opts.indexes = list(opts.indexes) + indexes
+            # migrations autodetector reads declared Meta options only
+            opts.original_attrs["indexes"] = opts.indexes
+
+
+class Reference(BaseCapabilitySet, models.Model, metaclass=ReferenceBase):
     """Reference are set of capabilities targeting a specific object. There are
     two kind of reference:
 
@@ -94,6 +769,16 @@ class Reference(BaseCapabilitySet, models.Model):
     """Source reference in references chain."""
     depth = models.PositiveIntegerField(_("Share Count"), default=0)
     """Reference chain's current depth."""
+    path = models.CharField(
+        _("Derivation Path"),
+        max_length=512,
+        blank=True,
+        default="",
+        db_index=True,
+        editable=False,
+    )
+    """Materialized path of ancestors' ids, from root to origin, each
+    followed by `PATH_SEPARATOR` (empty for root references)."""
     receiver = models.ForeignKey(
         Agent,
         models.CASCADE,
@@ -104,6 +789,43 @@ class Reference(BaseCapabilitySet, models.Model):
     capabilities = models.ManyToManyField(
         Capability, verbose_name=_("Capability")
     )
+    capability_map = models.JSONField(
+        _("Capabilities Map"),
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    """Denormalized capabilities, as a dict of ``{name: max_derive}``.
+
+    When present and `use_capability_map` is True, it is used in place of
+    `capabilities` for lookups and derivation checks. It is kept in sync
+    with `capabilities` relation by `fox.caps.receivers`; references
+    whose map is NULL are looked up through the relation.
+    """
+
+    use_capability_map = False
+    """Maintain and use `capability_map` in place of the `capabilities`
+    relation when possible."""
+    use_permission_index = False
+    """Maintain `PermissionIndex` rows of this model's references, which
+    are then used by `ObjectQuerySet.allowed` and permission classes.
+
+    Rows are updated when references are saved, when capabilities are
+    added in bulk (`create`, `derive` and `ReferenceQuerySet` bulk
+    methods, see `ReferenceQuerySet._add_capabilities`), and by
+    `fox.caps.receivers` when `capabilities` relation changes, or
+    references are revoked or deleted.
+    """
+
+    index_fields = (("receiver", "ref"), ("receiver", "target"), ("origin",))
+    """Fields of the indexes concrete reference models must have, for
+    hot lookups: detail (receiver and ref), listing (receiver and target)
+    and chain walks (origin).
+
+    Missing ones are added by `ReferenceBase` (see `get_indexes`), and
+    `fox.caps.checks` reports the ones missing from migrations. Override
+    it on subclasses in order to customize indexes.
+    """
 
     objects = ReferenceQuerySet.as_manager()
 
@@ -111,6 +833,51 @@ class Reference(BaseCapabilitySet, models.Model):
         abstract = True
         unique_together = (("origin", "receiver", "target"),)
 
+    PATH_SEPARATOR = "/"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        incr("references")
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_chain = instance._get_chain()
+        return instance
+
+    def _get_chain(self) -> tuple:
+        """Return loaded values `path` and validity depend on."""
+        return self.__dict__.get("origin_id"), self.__dict__.get("depth")
+
+    @classmethod
+    def get_indexes(cls) -> list[models.Index]:
+        """Return indexes declared by `index_fields` that are not yet
+        provided by the model."""
+        return [
+            models.Index(fields=list(fields))
+            for fields in cls.index_fields
+            if not cls.has_index(fields)
+        ]
+
+    @classmethod
+    def has_index(cls, fields: Iterable[str]) -> bool:
+        """Return True if model has an index or unique constraint starting
+        with provided fields."""
+        fields = tuple(fields)
+        opts = cls._meta
+        if len(fields) == 1:
+            field = opts.get_field(fields[0])
+            if field.primary_key or field.unique or field.db_index:
+                return True
+
+        items = [index.fields for index in opts.indexes]
+        items.extend(opts.unique_together)
+        items.extend(getattr(opts, "index_together", ()))
+        items.extend(
+            constraint.fields
+            for constraint in opts.constraints
+            if isinstance(constraint, models.UniqueConstraint)
+            and constraint.condition is None
+        )
+        return any(tuple(item[: len(fields)]) == fields for item in items)
+
     @property
     def emitter(self):
         """Agent emitting the reference."""
@@ -145,19 +912,131 @@ class Reference(BaseCapabilitySet, models.Model):
                 "`create()`: you should use derive instead"
             )
 
+        capabilities = Capability.objects.get_or_create_many(
+            Capability.into(c) for c in capabilities
+        )
         self = cls(receiver=emitter, target=target, **kw)
+        if cls.use_capability_map:
+            self.capability_map = cls.get_capability_map(capabilities)
         self.save()
-        self.capabilities.add(*capabilities)
+        cls.objects.using(self._state.db)._add_capabilities(
+            [(self, capabilities)]
+        )
         return self
 
+    @classmethod
+    async def acreate(
+        cls,
+        emitter: Agent,
+        target: object,
+        capabilities: Iterable[Capability],
+        **kw,
+    ) -> Reference:
+        """Async version of `create`."""
+        if "origin" in kw:
+            raise ValueError(
+                'attribute "origin" can not be passed as an argument to '
+                "`acreate()`: you should use aderive instead"
+            )
+
+        capabilities = await Capability.objects.aget_or_create_many(
+            Capability.into(c) for c in capabilities
+        )
+        self = cls(receiver=emitter, target=target, **kw)
+        if cls.use_capability_map:
+            self.capability_map = cls.get_capability_map(capabilities)
+        # FIXME: use asave() once available (Django 4.2)
+        await sync_to_async(self.save)()
+        await cls.objects.all()._aadd_capabilities([(self, capabilities)])
+        return self
+
+    @staticmethod
+    def get_capability_map(
+        capabilities: Iterable[Capability], initial: dict = None
+    ) -> dict[str, int]:
+        """Return a denormalized capability map from capabilities, merging
+        them into `initial` if provided.
+
+        When a capability name is present multiple times, the highest
+        `max_derive` is kept.
+        """
+        capability_map = dict(initial or {})
+        for capability in capabilities:
+            capability_map[capability.name] = max(
+                capability_map.get(capability.name, -1),
+                capability.max_derive,
+            )
+        return capability_map
+
     def is_derived(self, other: Reference) -> bool:
-        if other.depth <= self.depth or self.target != other.target:
+        if other.depth <= self.depth or self.target_id != other.target_id:
             return False
         return super().is_derived(other)
 
     def get_capabilities(self):
+        """Return reference's capabilities.
+
+        When `capability_map` is used, capabilities are built from it,
+        without database access (returned instances are not saved).
+        """
+        if self.use_capability_map and self.capability_map is not None:
+            return [
+                Capability(name=name, max_derive=max_derive)
+                for name, max_derive in self.capability_map.items()
+            ]
         return self.capabilities.all()
 
+    def get_capability_set(self) -> FrozenCapabilitySet:
+        """Return reference's capabilities as a `FrozenCapabilitySet`.
+
+        It is built from `capability_map` or prefetched capabilities when
+        available, otherwise from names and max_derive values fetched from
+        database.
+        """
+        if self.use_capability_map and self.capability_map is not None:
+            return FrozenCapabilitySet.from_map(self.capability_map)
+        prefetched = getattr(self, "_prefetched_objects_cache", {})
+        if "capabilities" in prefetched:
+            return FrozenCapabilitySet(prefetched["capabilities"])
+        return FrozenCapabilitySet.from_queryset(self.capabilities.all())
+
+    def get_token(
+        self,
+        target=None,
+        receiver: int = None,
+        depth: int = None,
+        expires: int = None,
+        signer=None,
+    ) -> str:
+        """Return a signed capability token for this reference (see
+        `BaseCapabilitySet.get_token`).
+
+        Target, receiver and depth default to reference's ones.
+        """
+        if signer is None:
+            from ..tokens import token_signer as signer
+
+        if target is None:
+            model = self._meta.get_field("target").related_model
+            target = (model._meta.label_lower, self.target_id)
+        return signer.sign(
+            target,
+            self.get_capability_set(),
+            self.receiver_id if receiver is None else receiver,
+            self.depth if depth is None else depth,
+            expires,
+        )
+
+    async def aget_capabilities(self):
+        if self.use_capability_map and self.capability_map is not None:
+            return self.get_capabilities()
+        return [c async for c in self.capabilities.all()]
+
+    def get_cache_key(self):
+        if self.pk is None:
+            return None
+        return (self.receiver_id, self._meta.label, self.pk)
+
     def derive(
         self,
         receiver: Agent,
@@ -170,25 +1049,186 @@ class Reference(BaseCapabilitySet, models.Model):
         :param DeriveItems items: if provided, only derive those capabilities
         :param bool update: update existing reference if it exists
         """
-        subset = None
-        if update:
-            queryset = self.objects.filter(
-                origin=self, receiver=receiver, target=self.target
+        with timer("derive"):
+            subset = None
+            if update:
+                subset = self._get_derived_queryset(receiver).first()
+
+            capabilities = list(self.derive_caps(items) or ())
+            subset = self._get_derived(subset, receiver)
+            if self.use_capability_map:
+                initial = list(subset.get_capabilities()) if subset.pk else []
+                subset.capability_map = self.get_capability_map(
+                    initial + capabilities
+                )
+            subset.save()
+            type(self).objects.using(subset._state.db)._add_capabilities(
+                [(subset, capabilities)]
             )
-            subset = queryset.first()
 
-        capabilities = self.derive_caps(items)
+            cache = get_capability_cache()
+            if cache is not None:
+                cache.discard(subset)
+            return subset
+
+    def derive_many(
+        self,
+        receivers: Iterable[Agent],
+        items: BaseCapabilitySet.DeriveItems = None,
+        update: bool = False,
+        batch_size: int = None,
+    ) -> list[Reference]:
+        """Derive this reference for many receivers at once.
+
+        Derivation is checked once, then references and their capabilities
+        are saved in bulk, using a constant number of queries.
+
+        :param receivers: receivers as Agent instances or primary keys.
+        :param DeriveItems items: if provided, only derive those capabilities
+        :param bool update: update existing references if they exist
+        :return the list of created and updated references.
+        """
+        capabilities = list(self.derive_caps(items) or ())
+        created, updated = (
+            type(self)
+            .objects.all()
+            ._bulk_derive(
+                [(self, capabilities)], receivers, update, batch_size
+            )
+        )
+        return created + updated
+
+    def derive_agents(
+        self,
+        agents: AgentQuerySet,
+        items: BaseCapabilitySet.DeriveItems = None,
+        update: bool = False,
+        chunk_size: int = 1000,
+    ) -> tuple[int, int]:
+        """Derive this reference for all agents of the provided queryset
+        (e.g. members of a group), excluding self's receiver.
+
+        Agents' primary keys are read by chunks, and derived references
+        saved in bulk for each chunk: memory usage does not depend on the
+        agents count.
+
+        :param AgentQuerySet agents: receivers of derived references.
+        :param DeriveItems items: if provided, only derive those capabilities
+        :param bool update: update existing references if they exist
+        :param int chunk_size: number of agents handled at once.
+        :return a tuple of created and updated references count.
+        """
+        capabilities = list(self.derive_caps(items) or ())
+        queryset = type(self).objects.all()
+        agents = (
+            agents.exclude(pk=self.receiver_id)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+
+        created = updated = 0
+        last = None
+        while True:
+            chunk = agents if last is None else agents.filter(pk__gt=last)
+            chunk = list(chunk[:chunk_size])
+            if not chunk:
+                break
+            result = queryset._bulk_derive(
+                [(self, capabilities)], chunk, update
+            )
+            created += len(result[0])
+            updated += len(result[1])
+            last = chunk[-1]
+        return created, updated
+
+    async def aderive(
+        self,
+        receiver: Agent,
+        items: BaseCapabilitySet.DeriveItems = None,
+        update: bool = False,
+    ) -> Reference:
+        """Async version of `derive`."""
+        with timer("derive"):
+            subset = None
+            if update:
+                subset = await self._get_derived_queryset(receiver).afirst()
+
+            capabilities = list(await self.aderive_caps(items) or ())
+            subset = self._get_derived(subset, receiver)
+            if self.use_capability_map:
+                initial = await subset.aget_capabilities() if subset.pk else []
+                subset.capability_map = self.get_capability_map(
+                    list(initial) + capabilities
+                )
+            # FIXME: use asave() once available (Django 4.2)
+            await sync_to_async(subset.save)()
+            await type(self).objects.all()._aadd_capabilities(
+                [(subset, capabilities)]
+            )
+
+            cache = get_capability_cache()
+            if cache is not None:
+                cache.discard(subset)
+            return subset
+
+    def _get_derived_queryset(self, receiver: Agent) -> ReferenceQuerySet:
+        """Return queryset of references derived from self for receiver."""
+        return type(self).objects.filter(
+            origin=self, receiver=receiver, target_id=self.target_id
+        )
+
+    def _get_derived(self, subset: Reference, receiver: Agent) -> Reference:
+        """Return `subset` or a new reference derived from self."""
         if subset is None:
             subset = type(self)(
                 origin=self,
                 depth=self.depth + 1,
                 receiver=receiver,
-                target=self.target,
+                target_id=self.target_id,
             )
-        subset.save()
-        subset.capabilities.add(*capabilities)
         return subset
 
+    def get_path(self) -> str:
+        """Return materialized path based on origin.
+
+        :raises ValidationError: path exceeds `path` field's size, i.e. \
+            the derivation chain is too deep.
+        """
+        if not self.origin_id:
+            return ""
+        path = self.origin.get_descendants_path()
+        if len(path) > self._meta.get_field("path").max_length:
+            raise ValidationError(
+                _("Reference derivation chain is too deep."), code="path"
+            )
+        return path
+
+    def get_descendants_path(self) -> str:
+        """Return path prefix of references derived from self."""
+        return "{}{}{}".format(self.path, self.pk, self.PATH_SEPARATOR)
+
+    def revoke(self, capabilities: Iterable[str] = None) -> int:
+        """Revoke this reference and references derived from it (see
+        `ReferenceQuerySet.revoke()`)."""
+        queryset = type(self).objects.using(self._state.db)
+        return queryset.revoke(self, capabilities)
+
+    def get_ancestor_ids(self) -> list[int]:
+        """Return ids of ancestors, from root to origin."""
+        return [int(r) for r in self.path.split(self.PATH_SEPARATOR) if r]
+
     def save(self, *a, **kw):
-        self.is_valid()
-        return super().save(*a, **kw)
+        adding = self._state.adding
+        # origin is only fetched when the chain changed
+        if adding or self._get_chain() != getattr(self, "_loaded_chain", ()):
+            self.is_valid()
+            self.path = self.get_path()
+        result = super().save(*a, **kw)
+        self._loaded_chain = self._get_chain()
+        if self.use_permission_index and not adding:
+            # receiver may have changed: refresh all target's receivers;
+            # new references get their rows when capabilities are added.
+            type(self).objects.using(self._state.db).update_permission_index(
+                [self.target_id]
+            )
+        return result
@@ -1,15 +1,57 @@
 """Provide Django Rest Framework permissions to work with capabilities."""
+from django.core import signing
 from rest_framework.permissions import BasePermission
 
-from fox.caps.models import Capability, Object
+from fox.caps.cache import get_capability_cache
+from fox.caps.instrumentation import incr, timer
+from fox.caps.models import Capability, Object, PermissionIndex
+from fox.caps.tokens import token_signer
 
 __all__ = (
+    "BaseCapabilityPermission",
     "IsAllowed",
     "IsActionAllowed",
+    "IsTokenAllowed",
 )
 
 
-class IsAllowed(BasePermission):
+class BaseCapabilityPermission(BasePermission):
+    """Base class for capability permissions.
+
+    Capabilities are resolved through request's capability cache (set by
+    `fox.caps.middleware.AgentMiddleware`) or current one, such as each
+    reference's capabilities are loaded only once per request.
+
+    When object has no reference (it was not fetched for an agent) and its
+    reference model's `use_permission_index` is True, capability of
+    ``request.agent`` is looked up in `fox.caps.models.PermissionIndex`.
+    """
+
+    def get_capability(self, request, obj, name):
+        """Return object's reference capability by name or None."""
+        incr("capability_checks")
+        with timer("permissions"):
+            reference = obj.reference
+            if reference is None:
+                return self.get_indexed_capability(request, obj, name)
+            cache = getattr(request, "capability_cache", None)
+            if cache is None:
+                cache = get_capability_cache()
+            if cache is not None:
+                return cache.get_capability(reference, name)
+            return reference.get_capability(name)
+
+    def get_indexed_capability(self, request, obj, name):
+        """Return capability of request's agent from permission index, or
+        None if not used."""
+        # lazy request's agent may resolve to None
+        agent = getattr(request, "agent", None)
+        if not agent or not obj.Reference.use_permission_index:
+            return None
+        return PermissionIndex.objects.get_capability(agent, obj, name)
+
+
+class IsAllowed(BaseCapabilityPermission):
     """Return True if capability is allowed."""
 
     capability_name = None
@@ -20,11 +62,11 @@ class IsAllowed(BasePermission):
 
     def has_object_permission(self, request, view, obj):
         return isinstance(obj, Object) and bool(
-            obj.reference.get_capability(self.capability_name)
+            self.get_capability(request, obj, self.capability_name)
         )
 
 
-class IsActionAllowed(BasePermission):
+class IsActionAllowed(BaseCapabilityPermission):
     """Permission allowed for a specific action and object. It uses
     `Capability.get_name()` to get name from object's model and view action.
 
@@ -42,4 +84,68 @@ class IsActionAllowed(BasePermission):
 
         model = type(obj)
         capability_name = Capability.get_name(model, action)
-        return bool(obj.reference.get_capability(capability_name))
+        return bool(self.get_capability(request, obj, capability_name))
+
+
+class IsTokenAllowed(BasePermission):
+    """Permission allowed by a signed capability token (see
+    `fox.caps.tokens`), without loading references from database.
+
+    Token is read from the ``Authorization: Capability <token>`` header,
+    or from the `query_param` request's query parameter. The decoded token
+    is assigned to ``request.capability_token``.
+
+    Token must target the object, and provide capability for the view's
+    action (see `IsActionAllowed`) or `capability_name` when provided.
+    """
+
+    keyword = "Capability"
+    """Authorization header keyword."""
+    query_param = "token"
+    """Query parameter name."""
+    capability_name = None
+    signer = token_signer
+
+    def __init__(self, capability_name=None, action=None):
+        if capability_name:
+            self.capability_name = capability_name
+        self.action = action
+
+    def get_token(self, request):
+        """Return raw token from request or None."""
+        header = request.META.get("HTTP_AUTHORIZATION", "").split()
+        if len(header) == 2 and header[0] == self.keyword:
+            return header[1]
+        return request.GET.get(self.query_param)
+
+    def get_capability_token(self, request, target=None):
+        """Return verified token from request, or None if missing or
+        invalid."""
+        token = getattr(request, "capability_token", None)
+        if token is None:
+            value = self.get_token(request)
+            if not value:
+                return None
+            try:
+                token = self.signer.verify(value)
+            except signing.BadSignature:
+                return None
+            request.capability_token = token
+        if target is not None and not token.is_target(target):
+            return None
+        return token
+
+    def has_permission(self, request, view):
+        return self.get_capability_token(request) is not None
+
+    def has_object_permission(self, request, view, obj):
+        token = self.get_capability_token(request, obj)
+        if token is None:
+            return False
+        name = self.capability_name
+        if name is None:
+            action = getattr(view, "action", self.action)
+            if action is None:
+                return False
+            name = Capability.get_name(type(obj), action)
+        return token.get_capability(name) is not None
@@ -0,0 +1,201 @@
+"""Signal receivers keeping caches in sync with database.
+
+Handlers are connected when application is ready.
+"""
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import agent_cache, get_capability_cache
+from .models import Agent, Capability, Reference
+from .signals import references_revoked
+from .tokens import revocation_epochs
+
+__all__ = (
+    "capability_post_delete",
+    "agent_changed",
+    "user_groups_changed",
+    "reference_capability_map_changed",
+    "reference_revoked",
+    "reference_capabilities_removed",
+    "reference_index_revoked",
+    "reference_capabilities_changed",
+)
+
+
+@receiver(post_delete, sender=Capability)
+def capability_post_delete(sender, instance, using, **kwargs):
+    """Remove deleted capability from `Capability.registry`."""
+    sender.registry.discard(using, instance.name, instance.max_derive)
+
+
+@receiver(post_save, sender=Agent)
+@receiver(post_delete, sender=Agent)
+def agent_changed(sender, instance, **kwargs):
+    """Invalidate agent cache of users targeted by agent."""
+    if instance.user_id:
+        user_ids = [instance.user_id]
+    elif instance.group_id:
+        user_ids = User.objects.filter(groups=instance.group_id)
+        user_ids = list(user_ids.values_list("pk", flat=True))
+    else:
+        user_ids = [None]
+    agent_cache.invalidate(user_ids)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate agent cache of users whose groups changed."""
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif action == "pre_clear":
+        user_ids = list(instance.user_set.values_list("pk", flat=True))
+    else:
+        user_ids = pk_set
+    agent_cache.invalidate(user_ids)
+
+
+@receiver(m2m_changed)
+def reference_capability_map_changed(
+    sender, instance, action, reverse, model, pk_set, using, **kwargs
+):
+    """Keep `capability_map` of references in sync with their
+    `capabilities` relation.
+
+    Map is rebuilt for a reference whose capabilities changed. When
+    changed from capabilities' side, maps of affected references are reset
+    to NULL: they are then looked up through the relation.
+    """
+    reference_model = model if reverse else type(instance)
+    if (
+        not issubclass(reference_model, Reference)
+        or not reference_model.use_capability_map
+    ):
+        return
+
+    queryset = reference_model.objects.using(using)
+    cache = get_capability_cache()
+    if not reverse:
+        if action not in ("post_add", "post_remove", "post_clear"):
+            return
+        instance.capability_map = instance.get_capability_map(
+            instance.capabilities.all()
+        )
+        queryset.filter(pk=instance.pk).update(
+            capability_map=instance.capability_map
+        )
+        if cache is not None:
+            cache.discard(instance)
+        return
+
+    if action == "pre_clear":
+        queryset = queryset.filter(capabilities=instance)
+    elif action in ("post_add", "post_remove"):
+        queryset = queryset.filter(pk__in=pk_set)
+    else:
+        return
+    queryset.update(capability_map=None)
+    if cache is not None:
+        cache.clear()
+
+
+@receiver(references_revoked)
+@receiver(post_delete)
+def reference_revoked(sender, **kwargs):
+    """Increment revocation epoch of revoked or deleted references'
+    target, revoking its capability tokens."""
+    if not issubclass(sender, Reference):
+        return
+    reference = kwargs.get("reference") or kwargs.get("instance")
+    target = sender._meta.get_field("target").related_model
+    revocation_epochs.increment(
+        (target._meta.label_lower, reference.target_id)
+    )
+
+
+@receiver(m2m_changed)
+def reference_capabilities_removed(
+    sender, instance, action, reverse, model, pk_set, using, **kwargs
+):
+    """Increment revocation epoch of targets of references losing
+    capabilities, revoking their capability tokens."""
+    reference_model = model if reverse else type(instance)
+    if not issubclass(reference_model, Reference):
+        return
+    target = reference_model._meta.get_field("target").related_model
+    label = target._meta.label_lower
+
+    if not reverse:
+        if action in ("post_remove", "post_clear"):
+            revocation_epochs.increment((label, instance.target_id))
+        return
+
+    queryset = reference_model.objects.using(using)
+    if action == "pre_clear":
+        # before the relations are removed, as they are needed
+        queryset = queryset.filter(capabilities=instance)
+    elif action == "post_remove":
+        queryset = queryset.filter(pk__in=pk_set)
+    else:
+        return
+    for target_id in set(queryset.values_list("target_id", flat=True)):
+        revocation_epochs.increment((label, target_id))
+
+
+@receiver(references_revoked)
+@receiver(post_delete)
+def reference_index_revoked(sender, **kwargs):
+    """Refresh permission index of revoked or deleted references'
+    target."""
+    if not issubclass(sender, Reference) or not sender.use_permission_index:
+        return
+    reference = kwargs.get("reference") or kwargs.get("instance")
+    queryset = sender.objects.using(kwargs.get("using") or reference._state.db)
+    if "instance" in kwargs:
+        queryset.update_permission_index(
+            [reference.target_id], [reference.receiver_id]
+        )
+    else:
+        # receivers of the revoked subtree are unknown
+        queryset.update_permission_index([reference.target_id])
+
+
+@receiver(m2m_changed)
+def reference_capabilities_changed(
+    sender, instance, action, reverse, model, pk_set, using, **kwargs
+):
+    """Refresh permission index of references whose capabilities
+    changed."""
+    if reverse:
+        reference_model = model
+    else:
+        reference_model = type(instance)
+    if (
+        not issubclass(reference_model, Reference)
+        or not reference_model.use_permission_index
+    ):
+        return
+
+    queryset = reference_model.objects.using(using)
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            queryset.update_permission_index(
+                [instance.target_id], [instance.receiver_id]
+            )
+        return
+
+    # reverse side: instance is a capability, pk_set references' ids
+    if action == "pre_clear":
+        refs = queryset.filter(capabilities=instance)
+        instance._cleared_references = list(refs.values_list("pk", flat=True))
+        return
+    if action == "post_clear":
+        pk_set = instance.__dict__.pop("_cleared_references", ())
+    elif action not in ("post_add", "post_remove"):
+        return
+    targets = queryset.filter(pk__in=pk_set).values_list(
+        "target_id", flat=True
+    )
+    queryset.update_permission_index(set(targets))
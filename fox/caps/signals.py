@@ -0,0 +1,14 @@
+"""Signals sent by capabilities application."""
+from django.dispatch import Signal
+
+__all__ = ("references_revoked",)
+
+
+references_revoked = Signal()
+"""Sent once when references are revoked in bulk (see
+`ReferenceQuerySet.revoke()`).
+
+Arguments: ``sender`` (Reference model), ``reference`` (revoked root
+reference), ``capabilities`` (revoked capabilities names, None when
+references are deleted), ``count`` (number of affected references).
+"""
@@ -28,6 +28,20 @@ def agents(db, groups, user):
 
 
 # -- Capabilities
+@pytest.fixture
+def capability_map(monkeypatch):
+    """Use references' capability map."""
+    monkeypatch.setattr(ConcreteReference, "use_capability_map", True)
+
+
+@pytest.fixture(autouse=True)
+def capability_registry():
+    # registry is process-wide and test transactions are rolled back
+    Capability.registry.clear()
+    yield Capability.registry
+    Capability.registry.clear()
+
+
 @pytest.fixture
 def caps_names():
     return ["action_1", "action_2", "action_3"]
@@ -0,0 +1,51 @@
+from fox.caps.benchmarks import select_references, suite
+
+__all__ = ("TestSelectReferences", "TestSuite")
+
+
+class TestSelectReferences:
+    def test_plans_match(self, db):
+        agent = select_references.create_dataset(100)
+        plans = select_references.get_plans(agent)
+        expected = set(plans["subquery"].values_list("pk", flat=True))
+        assert len(expected) == 100 // select_references.AGENTS
+        for queryset in plans.values():
+            assert expected == set(queryset.values_list("pk", flat=True))
+
+    def test_run(self, db):
+        results = select_references.run([100], repeat=1)
+        assert len(results) == 3
+        assert all(r["count"] == results[0]["count"] for r in results)
+
+
+class TestSuite:
+    def test_create_dataset(self, db):
+        dataset = suite.create_dataset(
+            users=4, groups=2, objects=10, depth=2, fanout=2
+        )
+        assert len(dataset.agents) == 6
+        assert len(dataset.refs) == 10 * (1 + 2 + 4)
+        assert max(r.depth for r in dataset.refs) == 2
+
+    def test_run(self, db):
+        dataset = suite.create_dataset(users=1, groups=1, objects=10)
+        results = suite.run(dataset, repeat=2)
+        assert set(suite.benchmarks) == set(results)
+        for result in results.values():
+            assert result["repeat"] == 2
+            assert result["min_ms"] <= result["max_ms"]
+
+    def test_run_warm(self, db):
+        dataset = suite.create_dataset(users=1, groups=1, objects=10)
+        results = suite.run(dataset, ["middleware.warm"], repeat=2)
+        assert 0 == results["middleware.warm"]["queries"]
+
+    def test_measure_warmup(self, db):
+        calls = []
+        suite.measure(lambda: calls.append(1), repeat=2, warmup=1)
+        assert 3 == len(calls)
+
+    def test_compare(self):
+        results = {"a": {"median_ms": 2.0, "queries": 3}}
+        baseline = {"a": {"median_ms": 1.0, "queries": 4}, "b": {}}
+        assert {"a": (2.0, -1)} == suite.compare(results, baseline)
@@ -0,0 +1,140 @@
+import pytest
+
+from asgiref.sync import async_to_sync
+
+from fox.caps.cache import (
+    CapabilityCache,
+    agent_cache,
+    capability_cache,
+    get_capability_cache,
+)
+from fox.caps.models import Agent, CapabilitySet
+from fox.caps.permissions import IsAllowed
+from .app.models import ConcreteObject, ConcreteReference
+
+__all__ = (
+    "TestCapabilityCache",
+    "TestCapabilityCacheContext",
+    "TestAgentCache",
+)
+
+
+@pytest.fixture
+def reference(refs_3):
+    # do not use denormalized capabilities
+    reference = ConcreteReference.objects.get(pk=refs_3[0].pk)
+    reference.capability_map = None
+    return reference
+
+
+class TestCapabilityCache:
+    def test_get_capability(self, reference, caps_names):
+        cache = CapabilityCache()
+        capability = cache.get_capability(reference, caps_names[0])
+        assert capability.name == caps_names[0]
+        assert cache.get_capability(reference, "missing") is None
+
+    def test_get_capabilities_loads_once(
+        self, reference, caps_names, django_assert_num_queries
+    ):
+        cache = CapabilityCache()
+        with django_assert_num_queries(1):
+            for name in caps_names + ["missing"]:
+                cache.get_capability(reference, name)
+
+    def test_get_capabilities_not_cacheable(self, caps_set_1, caps_names):
+        cache = CapabilityCache()
+        assert cache.get_capability(caps_set_1, caps_names[0])
+        assert not cache.sets
+
+    def test_discard(self, reference, caps_names):
+        cache = CapabilityCache()
+        cache.get_capability(reference, caps_names[0])
+        cache.discard(reference)
+        assert not cache.sets
+
+
+class TestCapabilityCacheContext:
+    def test_capability_cache(self):
+        assert get_capability_cache() is None
+        with capability_cache() as cache:
+            assert get_capability_cache() is cache
+        assert get_capability_cache() is None
+
+    def test_get_capability_uses_cache(
+        self, reference, caps_names, django_assert_num_queries
+    ):
+        with capability_cache():
+            with django_assert_num_queries(1):
+                for name in caps_names:
+                    assert reference.get_capability(name)
+
+    def test_get_capability_without_cache(
+        self, reference, caps_names, django_assert_num_queries
+    ):
+        with django_assert_num_queries(len(caps_names)):
+            for name in caps_names:
+                assert reference.get_capability(name)
+
+    def test_capability_set_get_capability(self, caps_1, caps_names):
+        with capability_cache() as cache:
+            assert CapabilitySet(caps_1).get_capability(caps_names[0])
+            assert not cache.sets
+
+    def test_permission_uses_request_cache(
+        self, rf, refs_3, caps_names, django_assert_num_queries
+    ):
+        ref = refs_3[0]
+        obj = ConcreteObject.objects.ref(
+            ref.receiver, ref.ref, capabilities=False
+        )
+        obj.reference.capability_map = None
+        request = rf.get("/test")
+        request.capability_cache = CapabilityCache()
+
+        with django_assert_num_queries(1):
+            for name in caps_names:
+                assert IsAllowed(name).has_object_permission(
+                    request, None, obj
+                )
+            assert not IsAllowed("missing").has_object_permission(
+                request, None, obj
+            )
+
+
+@pytest.fixture
+def clear_agent_cache():
+    agent_cache.cache.clear()
+    yield agent_cache
+    agent_cache.cache.clear()
+
+
+class TestAgentCache:
+    def test_get_ids(
+        self, clear_agent_cache, user, agents, django_assert_num_queries
+    ):
+        ids = agent_cache.get_ids(user)
+        assert Agent.objects.ids(user) == ids
+        with django_assert_num_queries(0):
+            assert ids == agent_cache.get_ids(user)
+
+    def test_aget_ids(self, clear_agent_cache, user, agents):
+        ids = async_to_sync(agent_cache.aget_ids)(user)
+        assert Agent.objects.ids(user) == ids
+        assert ids == async_to_sync(agent_cache.aget_ids)(user)
+
+    def test_get_ids_invalidate_on_agent_save(
+        self, clear_agent_cache, user, agents
+    ):
+        ids = agent_cache.get_ids(user)
+        agent = Agent.objects.create(user=user, is_default=True)
+        ids_2 = agent_cache.get_ids(user)
+        assert ids | {agent.pk} == ids_2
+        assert agent.pk == ids_2.default
+
+    def test_get_ids_invalidate_on_groups_changed(
+        self, clear_agent_cache, user, groups, agents
+    ):
+        agent_cache.get_ids(user)
+        user.groups.add(groups[1])
+        assert agents[2].pk in agent_cache.get_ids(user)
@@ -0,0 +1,61 @@
+from django.apps import apps
+from django.db.migrations.state import ModelState, ProjectState
+
+from fox.caps import checks
+from .app.models import ConcreteReference
+
+__all__ = ("TestCheckReferenceIndexes",)
+
+
+def get_state(model_state=None):
+    state = ProjectState()
+    if model_state is not None:
+        state.add_model(model_state)
+    return state
+
+
+def get_model_state(indexes=None):
+    model_state = ModelState.from_model(ConcreteReference)
+    if indexes is not None:
+        model_state.options["indexes"] = indexes
+    return model_state
+
+
+class TestCheckReferenceIndexes:
+    def check(self, monkeypatch, state, migrated_apps=("caps_test",)):
+        monkeypatch.setattr(
+            checks, "get_migration_state", lambda: (state, migrated_apps)
+        )
+        app_configs = [apps.get_app_config("caps_test")]
+        errors = checks.check_reference_indexes(app_configs)
+        return [e for e in errors if e.obj is ConcreteReference]
+
+    def test_check(self, monkeypatch):
+        state = get_state(get_model_state())
+        assert not self.check(monkeypatch, state)
+
+    def test_check_missing(self, monkeypatch):
+        state = get_state(get_model_state(indexes=[]))
+        errors = self.check(monkeypatch, state)
+        assert ["fox_caps.W001"] * 2 == [e.id for e in errors]
+        assert ConcreteReference is errors[0].obj
+
+    def test_check_no_migration(self, monkeypatch):
+        errors = self.check(monkeypatch, get_state())
+        assert ["fox_caps.W002"] == [e.id for e in errors]
+
+    def test_check_unmigrated_app(self, monkeypatch):
+        state = get_state(get_model_state(indexes=[]))
+        assert not self.check(monkeypatch, state, migrated_apps=())
+
+    def test_get_missing_indexes(self):
+        model_state = get_model_state(indexes=[])
+        assert [("receiver", "ref"), ("receiver", "target")] == (
+            checks.get_missing_indexes(ConcreteReference, model_state)
+        )
+
+    def test_has_index(self):
+        assert ConcreteReference.has_index(["receiver", "ref"])
+        assert ConcreteReference.has_index(["origin", "receiver"])
+        assert ConcreteReference.has_index(["target"])
+        assert not ConcreteReference.has_index(["receiver", "depth"])
@@ -0,0 +1,112 @@
+import pytest
+from django.http import Http404
+
+from fox.caps.filters import ActionAllowedFilterBackend, ReceiverFilterBackend
+from fox.caps.models import Capability
+from .app.models import ConcreteObject, ConcreteReference
+
+__all__ = ("TestReceiverFilterBackend", "TestActionAllowedFilterBackend")
+
+
+class View:
+    lookup_field = "ref"
+
+    def __init__(self, action=None, **kwargs):
+        self.action = action
+        self.kwargs = kwargs
+
+
+@pytest.fixture
+def request_(rf, agents):
+    request = rf.get("/test")
+    request.agent = agents[0]
+    return request
+
+
+@pytest.fixture
+def allowed_refs(agents, objects):
+    name = Capability.get_name(ConcreteObject, "list")
+    return [
+        ConcreteReference.create(agents[0], objects[0], [name]),
+        ConcreteReference.create(agents[0], objects[1], ["other"]),
+        ConcreteReference.create(agents[1], objects[2], [name]),
+    ]
+
+
+class TestActionAllowedFilterBackend:
+    def test_filter_queryset(self, request_, objects, allowed_refs):
+        backend = ActionAllowedFilterBackend()
+        queryset = backend.filter_queryset(
+            request_, ConcreteObject.objects.all(), View("list")
+        )
+        assert [objects[0]] == list(queryset)
+
+    def test_filter_queryset_default_action(
+        self, request_, objects, allowed_refs
+    ):
+        backend = ActionAllowedFilterBackend("list")
+        view = View()
+        del view.action
+        queryset = backend.filter_queryset(
+            request_, ConcreteObject.objects.all(), view
+        )
+        assert [objects[0]] == list(queryset)
+
+        # as IsActionAllowed, view's action is not overridden
+        queryset = backend.filter_queryset(
+            request_, ConcreteObject.objects.all(), View()
+        )
+        assert not queryset.exists()
+
+    def test_filter_queryset_no_action(self, request_, allowed_refs):
+        backend = ActionAllowedFilterBackend()
+        queryset = backend.filter_queryset(
+            request_, ConcreteObject.objects.all(), View()
+        )
+        assert not queryset.exists()
+
+
+class TestReceiverFilterBackend:
+    def test_filter_queryset(self, request_, objects, allowed_refs):
+        backend = ReceiverFilterBackend()
+        queryset = backend.filter_queryset(
+            request_, ConcreteObject.objects.all(), View("list")
+        )
+        result = sorted(queryset, key=lambda o: o.pk)
+        assert objects[:2] == result
+        assert [r.reference for r in result] == allowed_refs[:2]
+
+    def test_filter_queryset_ref(self, request_, objects, allowed_refs):
+        backend = ReceiverFilterBackend()
+        view = View("retrieve", ref=allowed_refs[1].ref)
+        queryset = backend.filter_queryset(
+            request_, ConcreteObject.objects.all(), view
+        )
+        assert [objects[1]] == list(queryset)
+
+    def test_filter_queryset_ref_other_receiver(self, request_, allowed_refs):
+        backend = ReceiverFilterBackend()
+        view = View("retrieve", ref=allowed_refs[2].ref)
+        queryset = backend.filter_queryset(
+            request_, ConcreteObject.objects.all(), view
+        )
+        assert not queryset.exists()
+
+    def test_get_ref(self, request_, allowed_refs):
+        backend = ReceiverFilterBackend()
+        ref = allowed_refs[0].ref
+        assert backend.get_ref(request_, View()) is None
+        assert ref == backend.get_ref(request_, View(ref=ref))
+        assert ref == backend.get_ref(request_, View(ref=str(ref)))
+        with pytest.raises(Http404):
+            backend.get_ref(request_, View(ref="invalid"))
+
+    def test_get_prefetch_capabilities(self, monkeypatch):
+        backend = ReceiverFilterBackend()
+        queryset = ConcreteObject.objects.all()
+        assert backend.get_prefetch_capabilities(queryset, View())
+        monkeypatch.setattr(ConcreteReference, "use_capability_map", True)
+        assert not backend.get_prefetch_capabilities(queryset, View())
+        view = View()
+        view.prefetch_capabilities = True
+        assert backend.get_prefetch_capabilities(queryset, view)
@@ -0,0 +1,157 @@
+import json
+import logging
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.http import HttpResponse
+
+from fox.caps import instrumentation
+from fox.caps.cache import agent_cache, capability_cache
+from fox.caps.instrumentation import (
+    CallbackReporter,
+    HeaderReporter,
+    LoggingReporter,
+    Metrics,
+    acollect_metrics,
+    collect_metrics,
+    get_metrics,
+)
+from fox.caps.middleware import AgentMiddleware
+from fox.caps.permissions import IsAllowed
+from .app.models import ConcreteObject
+
+__all__ = ("TestMetrics", "TestCollectMetrics", "TestReporters")
+
+
+class TestMetrics:
+    def test_incr(self):
+        metrics = Metrics()
+        metrics.incr("a")
+        metrics.incr("a", 2)
+        assert {"a": 3} == metrics.as_dict()["counters"]
+
+    def test_timer(self):
+        metrics = Metrics()
+        with metrics.timer("a"):
+            with metrics.timer("b"):
+                assert ["a", "b"] == metrics.sections
+        assert not metrics.sections
+        assert {"a", "b"} == set(metrics.as_dict()["timers"])
+
+
+class TestCollectMetrics:
+    def test_disabled(self):
+        assert get_metrics() is None
+        instrumentation.incr("a")
+        with instrumentation.timer("a"):
+            pass
+
+    def test_collect_metrics(self):
+        with collect_metrics() as metrics:
+            assert metrics is get_metrics()
+            instrumentation.incr("a")
+        assert get_metrics() is None
+        assert 1 == metrics.counters["a"]
+
+    def test_queries(self, agents, refs, caps_names):
+        agent = agents[0]
+        with collect_metrics() as metrics, capability_cache():
+            objects = list(ConcreteObject.objects.receiver(agent))
+            for obj in objects * 2:
+                IsAllowed(caps_names[0]).has_object_permission(None, None, obj)
+
+        counters = metrics.counters
+        assert 3 == counters["queries"] == counters["queries.objects"]
+        assert len(objects) == counters["references"]
+        assert 2 * len(objects) == counters["capability_checks"]
+        assert len(objects) == counters["capability_cache.misses"]
+        assert len(objects) == counters["capability_cache.hits"]
+        assert {"objects", "permissions"} == set(metrics.timers)
+
+    def test_acollect_metrics(self, agents, refs):
+        async def run():
+            async with acollect_metrics() as metrics:
+                assert metrics is get_metrics()
+                await ConcreteObject.objects.areceiver(agents[0])
+            return metrics
+
+        metrics = async_to_sync(run)()
+        assert get_metrics() is None
+        counters = metrics.counters
+        assert 3 == counters["queries"] == counters["queries.objects"]
+
+    def test_derive(self, agents, refs_3):
+        with collect_metrics() as metrics:
+            refs_3[0].derive(agents[1], update=True)
+        assert metrics.counters["queries.derive"]
+        assert "derive" in metrics.timers
+
+
+@pytest.fixture
+def reports():
+    return []
+
+
+@pytest.fixture
+def middleware(reports):
+    middleware = AgentMiddleware(
+        lambda request: HttpResponse(str(request.agent.pk))
+    )
+    middleware.metrics_reporter = CallbackReporter(
+        lambda *args: reports.append(args)
+    )
+    return middleware
+
+
+class TestReporters:
+    def test_middleware(self, middleware, reports, rf, user, agents):
+        request = rf.get("/test")
+        request.user = user
+        response = middleware(request)
+
+        assert [(request, response, request.caps_metrics)] == reports
+        counters = request.caps_metrics.counters
+        assert counters["agent_cache.misses"] == 1
+        assert counters["queries.middleware"] >= 1
+
+    def test_amiddleware(self, reports, rf, user, agents):
+        async def get_response(request):
+            agent = await request.aagent()
+            return HttpResponse(str(agent.pk))
+
+        agent_cache.cache.clear()
+        middleware = AgentMiddleware(get_response)
+        middleware.metrics_reporter = CallbackReporter(
+            lambda *args: reports.append(args)
+        )
+        request = rf.get("/test")
+        request.user = user
+        response = async_to_sync(middleware)(request)
+
+        assert str(agents[0].pk) == response.content.decode()
+        assert [(request, response, request.caps_metrics)] == reports
+        counters = request.caps_metrics.counters
+        assert counters["agent_cache.misses"] == 1
+        assert counters["queries.middleware"] >= 1
+        assert counters["queries"] >= 1
+
+    def test_header_reporter(self, settings):
+        response, metrics = HttpResponse(), Metrics()
+        metrics.incr("a")
+        settings.DEBUG = True
+        HeaderReporter().report(None, response, metrics)
+        header = json.loads(response[HeaderReporter.header])
+        assert {"a": 1} == header["counters"]
+
+    def test_header_reporter_no_debug(self, settings):
+        response = HttpResponse()
+        settings.DEBUG = False
+        HeaderReporter().report(None, response, Metrics())
+        assert HeaderReporter.header not in response
+
+    def test_logging_reporter(self, rf, caplog):
+        metrics = Metrics()
+        metrics.incr("a")
+        with caplog.at_level(logging.INFO, "fox.caps.metrics"):
+            LoggingReporter().report(rf.get("/test"), None, metrics)
+        assert '"a": 1' in caplog.text
@@ -0,0 +1,119 @@
+import pytest
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.contrib.auth.models import AnonymousUser
+
+from fox.caps.cache import agent_cache
+from fox.caps.middleware import AgentMiddleware
+from fox.caps.models import Agent
+
+__all__ = ("TestAgentMiddleware",)
+
+
+@pytest.fixture(autouse=True)
+def clear_agent_cache():
+    agent_cache.cache.clear()
+    yield
+    agent_cache.cache.clear()
+
+
+@pytest.fixture
+def middleware():
+    return AgentMiddleware(lambda request: request)
+
+
+@pytest.fixture
+def amiddleware():
+    async def get_response(request):
+        return request
+
+    return AgentMiddleware(get_response)
+
+
+@pytest.fixture
+def request_(rf, user):
+    request = rf.get("/test")
+    request.user = user
+    return request
+
+
+class TestAgentMiddleware:
+    def test_call_is_lazy(
+        self, middleware, request_, agents, django_assert_num_queries
+    ):
+        with django_assert_num_queries(0):
+            middleware(request_)
+
+    def test_call(self, middleware, request_, agents):
+        request = middleware(request_)
+        assert agents[0] == request.agent
+        assert request.capability_cache is not None
+
+    def test_call_cached(
+        self, middleware, rf, user, agents, django_assert_num_queries
+    ):
+        request = rf.get("/test")
+        request.user = user
+        middleware(request).agent.pk
+
+        request = rf.get("/test")
+        request.user = user
+        with django_assert_num_queries(0):
+            assert agents[0].pk == middleware(request).agent.pk
+
+    def test_get_agent_cookie(self, middleware, request_, agents):
+        request_.COOKIES[middleware.agent_cookie_key] = str(agents[1].ref)
+        assert agents[1] == middleware(request_).agent
+
+    def test_get_agent_anonymous(self, middleware, rf, db):
+        agent = Agent.objects.create()
+        request = rf.get("/test")
+        request.user = AnonymousUser()
+        assert agent == middleware(request).agent
+
+    def test_cache_invalidate_on_agent_save(
+        self, middleware, request_, user, agents
+    ):
+        middleware(request_).agent.pk
+        assert agent_cache.get(user) is not None
+        Agent.objects.create(user=user, is_default=True)
+        assert agent_cache.get(user) is None
+
+    def test_cache_invalidate_on_group_agent_save(
+        self, middleware, request_, user, groups, agents
+    ):
+        middleware(request_).agent.pk
+        agents[1].save()
+        assert agent_cache.get(user) is None
+
+    def test_cache_invalidate_on_groups_changed(
+        self, middleware, request_, user, groups, agents
+    ):
+        middleware(request_).agent.pk
+        user.groups.add(groups[1])
+        assert agent_cache.get(user) is None
+
+        middleware(request_).agent.pk
+        groups[0].user_set.clear()
+        assert agent_cache.get(user) is None
+
+    def test_acall(self, amiddleware, request_, agents):
+        assert iscoroutinefunction(amiddleware)
+        request = async_to_sync(amiddleware)(request_)
+        assert request.capability_cache is not None
+        assert agents[0] == async_to_sync(request.aagent)()
+        # resolved once
+        assert request.agent == request._cached_agent
+
+    def test_acall_cached(
+        self, amiddleware, rf, user, agents, django_assert_num_queries
+    ):
+        request = rf.get("/test")
+        request.user = user
+        request = async_to_sync(amiddleware)(request)
+        async_to_sync(request.aagent)()
+
+        request = rf.get("/test")
+        request.user = user
+        with django_assert_num_queries(0):
+            request = async_to_sync(amiddleware)(request)
+            assert agents[0].pk == async_to_sync(request.aagent)().pk
@@ -1,7 +1,9 @@
+import pickle
+
 import pytest
 from django.core.exceptions import ValidationError
 
-from fox.caps.models import Agent
+from fox.caps.models import Agent, AgentIds
 
 __all__ = ("TestAgentQuerySet", "TestAgent")
 
@@ -29,6 +31,24 @@ class TestAgentQuerySet:
             assert queryset.count() == 1
             assert group == next(iter(queryset)).group
 
+    def test_members(self, user, groups, agents):
+        queryset = Agent.objects.members(groups[0])
+        assert [agents[0]] == list(queryset)
+        assert not Agent.objects.members(groups[1]).exists()
+
+    def test_ids(self, user, agents):
+        agents[0].is_default = True
+        agents[0].save()
+        ids = Agent.objects.ids(user)
+        assert isinstance(ids, AgentIds)
+        assert {agents[0].pk, agents[1].pk} == ids
+        assert agents[0].pk == ids.default
+
+    def test_ids_pickle(self):
+        ids = pickle.loads(pickle.dumps(AgentIds([1, 2], default=1)))
+        assert {1, 2} == ids
+        assert 1 == ids.default
+
 
 class TestAgent:
     def test_is_anonymous_return_true(self):
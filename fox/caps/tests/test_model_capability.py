@@ -1,18 +1,64 @@
 import pytest
-from asgiref.sync import sync_to_async
+from asgiref.sync import async_to_sync
 from django.core.exceptions import PermissionDenied
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 
 __all__ = (
+    "TestCapabilityRegistry",
     "TestCapabilityQuerySet",
     "TestCapability",
 )
 
 
 from fox.caps.models import Capability
+from fox.caps.models.capability import CapabilityRegistry
+from .app.models import ConcreteObject
+
+
+class TestCapabilityRegistry:
+    def test_add_and_get(self):
+        registry = CapabilityRegistry()
+        registry.add("default", [Capability(pk=1, name="a", max_derive=1)])
+        assert 1 == registry.get("default", "a", 1)
+        assert registry.get("default", "a", 0) is None
+        assert registry.get("other", "a", 1) is None
+
+    def test_add_ignore_unsaved(self):
+        registry = CapabilityRegistry()
+        registry.add("default", [Capability(name="a", max_derive=1)])
+        assert not registry.items
+
+    def test_add_bounded(self):
+        registry = CapabilityRegistry(max_size=2)
+        registry.add(
+            "default",
+            [Capability(pk=i, name="a", max_derive=i) for i in range(1, 4)],
+        )
+        assert 2 == len(registry.items)
+        assert registry.get("default", "a", 1) is None
+        assert 3 == registry.get("default", "a", 3)
+
+    def test_resolve(self):
+        registry = CapabilityRegistry()
+        registry.add("default", [Capability(pk=1, name="a", max_derive=1)])
+        items = [
+            Capability(name="a", max_derive=1),
+            Capability(name="b", max_derive=1),
+        ]
+        missing = registry.resolve("default", items)
+        assert 1 == items[0].pk
+        assert [items[1]] == missing
+
+    def test_discard(self):
+        registry = CapabilityRegistry()
+        registry.add("default", [Capability(pk=1, name="a", max_derive=1)])
+        registry.discard("default", "a", 1)
+        assert registry.get("default", "a", 1) is None
 
 
 class TestCapabilityQuerySet:
-    def test_get_or_create_many(self):
+    def test_get_or_create_many(self, db):
         subset = [
             Capability(name="action_1", max_derive=1),
             Capability(name="action_2", max_derive=1),
@@ -20,26 +66,129 @@ class TestCapabilityQuerySet:
         subset[0].save()
         result = Capability.objects.get_or_create_many(subset)
 
-        assert len(subset) == result.count()
+        assert len(subset) == len(result)
         for item in subset:
             assert item.pk is not None
 
-    async def test_aget_or_create_many(self):
+    def test_aget_or_create_many(
+        self, db, capability_registry, django_capture_on_commit_callbacks
+    ):
         subset = [
             Capability(name="action_1", max_derive=1),
             Capability(name="action_2", max_derive=1),
+            Capability(name="action_2", max_derive=1),
         ]
-        sync_to_async(subset[0].save)
-        result = await Capability.objects.aget_or_create_many(subset)
+        existing = Capability.objects.create(name="action_1", max_derive=1)
+        with django_capture_on_commit_callbacks(execute=True):
+            result = async_to_sync(
+                Capability.objects.all().aget_or_create_many
+            )(subset)
+
+        assert subset == result
+        assert existing.pk == subset[0].pk
+        assert subset[1].pk == subset[2].pk
+        expected = Capability.objects.get(name="action_2", max_derive=1)
+        assert expected.pk == subset[1].pk
+        assert existing.pk == capability_registry.get("default", "action_1", 1)
+        assert expected.pk == capability_registry.get("default", "action_2", 1)
+
+    def test_get_or_create_many_registry(
+        self,
+        db,
+        capability_registry,
+        django_assert_num_queries,
+        django_capture_on_commit_callbacks,
+    ):
+        with django_capture_on_commit_callbacks(execute=True):
+            Capability.objects.get_or_create_many(
+                [Capability(name="action_1", max_derive=1)]
+            )
+        assert capability_registry.get("default", "action_1", 1)
+
+        subset = [Capability(name="action_1", max_derive=1)]
+        with django_assert_num_queries(0):
+            Capability.objects.get_or_create_many(subset)
+        assert subset[0].pk is not None
+
+    def test_get_or_create_many_registry_delete(
+        self, db, capability_registry, django_capture_on_commit_callbacks
+    ):
+        with django_capture_on_commit_callbacks(execute=True):
+            Capability.objects.get_or_create_many(
+                [Capability(name="action_1", max_derive=1)]
+            )
+        Capability.objects.filter(name="action_1").delete()
+        assert capability_registry.get("default", "action_1", 1) is None
+
+    def test_aget_or_create_many_rollback(
+        self, db, capability_registry, django_capture_on_commit_callbacks
+    ):
+        aget_or_create_many = async_to_sync(
+            Capability.objects.all().aget_or_create_many
+        )
 
-        assert len(subset) == await result.acount()
-        for item in subset:
-            assert item.pk is not None
+        def rollback():
+            with transaction.atomic():
+                aget_or_create_many([Capability(name="action_1")])
+                raise RuntimeError("rollback")
 
-    # TODO: test__get_items_queryset
+        with django_capture_on_commit_callbacks(execute=True):
+            pytest.raises(RuntimeError, rollback)
+        assert capability_registry.get("default", "action_1", 0) is None
+
+        other = Capability.objects.get_or_create_many(
+            [Capability(name="action_2")]
+        )
+        result = Capability.objects.get_or_create_many(
+            [Capability(name="action_1")]
+        )
+        assert other[0].pk != result[0].pk
+        assert "action_1" == Capability.objects.get(pk=result[0].pk).name
+
+    def test_get_or_create_many_duplicates(self, db):
+        subset = [
+            Capability(name="action_1", max_derive=1),
+            Capability(name="action_1", max_derive=1),
+            Capability(name="action_1", max_derive=2),
+        ]
+        result = Capability.objects.get_or_create_many(subset)
+        assert 2 == len({r.pk for r in result})
+        assert subset[0].pk == subset[1].pk
+        assert subset[0].pk != subset[2].pk
+
+    def test_get_or_create_many_existing_max_derive(
+        self, db, django_assert_num_queries
+    ):
+        Capability.objects.create(name="action_1", max_derive=1)
+        subset = [
+            Capability(name="action_1", max_derive=1),
+            Capability(name="action_1", max_derive=2),
+            Capability(name="action_2", max_derive=0),
+        ]
+        with django_assert_num_queries(2):
+            Capability.objects.get_or_create_many(subset)
+        assert all(item.pk for item in subset)
+        assert 3 == Capability.objects.count()
+
+    def test_get_or_create_many_large(self, db):
+        items = [
+            Capability(name="action_{}".format(i), max_derive=i % 3)
+            for i in range(1500)
+        ]
+        with CaptureQueriesContext(connection) as context:
+            Capability.objects.get_or_create_many(items)
+        # insertion may be batched by the backend, not the fetch
+        queries = [q["sql"] for q in context.captured_queries]
+        assert 1 == len([q for q in queries if q.startswith("SELECT")])
+        assert all(item.pk for item in items)
+        assert 1500 == len({item.pk for item in items})
 
 
 class TestCapability:
+    def test_get_name(self):
+        name = Capability.get_name(ConcreteObject, "retrieve")
+        assert "concreteobject_retrieve" == name
+
     def test_into_tuple(self):
         expected = Capability(name="action", max_derive=12)
         values = (
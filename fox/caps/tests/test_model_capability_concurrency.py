@@ -0,0 +1,49 @@
+"""Stress `CapabilityQuerySet.get_or_create_many` from multiple processes
+sharing a SQLite database file.
+
+Worker processes configure their own Django settings: models must not be
+imported at module level.
+"""
+import multiprocessing
+
+from fox.caps.benchmarks import setup_django
+
+__all__ = ("test_get_or_create_many_concurrent",)
+
+
+WORKERS = 4
+ROUNDS = 20
+
+
+def migrate(path):
+    setup_django(path, timeout=30)
+
+
+def get_or_create_many(path):
+    setup_django(path, migrate=False, timeout=30)
+    from fox.caps.models import Capability
+
+    results = {}
+    for i in range(ROUNDS):
+        items = [
+            Capability(name="action_{}_{}".format(i, j), max_derive=k)
+            for j in range(5)
+            for k in range(3)
+        ]
+        Capability.objects.get_or_create_many(items)
+        results.update(((r.name, r.max_derive), r.pk) for r in items)
+    return results
+
+
+def test_get_or_create_many_concurrent(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(WORKERS) as pool:
+        pool.apply(migrate, (path,))
+        results = pool.map(get_or_create_many, [path] * WORKERS)
+
+    expected = results[0]
+    assert ROUNDS * 5 * 3 == len(expected)
+    assert all(pk is not None for pk in expected.values())
+    for result in results[1:]:
+        assert expected == result
@@ -1,17 +1,26 @@
 import pytest
+from asgiref.sync import async_to_sync
 from django.core.exceptions import PermissionDenied
 
 from fox.utils.test import assertCountEqual
 
-__all__ = ("TestCapabilitySet",)
+__all__ = (
+    "TestCapabilitySet",
+    "TestCapabilityValue",
+    "TestFrozenCapabilitySet",
+)
 
 
-from fox.caps.models import Capability, CapabilitySet
+from fox.caps.models import (
+    Capability,
+    CapabilitySet,
+    CapabilityValue,
+    FrozenCapabilitySet,
+)
 
 
 # Test both CapabilitySet and BaseCapabilitySet
 class TestCapabilitySet:
-    # TODO: derive_caps, aderive_caps, aderive
     def test_is_derived(self, caps_set_3, caps_set_2):
         assert caps_set_3.is_derived(caps_set_2)
         assert not caps_set_2.is_derived(caps_set_3)
@@ -38,6 +47,27 @@ class TestCapabilitySet:
         capabilities = caps_set_3.derive_caps(args)
         assertCountEqual(expected, capabilities)
 
+    def test_aderive_caps(self, db, caps_names, caps_set_2):
+        args = [(name, 0) for name in caps_names]
+        capabilities = async_to_sync(caps_set_2.aderive_caps)(args)
+        assertCountEqual(caps_set_2.derive_caps(args), capabilities)
+        assert all(c.pk for c in capabilities)
+
+    def test_aderive_caps_without_arg(self, db, caps_names, caps_set_2):
+        expected = [Capability(name=name, max_derive=0) for name in caps_names]
+        capabilities = async_to_sync(caps_set_2.aderive_caps)()
+        assertCountEqual(expected, capabilities)
+
+    def test_aderive_caps_fail(self, db, caps_names, caps_set_2):
+        with pytest.raises(PermissionDenied):
+            async_to_sync(caps_set_2.aderive_caps)(caps_names + ["missing"])
+
+    def test_aderive(self, db, caps_names, caps_set_2):
+        result = async_to_sync(caps_set_2.aderive)(caps_names)
+        expected = [Capability(name=name, max_derive=0) for name in caps_names]
+        assertCountEqual(expected, result.capabilities)
+        assert all(c.pk for c in result.capabilities)
+
     def test_derive_caps_fail_missing_cap(self, caps_names, caps_set_3):
         with pytest.raises(PermissionDenied):
             caps_set_3.derive_caps(caps_names + ["missing_one"])
@@ -64,3 +94,97 @@ class TestCapabilitySet:
 #    def test_extend(self):
 #        self.caps_set_2.extend([Capability(name="action", max_derive=1)])
 #        self.assertEqual("action", self.caps_set_2["action"].name)
+
+
+class TestCapabilityValue:
+    def test_into(self):
+        expected = CapabilityValue("action", 2)
+        values = (
+            ("action", 2),
+            ["action", 2],
+            Capability(name="action", max_derive=2),
+            expected,
+        )
+        for value in values:
+            assert expected == CapabilityValue.into(value)
+        assert CapabilityValue("action", 0) == CapabilityValue.into("action")
+
+    def test_is_derived(self):
+        value = CapabilityValue("action", 2)
+        assert value.is_derived(CapabilityValue("action", 1))
+        assert not value.is_derived(CapabilityValue("action", 2))
+        assert not value.is_derived(CapabilityValue("other", 0))
+
+    def test_derive(self):
+        assert CapabilityValue("a", 1) == CapabilityValue("a", 2).derive()
+        with pytest.raises(PermissionDenied):
+            CapabilityValue("a", 0).derive()
+
+    def test_hash(self):
+        assert len({CapabilityValue("a", 1), CapabilityValue("a", 1)}) == 1
+
+
+@pytest.fixture
+def frozen_set(caps_3):
+    return FrozenCapabilitySet(caps_3)
+
+
+class TestFrozenCapabilitySet:
+    def test_init(self, frozen_set, caps_3):
+        assert {c.name: c.max_derive for c in caps_3} == frozen_set.map
+        assert not hasattr(frozen_set, "__dict__")
+
+    def test_init_keep_max_derive(self):
+        items = FrozenCapabilitySet([("a", 1), ("a", 3), ("a", 2)])
+        assert {"a": 3} == items.map
+
+    def test_immutable(self, frozen_set):
+        with pytest.raises(TypeError):
+            frozen_set.map["a"] = 1
+        with pytest.raises(AttributeError):
+            frozen_set.other = 1
+
+    def test_from_values(self, frozen_set):
+        values = list(frozen_set.map.items())
+        assert frozen_set == FrozenCapabilitySet.from_values(values)
+
+    def test_from_queryset(
+        self, db, frozen_set, caps_3, django_assert_num_queries
+    ):
+        Capability.objects.get_or_create_many(caps_3)
+        queryset = Capability.objects.filter(pk__in=[c.pk for c in caps_3])
+        with django_assert_num_queries(1):
+            assert frozen_set == FrozenCapabilitySet.from_queryset(queryset)
+
+    def test_get_capability(self, frozen_set, caps_names):
+        assert CapabilityValue(caps_names[0], 2) == frozen_set.get_capability(
+            caps_names[0]
+        )
+        assert frozen_set.get_capability("missing") is None
+        assert caps_names[0] in frozen_set
+
+    def test_is_derived(self, frozen_set, caps_set_2, caps_set_1):
+        assert frozen_set.is_derived(caps_set_2)
+        assert frozen_set.is_derived(
+            FrozenCapabilitySet(caps_set_1.capabilities)
+        )
+        assert not frozen_set.is_derived(frozen_set)
+        assert not frozen_set.is_derived(FrozenCapabilitySet(["missing"]))
+
+    def test_derive(self, frozen_set, caps_names):
+        derived = frozen_set.derive([(caps_names[0], 1)])
+        assert {caps_names[0]: 1} == derived.map
+        with pytest.raises(PermissionDenied):
+            frozen_set.derive([(caps_names[0], 2)])
+
+    def test_issubset(self, frozen_set, caps_names):
+        subset = FrozenCapabilitySet([(caps_names[0], 1)])
+        assert subset.issubset(frozen_set)
+        assert frozen_set.issubset(frozen_set)
+        assert not frozen_set.issubset(subset)
+
+    def test_eq_hash(self, frozen_set, caps_3):
+        other = FrozenCapabilitySet(reversed(caps_3))
+        assert frozen_set == other
+        assert hash(frozen_set) == hash(other)
+        assert frozen_set != FrozenCapabilitySet()
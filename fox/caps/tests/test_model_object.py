@@ -1,11 +1,13 @@
 # FIXME:
 # TestObjectQuerySet -> inherit from TestBaseReference
 import pytest
+from asgiref.sync import async_to_sync
 
-from fox.caps.models import Reference
+from fox.caps.models import Agent, Capability, Reference
 from fox.caps.models.object import Object, ObjectBase
+from fox.caps.permissions import IsAllowed
 from fox.utils.test import assertCountEqual
-from .app.models import AbstractObject, ConcreteObject
+from .app.models import AbstractObject, ConcreteObject, ConcreteReference
 
 __all__ = (
     "TestObjectManager",
@@ -85,3 +87,90 @@ class TestObjectQuerySet:
             refs = [r for r in refs if r.receiver != agent]
             result = ConcreteObject.objects.refs(agent, [r.ref for r in refs])
             assert not result.exists()
+
+    def test_receiver(self, agents, refs):
+        for agent in agents:
+            expected = [r for r in refs if r.receiver == agent]
+            result = ConcreteObject.objects.receiver(agent)
+            assertCountEqual(
+                {r.target_id for r in expected}, (r.pk for r in result)
+            )
+
+    def test_refs_prefetch_capabilities(
+        self, agents, refs, caps_names, django_assert_num_queries
+    ):
+        agent = agents[0]
+        items = [r.ref for r in refs if r.receiver == agent]
+        # objects, references, capabilities
+        with django_assert_num_queries(3):
+            objects = list(ConcreteObject.objects.refs(agent, items))
+
+        assert objects
+        with django_assert_num_queries(0):
+            for obj in objects:
+                for name in caps_names:
+                    assert IsAllowed(name).has_object_permission(
+                        None, None, obj
+                    )
+
+    def test_refs_without_capabilities(
+        self, agents, refs, django_assert_num_queries
+    ):
+        agent = agents[0]
+        items = [r.ref for r in refs if r.receiver == agent]
+        with django_assert_num_queries(2):
+            list(ConcreteObject.objects.refs(agent, items, capabilities=False))
+
+    def test_aref(self, refs):
+        for ref in refs:
+            result = async_to_sync(ConcreteObject.objects.all().aref)(
+                ref.receiver, ref.ref
+            )
+            assert ref == result.reference
+
+    def test_arefs(self, agents, refs):
+        agent = agents[0]
+        expected = [r for r in refs if r.receiver == agent]
+        result = async_to_sync(ConcreteObject.objects.all().arefs)(
+            agent, [r.ref for r in expected]
+        )
+        assertCountEqual(expected, [r.reference for r in result])
+
+    def test_areceiver(self, agents, refs):
+        agent = agents[0]
+        expected = {r.target_id for r in refs if r.receiver == agent}
+        result = async_to_sync(ConcreteObject.objects.all().areceiver)(agent)
+        assertCountEqual(expected, [r.pk for r in result])
+
+    def test_receiver_many(
+        self, user, agents, refs, django_assert_num_queries
+    ):
+        receivers = Agent.objects.user(user)
+        ids = set(receivers.values_list("pk", flat=True))
+        expected = {}
+        for ref in sorted(refs, key=lambda r: (r.depth, r.pk)):
+            if ref.receiver_id in ids:
+                expected.setdefault(ref.target_id, ref)
+
+        for receiver in (receivers, Agent.objects.ids(user), list(receivers)):
+            # objects, references, capabilities
+            with django_assert_num_queries(3):
+                result = list(ConcreteObject.objects.receiver(receiver))
+            assert expected == {r.pk: r.reference for r in result}
+            assert len(expected) == len(result)
+        assert len(expected) < len([r for r in refs if r.receiver_id in ids])
+
+    def test_allowed(self, agents, refs, caps_names):
+        agent = agents[0]
+        expected = {r.target_id for r in refs if r.receiver == agent}
+        result = ConcreteObject.objects.allowed(agent, caps_names[:1])
+        assertCountEqual(expected, [r.pk for r in result])
+        assert not ConcreteObject.objects.allowed(agent, ["missing"]).exists()
+
+    def test_allowed_action(self, agents, objects):
+        name = Capability.get_name(ConcreteObject, "retrieve")
+        ConcreteReference.create(agents[0], objects[0], [name])
+        ConcreteReference.create(agents[0], objects[1], ["other"])
+        result = ConcreteObject.objects.allowed(agents[0], "retrieve")
+        assert [objects[0].pk] == [r.pk for r in result]
+        assert not ConcreteObject.objects.allowed(agents[1], "retrieve")
@@ -0,0 +1,198 @@
+import io
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.utils.functional import SimpleLazyObject
+
+from fox.caps.cache import agent_cache
+from fox.caps.middleware import AgentMiddleware
+from fox.caps.models import (
+    Capability,
+    CapabilityValue,
+    PermissionIndex,
+    PermissionIndexQuerySet,
+)
+from fox.caps.permissions import IsActionAllowed
+from .app.models import ConcreteObject, ConcreteReference
+
+__all__ = ("TestPermissionIndexQuerySet", "TestPermissionIndexMaintenance")
+
+
+@pytest.fixture
+def use_index(db, monkeypatch):
+    monkeypatch.setattr(ConcreteReference, "use_permission_index", True)
+
+
+def get_rows():
+    return set(
+        PermissionIndex.objects.values_list(
+            "agent_id", "target_id", "name", "max_derive"
+        )
+    )
+
+
+def get_expected():
+    queryset = ConcreteReference.objects.all()
+    return set(queryset.capability_rows("receiver_id", "target_id"))
+
+
+class TestPermissionIndexQuerySet:
+    def test_lookup(self, use_index, agents, refs, caps_names):
+        rows = PermissionIndex.objects.lookup(
+            agents[0], ConcreteObject, caps_names[:1]
+        )
+        expected = {r.target_id for r in refs if r.receiver == agents[0]}
+        assert expected == set(rows.values_list("target_id", flat=True))
+
+    def test_lookup_lazy(self, use_index, agents, refs, caps_names):
+        for agent, expected in (
+            (SimpleLazyObject(lambda: agents[0]), True),
+            (SimpleLazyObject(lambda: None), False),
+        ):
+            rows = PermissionIndex.objects.lookup(
+                agent, ConcreteObject, caps_names[:1]
+            )
+            assert expected == rows.exists()
+
+    def test_get_capability(self, use_index, agents, refs_3, caps_names):
+        obj = refs_3[0].target
+        value = PermissionIndex.objects.get_capability(
+            agents[0], obj, caps_names[0]
+        )
+        assert CapabilityValue(caps_names[0], 2) == value
+        assert not PermissionIndex.objects.get_capability(
+            agents[1], obj, caps_names[0]
+        )
+
+    def test_rebuild(self, agents, refs):
+        assert not PermissionIndex.objects.exists()
+        count = PermissionIndex.objects.rebuild(ConcreteReference, 2)
+        assert get_expected() == get_rows()
+        assert len(get_rows()) == count
+
+    def test_rebuild_keep_rows(self, use_index, refs, monkeypatch):
+        expected = get_rows()
+        counts = []
+        refresh = PermissionIndexQuerySet.refresh
+
+        def wrapper(self, *args, **kwargs):
+            counts.append(PermissionIndex.objects.count())
+            return refresh(self, *args, **kwargs)
+
+        monkeypatch.setattr(PermissionIndexQuerySet, "refresh", wrapper)
+        PermissionIndex.objects.rebuild(ConcreteReference, 1)
+        assert {len(expected)} == set(counts)
+        assert expected == get_rows()
+
+    def test_rebuild_stale(self, use_index, agents, refs):
+        obj = ConcreteObject.objects.create(name="stale")
+        content_type = ContentType.objects.get_for_model(ConcreteObject)
+        PermissionIndex.objects.create(
+            agent=agents[0],
+            content_type=content_type,
+            target_id=obj.pk,
+            name="stale",
+        )
+        PermissionIndex.objects.rebuild(ConcreteReference)
+        assert get_expected() == get_rows()
+
+    def test_rebuild_command(self, use_index, refs):
+        PermissionIndex.objects.all().delete()
+        stdout = io.StringIO()
+        call_command(
+            "rebuild_permission_index", "--chunk-size=1", stdout=stdout
+        )
+        assert "permissions indexed" in stdout.getvalue()
+        assert get_expected() == get_rows()
+
+
+class TestPermissionIndexMaintenance:
+    def test_disabled(self, refs):
+        assert not PermissionIndex.objects.exists()
+
+    def test_create_derive(self, use_index, refs):
+        assert get_rows()
+        assert get_expected() == get_rows()
+
+    def test_acreate_aderive(self, use_index, agents, objects, caps_3):
+        ref = async_to_sync(ConcreteReference.acreate)(
+            agents[0], objects[0], caps_3
+        )
+        async_to_sync(ref.aderive)(agents[1])
+        assert 2 * len(caps_3) == len(get_rows())
+        assert get_expected() == get_rows()
+
+    def test_derive_many(self, use_index, agents, refs_3):
+        queryset = ConcreteReference.objects.filter(pk=refs_3[0].pk)
+        queryset.derive_many(agents[1:])
+        assert get_expected() == get_rows()
+
+    def test_capabilities_changed(self, use_index, refs_3, caps_names):
+        ref = refs_3[0]
+        ref.capabilities.remove(*ref.capabilities.filter(name=caps_names[0]))
+        assert get_expected() == get_rows()
+        ref.capabilities.clear()
+        assert get_expected() == get_rows()
+
+    def test_capabilities_changed_reverse(self, use_index, refs_3):
+        capability = refs_3[0].capabilities.first()
+        capability.concreteobjectreference_set.clear()
+        assert get_expected() == get_rows()
+
+    def test_revoke(self, use_index, refs, caps_names):
+        refs[0].revoke([caps_names[0]])
+        assert get_expected() == get_rows()
+        refs[1].revoke()
+        assert get_expected() == get_rows()
+
+    def test_delete(self, use_index, refs):
+        refs[0].delete()
+        assert get_expected() == get_rows()
+
+    def test_save_receiver(self, use_index, agents, refs_3):
+        ref = refs_3[0]
+        ref.receiver = agents[2]
+        ref.save()
+        assert get_expected() == get_rows()
+
+    def test_allowed(self, use_index, agents, refs, caps_names):
+        expected = {r.target_id for r in refs if r.receiver == agents[0]}
+        result = ConcreteObject.objects.allowed(agents[0], caps_names[:1])
+        assert expected == {r.pk for r in result}
+
+    def test_permission(
+        self, use_index, rf, agents, objects, django_assert_num_queries
+    ):
+        name = Capability.get_name(ConcreteObject, "retrieve")
+        ConcreteReference.create(agents[0], objects[0], [name])
+        request = rf.get("/test")
+        request.agent = agents[0]
+        view = type("View", (), {"action": "retrieve"})
+        permission = IsActionAllowed()
+        objs = list(ConcreteObject.objects.filter(pk__in=[objects[0].pk]))
+        with django_assert_num_queries(1):
+            assert permission.has_object_permission(request, view, objs[0])
+        assert not permission.has_object_permission(request, view, objects[1])
+
+    def test_permission_middleware(self, use_index, rf, user, agents, objects):
+        agent_cache.cache.clear()
+        name = Capability.get_name(ConcreteObject, "retrieve")
+        ConcreteReference.create(agents[0], objects[0], [name])
+        view = type("View", (), {"action": "retrieve"})
+        permission = IsActionAllowed()
+        middleware = AgentMiddleware(
+            lambda request: permission.has_object_permission(
+                request, view, ConcreteObject.objects.get(pk=objects[0].pk)
+            )
+        )
+
+        request = rf.get("/test")
+        request.user = user
+        assert middleware(request)
+
+        request = rf.get("/test")
+        request.user = AnonymousUser()
+        assert not middleware(request)
@@ -1,14 +1,55 @@
 import copy
+import io
 
 import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
+from fox.caps.models import Agent, Capability, FrozenCapabilitySet
+from fox.caps.models.reference import ReferenceBase
+from fox.caps.signals import references_revoked
 from fox.utils.test import assertCountEqual
-from .app.models import ConcreteReference
+from .app.models import AbstractReference, ConcreteObject, ConcreteReference
 
-__all__ = ("TestReference", "TestReferenceQuerySet")
+__all__ = (
+    "TestReference",
+    "TestReferenceBase",
+    "TestReferenceQuerySet",
+    "TestReferenceQuerySetMerge",
+)
+
+
+@pytest.fixture
+def receivers(db):
+    return Agent.objects.bulk_create(Agent() for _ in range(20))
+
+
+@pytest.fixture
+def members(groups):
+    users = User.objects.bulk_create(
+        User(username="member_{}".format(i)) for i in range(15)
+    )
+    groups[1].user_set.add(*users)
+    return Agent.objects.bulk_create(Agent(user=user) for user in users)
 
 
 class TestReference:
+    def test_get_capability_set(
+        self, capability_map, refs_3, django_assert_num_queries
+    ):
+        ref = refs_3[0]
+        expected = FrozenCapabilitySet(ref.capabilities.all())
+        with django_assert_num_queries(0):
+            assert expected == ref.get_capability_set()
+
+        ref.capability_map = None
+        with django_assert_num_queries(1):
+            assert expected == ref.get_capability_set()
+
     def test_is_valid(self, refs):
         assert refs[2].is_valid()
         assert refs[1].is_valid()
@@ -58,6 +99,186 @@ class TestReference:
         # tested through setUpClass and is_derived/valid
         pass
 
+    def test_derive_warm_registry(
+        self,
+        capability_map,
+        refs_3,
+        agents,
+        caps_2,
+        django_capture_on_commit_callbacks,
+    ):
+        with django_capture_on_commit_callbacks(execute=True):
+            refs_3[0].derive(agents[1], caps_2)
+
+        with CaptureQueriesContext(connection) as context:
+            refs_3[1].derive(agents[2], caps_2)
+        table = Capability._meta.db_table
+        assert not any(
+            'FROM "{}"'.format(table) in query["sql"]
+            for query in context.captured_queries
+        )
+
+    def test_derive_many(self, capability_map, refs_3, receivers, caps_2):
+        result = refs_3[0].derive_many(receivers, caps_2)
+        assert len(receivers) == len(result)
+
+        expected = {c.name: c.max_derive for c in caps_2}
+        queryset = ConcreteReference.objects.filter(origin=refs_3[0])
+        assertCountEqual(
+            [r.pk for r in receivers], [r.receiver_id for r in queryset]
+        )
+        for ref in queryset.prefetch_related("capabilities"):
+            assert 1 == ref.depth
+            assert expected == ref.capability_map
+            assertCountEqual(caps_2, ref.capabilities.all())
+            assert refs_3[0].is_derived(ref)
+
+    def test_derive_many_constant_queries(self, refs_3, receivers, caps_2):
+        Capability.objects.get_or_create_many(caps_2)
+        with CaptureQueriesContext(connection) as context:
+            refs_3[0].derive_many(receivers[:2], caps_2)
+        with CaptureQueriesContext(connection) as context_2:
+            refs_3[1].derive_many(receivers[2:], caps_2)
+        assert len(context.captured_queries) == len(context_2.captured_queries)
+
+    def test_derive_many_update(
+        self, capability_map, refs_3, receivers, caps_names
+    ):
+        ref = refs_3[0].derive(receivers[0], [(caps_names[0], 1)])
+        result = refs_3[0].derive_many(
+            receivers[:2], [(caps_names[1], 0)], update=True
+        )
+        assert 2 == len(result)
+        updated = next(r for r in result if r.pk == ref.pk)
+        assert {caps_names[0]: 1, caps_names[1]: 0} == updated.capability_map
+        assert 2 == updated.capabilities.count()
+
+    def test_derive_many_fail_denied(self, refs_3, receivers):
+        with pytest.raises(PermissionDenied):
+            refs_3[0].derive_many(receivers, ["missing"])
+        assert not ConcreteReference.objects.filter(origin=refs_3[0]).exists()
+
+    def test_derive_agents(self, refs_3, groups, members, caps_2):
+        agents = Agent.objects.members(groups[1])
+        result = refs_3[0].derive_agents(agents, caps_2, chunk_size=4)
+        assert (len(members), 0) == result
+
+        queryset = ConcreteReference.objects.filter(origin=refs_3[0])
+        assertCountEqual(
+            [r.pk for r in members], [r.receiver_id for r in queryset]
+        )
+        for ref in queryset:
+            assert refs_3[0].is_derived(ref)
+
+    def test_derive_agents_update(self, refs_3, groups, members, caps_2):
+        agents = Agent.objects.members(groups[1])
+        refs_3[0].derive(members[0], caps_2)
+        result = refs_3[0].derive_agents(agents, caps_2, update=True)
+        assert (len(members) - 1, 1) == result
+
+    def test_derive_agents_exclude_receiver(self, refs_3, members):
+        agents = Agent.objects.filter(pk=refs_3[0].receiver_id)
+        assert (0, 0) == refs_3[0].derive_agents(agents)
+
+    def test_acreate(self, capability_map, agents, objects, caps_3):
+        ref = async_to_sync(ConcreteReference.acreate)(
+            agents[0], objects[1], caps_3
+        )
+        ref = ConcreteReference.objects.get(pk=ref.pk)
+        assertCountEqual(caps_3, ref.capabilities.all())
+        assert {c.name: c.max_derive for c in caps_3} == ref.capability_map
+
+    def test_acreate_fail_origin(self, agents, objects, caps_3, refs_3):
+        with pytest.raises(ValueError):
+            async_to_sync(ConcreteReference.acreate)(
+                agents[0], objects[1], caps_3, origin=refs_3[0]
+            )
+
+    def test_aderive(self, refs_3, agents, caps_2):
+        ref = async_to_sync(refs_3[0].aderive)(agents[1], caps_2)
+        ref = ConcreteReference.objects.get(pk=ref.pk)
+        assert refs_3[0].is_derived(ref)
+        assertCountEqual(caps_2, ref.capabilities.all())
+
+    def test_aderive_update(self, capability_map, refs_3, agents, caps_names):
+        aderive = async_to_sync(refs_3[0].aderive)
+        ref = aderive(agents[1], [(caps_names[0], 1)])
+        ref_2 = aderive(agents[1], [(caps_names[1], 0)], update=True)
+        assert ref.pk == ref_2.pk
+        assert {caps_names[0]: 1, caps_names[1]: 0} == ref_2.capability_map
+        assert 2 == ref_2.capabilities.count()
+
+    def test_aget_capability(self, refs_3, caps_names):
+        ref = ConcreteReference.objects.get(pk=refs_3[0].pk)
+        ref.capability_map = None
+        aget_capability = async_to_sync(ref.aget_capability)
+        assert aget_capability(caps_names[0])
+        assert aget_capability("missing") is None
+
+    def test_create_capability_map(self, capability_map, refs_3, caps_3):
+        expected = {c.name: c.max_derive for c in caps_3}
+        for ref in refs_3:
+            ref = ConcreteReference.objects.get(pk=ref.pk)
+            assert expected == ref.capability_map
+
+    def test_derive_capability_map(self, capability_map, refs_2, caps_2):
+        expected = {c.name: c.max_derive for c in caps_2}
+        for ref in refs_2:
+            ref = ConcreteReference.objects.get(pk=ref.pk)
+            assert expected == ref.capability_map
+
+    def test_derive_update_capability_map(
+        self, capability_map, refs_3, agents, caps_names
+    ):
+        ref = refs_3[0].derive(agents[1], [(caps_names[0], 1)])
+        ref = refs_3[0].derive(agents[1], [(caps_names[1], 0)], update=True)
+        assert {caps_names[0]: 1, caps_names[1]: 0} == ref.capability_map
+
+    def test_get_capability_from_map(
+        self, capability_map, refs_3, caps_names, django_assert_num_queries
+    ):
+        ref = ConcreteReference.objects.get(pk=refs_3[0].pk)
+        with django_assert_num_queries(0):
+            assert ref.get_capability(caps_names[0])
+            assert ref.get_capability("missing") is None
+
+    def test_is_derived_from_map(
+        self, capability_map, refs_3, refs_2, django_assert_num_queries
+    ):
+        parent = ConcreteReference.objects.get(pk=refs_3[0].pk)
+        child = ConcreteReference.objects.get(pk=refs_2[0].pk)
+        with django_assert_num_queries(0):
+            assert parent.is_derived(child)
+
+    def test_get_capability_map(self):
+        capabilities = [
+            Capability(name="a", max_derive=1),
+            Capability(name="a", max_derive=3),
+            Capability(name="b", max_derive=0),
+        ]
+        result = ConcreteReference.get_capability_map(capabilities, {"c": 1})
+        assert {"a": 3, "b": 0, "c": 1} == result
+
+
+class TestReferenceBase:
+    def test_add_indexes(self):
+        opts = ConcreteReference._meta
+        fields = [tuple(index.fields) for index in opts.indexes]
+        assert ("receiver", "ref") in fields
+        assert ("receiver", "target") in fields
+        # origin is already indexed as foreign key
+        assert ("origin",) not in fields
+        assert all(index.name for index in opts.indexes)
+
+    def test_add_indexes_declared(self):
+        fields = [tuple(i.fields) for i in AbstractReference._meta.indexes]
+        assert ("receiver", "ref") in fields
+
+    def test_add_indexes_no_duplicate(self):
+        count = len(ConcreteReference._meta.indexes)
+        ReferenceBase.add_indexes(ConcreteReference)
+        assert count == len(ConcreteReference._meta.indexes)
+
 
 class TestReferenceQuerySet:
     def test_emitter(self, agents):
@@ -78,11 +299,26 @@ class TestReferenceQuerySet:
                     agent.ref, ref, ref.receiver.ref
                 )
 
+    def test_receiver_ids(self, user, agents, refs):
+        ids = Agent.objects.ids(user)
+        queryset = ConcreteReference.objects.receiver(ids)
+        assert queryset.exists()
+        assert all(ref.receiver_id in ids for ref in queryset)
+        expected = [r for r in refs if r.receiver_id in ids]
+        assertCountEqual(expected, list(queryset))
+
     def test_ref(self, refs):
         for ref in refs:
             item = ConcreteReference.objects.ref(ref.receiver, ref.ref)
             assert ref == item
 
+    def test_aref(self, refs):
+        for ref in refs:
+            item = async_to_sync(ConcreteReference.objects.all().aref)(
+                ref.receiver, ref.ref
+            )
+            assert ref == item
+
     def test_ref_wrong_agent(self, refs, agents):
         for ref in refs:
             for agent in agents:
@@ -111,4 +347,284 @@ class TestReferenceQuerySet:
             )
             assert not queryset.exists(), "agent: " + str(agent.ref)
 
-    # TODO: bulk_create, bulk_update
+    def test_derive_many(self, capability_map, refs_3, receivers, caps_names):
+        queryset = ConcreteReference.objects.filter(
+            pk__in=[r.pk for r in refs_3]
+        )
+        with CaptureQueriesContext(connection) as context:
+            queryset.all().derive_many(receivers[:2], caps_names[:2])
+        with CaptureQueriesContext(connection) as context_2:
+            result = queryset.all().derive_many(receivers[2:], caps_names[:2])
+        assert len(context.captured_queries) == len(context_2.captured_queries)
+        assert len(refs_3) * len(receivers[2:]) == len(result)
+
+        expected = {name: 0 for name in caps_names[:2]}
+        for ref in refs_3:
+            derived = ConcreteReference.objects.filter(origin=ref)
+            assert len(receivers) == derived.count()
+            for item in derived:
+                assert ref.target_id == item.target_id
+                assert expected == item.capability_map
+
+    def test_path(self, refs_3, refs_2, refs_1, receivers):
+        assert "" == refs_3[0].path
+        assert "{}/".format(refs_3[0].pk) == refs_2[0].path
+        assert "{}/{}/".format(refs_3[0].pk, refs_2[0].pk) == refs_1[0].path
+
+        derived = refs_1[0].derive_many(receivers[:1])[0]
+        assert refs_1[0].get_descendants_path() == derived.path
+
+    def test_path_too_deep(self, monkeypatch, agents, refs_2):
+        field = ConcreteReference._meta.get_field("path")
+        monkeypatch.setattr(field, "max_length", len(refs_2[0].path))
+        with pytest.raises(ValidationError):
+            refs_2[0].derive(agents[0])
+
+    def test_save_path(self, refs_3, refs_2, django_assert_num_queries):
+        ref = ConcreteReference.objects.get(pk=refs_2[0].pk)
+        with django_assert_num_queries(1):
+            ref.save()
+
+        ref.origin = refs_3[1]
+        ref.save()
+        assert refs_3[1].get_descendants_path() == ref.path
+
+    def test_descendants(self, refs_3, refs_2, refs_1):
+        queryset = ConcreteReference.objects.descendants(refs_3[0])
+        assertCountEqual([refs_2[0], refs_1[0]], queryset)
+        assert not ConcreteReference.objects.descendants(refs_1[0]).exists()
+
+    def test_ancestors(self, refs_3, refs_2, refs_1):
+        queryset = ConcreteReference.objects.ancestors(refs_1[0])
+        assertCountEqual([refs_3[0], refs_2[0]], queryset)
+        assert not ConcreteReference.objects.ancestors(refs_3[0]).exists()
+
+    def test_emitted_by(self, agents, refs_2, refs_1):
+        queryset = ConcreteReference.objects.emitted_by(agents[0])
+        assertCountEqual([refs_2[0], refs_1[0], refs_1[2]], queryset)
+
+    def test_emitted_by_not_transitive(self, agents, refs_2, refs_1):
+        queryset = ConcreteReference.objects.emitted_by(
+            agents[0], transitive=False
+        )
+        assertCountEqual([refs_2[0], refs_1[2]], queryset)
+
+    def test_update_path(self, refs):
+        expected = {r.pk: r.path for r in ConcreteReference.objects.all()}
+        ConcreteReference.objects.update(path="")
+        ConcreteReference.objects.all().update_path()
+        result = {r.pk: r.path for r in ConcreteReference.objects.all()}
+        assert expected == result
+
+    def test_subtree(self, refs_3, refs_2, refs_1):
+        queryset = ConcreteReference.objects.subtree(refs_2[0])
+        assertCountEqual([refs_2[0], refs_1[0]], queryset)
+
+    def test_revoke(self, refs, refs_3, refs_2, refs_1):
+        calls = []
+
+        def receiver(**kwargs):
+            calls.append(kwargs)
+
+        references_revoked.connect(receiver)
+        try:
+            count = refs_3[0].revoke()
+        finally:
+            references_revoked.disconnect(receiver)
+
+        assert 3 == count
+        revoked = [refs_3[0].pk, refs_2[0].pk, refs_1[0].pk]
+        assert not ConcreteReference.objects.filter(pk__in=revoked).exists()
+        assert len(refs) - 3 == ConcreteReference.objects.count()
+        through = ConcreteReference.capabilities.through
+        assert not through.objects.filter(
+            concreteobjectreference__in=revoked
+        ).exists()
+        assert 1 == len(calls)
+        assert None is calls[0]["capabilities"]
+        assert 3 == calls[0]["count"]
+
+    def test_revoke_capabilities(
+        self, capability_map, refs_3, refs_2, refs_1, caps_names
+    ):
+        count = refs_2[0].revoke([caps_names[0]])
+        assert 2 == count
+        for ref in (refs_2[0], refs_1[0]):
+            ref = ConcreteReference.objects.get(pk=ref.pk)
+            assert caps_names[0] not in ref.capability_map
+            assert not ref.capabilities.filter(name=caps_names[0]).exists()
+            assert ref.capabilities.filter(name=caps_names[1]).exists()
+
+        ref = ConcreteReference.objects.get(pk=refs_3[0].pk)
+        assert caps_names[0] in ref.capability_map
+        assert ref.capabilities.filter(name=caps_names[0]).exists()
+
+    def test_revoke_capabilities_count(self, refs_3, refs_2, caps_names):
+        # only the derived reference still has the capability
+        refs_3[0].capabilities.remove(
+            *refs_3[0].capabilities.filter(name=caps_names[0])
+        )
+        assert 1 == refs_3[0].revoke([caps_names[0]])
+        assert 0 == refs_3[0].revoke([caps_names[0]])
+
+    def test_capability(self, refs, caps_names):
+        for ref in refs:
+            queryset = ConcreteReference.objects.capability(
+                ref.receiver, caps_names[0]
+            )
+            assert queryset.filter(pk=ref.pk).exists()
+            queryset = ConcreteReference.objects.capability(
+                ref.receiver, "missing"
+            )
+            assert not queryset.exists()
+
+    def test_capabilities(self, refs, caps_names):
+        for ref in refs:
+            queryset = ConcreteReference.objects.capabilities(
+                ref.receiver, ["missing", caps_names[1]]
+            )
+            assert queryset.filter(pk=ref.pk).exists()
+
+    def test_capability_map_null(self, capability_map, refs_3, caps_names):
+        ref = refs_3[0]
+        ConcreteReference.objects.filter(pk=ref.pk).update(capability_map=None)
+        queryset = ConcreteReference.objects.capabilities(
+            ref.receiver, caps_names[:1]
+        )
+        assert queryset.filter(pk=ref.pk).exists()
+
+    def test_capability_map_remove(self, capability_map, refs_3, caps_names):
+        ref = refs_3[0]
+        ref.capabilities.remove(*ref.capabilities.filter(name=caps_names[0]))
+        assert caps_names[0] not in ref.capability_map
+        assert ref.get_capability(caps_names[0]) is None
+
+        ref = ConcreteReference.objects.get(pk=ref.pk)
+        assert ref.get_capability(caps_names[0]) is None
+        queryset = ConcreteReference.objects.capability(
+            ref.receiver, caps_names[0]
+        )
+        assert not queryset.filter(pk=ref.pk).exists()
+        assert not ConcreteObject.objects.allowed(
+            ref.receiver, caps_names[:1]
+        ).filter(pk=ref.target_id)
+
+    def test_capability_map_remove_reverse(
+        self, capability_map, refs_3, caps_names
+    ):
+        ref = refs_3[0]
+        capability = ref.capabilities.get(name=caps_names[0])
+        capability.concreteobjectreference_set.remove(ref)
+        ref = ConcreteReference.objects.get(pk=ref.pk)
+        assert ref.capability_map is None
+        assert ref.get_capability(caps_names[0]) is None
+        assert ref.get_capability(caps_names[1])
+
+    def test_bulk_create_capabilities(
+        self, capability_map, agents, objects, caps_3
+    ):
+        capabilities = list(Capability.objects.get_or_create_many(caps_3))
+        refs = ConcreteReference.objects.bulk_create(
+            [ConcreteReference(receiver=agents[0], target=objects[1])],
+            capabilities=capabilities,
+        )
+        ref = ConcreteReference.objects.get(pk=refs[0].pk)
+        assertCountEqual(capabilities, ref.capabilities.all())
+        assert {c.name: c.max_derive for c in caps_3} == ref.capability_map
+
+    def test_update_capability_map(self, refs, caps_3):
+        ConcreteReference.objects.update(capability_map=None)
+        count = ConcreteReference.objects.all().update_capability_map()
+        assert len(refs) == count
+        for ref in ConcreteReference.objects.all():
+            assert ref.capability_map
+
+    # TODO: bulk_update
+
+    def test_validate(self, capability_map, refs, django_assert_num_queries):
+        queryset = ConcreteReference.objects.all()
+        # references, parents, (no capabilities: maps are used)
+        with django_assert_num_queries(2):
+            assert [] == queryset.validate()
+
+    def test_validate_invalid(self, capability_map, refs_3, refs_2, refs_1):
+        ConcreteReference.objects.filter(pk=refs_2[0].pk).update(depth=0)
+        ConcreteReference.objects.filter(pk=refs_1[1].pk).update(
+            capability_map={"unknown": 0}
+        )
+        ConcreteReference.objects.filter(pk=refs_1[2].pk).update(
+            target=refs_3[0].target
+        )
+        expected = [refs_2[0], refs_1[1], refs_1[2]]
+        queryset = ConcreteReference.objects.all()
+        assertCountEqual(expected, queryset.validate(batch_size=2))
+
+    def test_validate_capabilities(
+        self, refs_3, refs_2, refs_1, django_assert_num_queries
+    ):
+        ConcreteReference.objects.update(capability_map=None)
+        refs_2[1].capabilities.remove(*refs_2[1].capabilities.all())
+        refs = list(ConcreteReference.objects.all())
+        # parents and capabilities
+        with django_assert_num_queries(2):
+            invalid = ConcreteReference.objects.validate(refs)
+        # refs_2[1] has no capability: it is valid, but refs_1[1] derived
+        # from it is not
+        assert [refs_1[1]] == invalid
+
+
+@pytest.fixture
+def overlapping(agents, objects, caps_3, caps_2, caps_names):
+    root = ConcreteReference.create(agents[0], objects[0], caps_3)
+    # redundant: agents[1] also has a root reference on the same target,
+    # granting all capabilities.
+    derived = root.derive(agents[1], [(caps_names[0], 1)])
+    other = ConcreteReference.create(agents[1], objects[0], caps_3)
+    child = derived.derive(agents[2], [(caps_names[0], 0)])
+    return root, derived, other, child
+
+
+class TestReferenceQuerySetMerge:
+    def test_effective_capabilities(
+        self, agents, objects, overlapping, caps_names
+    ):
+        with CaptureQueriesContext(connection) as context:
+            result = ConcreteReference.objects.effective_capabilities(
+                agents[1]
+            )
+        assert len(context.captured_queries) == 1
+        assert [objects[0].pk] == list(result)
+        assert {name: 2 for name in caps_names} == result[objects[0].pk].map
+
+    def test_effective_capabilities_targets(self, agents, objects, refs):
+        queryset = ConcreteReference.objects.all()
+        ids = Agent.objects.ids(agents[0].user)
+        result = queryset.effective_capabilities(ids, [objects[0].pk])
+        assert [objects[0].pk] == list(result)
+
+    def test_compact(self, overlapping):
+        root, derived, other, child = overlapping
+        assert 1 == ConcreteReference.objects.compact()
+        assert not ConcreteReference.objects.filter(pk=derived.pk).exists()
+        child.refresh_from_db()
+        assert other.pk == child.origin_id
+        assert other.get_descendants_path() == child.path
+        assert [] == ConcreteReference.objects.validate()
+
+    def test_compact_nothing(self, refs):
+        assert 0 == ConcreteReference.objects.compact()
+        assert len(refs) == ConcreteReference.objects.count()
+
+    def test_compact_conflict(self, agents, overlapping, caps_names):
+        root, derived, other, child = overlapping
+        other.derive(agents[2], [(caps_names[1], 0)])
+        assert 0 == ConcreteReference.objects.compact()
+
+    def test_compact_command(self, overlapping):
+        stdout = io.StringIO()
+        call_command(
+            "compact_references",
+            "caps_test.ConcreteObjectReference",
+            stdout=stdout,
+        )
+        assert "1 references merged" in stdout.getvalue()
@@ -0,0 +1,164 @@
+import itertools
+
+import pytest
+from django.core import signing
+
+from fox.caps.models import CapabilitySet, FrozenCapabilitySet
+from fox.caps.permissions import IsTokenAllowed
+from fox.caps.tokens import (
+    CapabilityToken,
+    TokenRevoked,
+    TokenSigner,
+    revocation_epochs,
+)
+from .app.models import ConcreteObject, ConcreteReference
+
+__all__ = ("TestTokenSigner", "TestReferenceToken", "TestIsTokenAllowed")
+
+
+@pytest.fixture(autouse=True)
+def clear_epochs():
+    revocation_epochs.cache.clear()
+    yield
+    revocation_epochs.cache.clear()
+
+
+@pytest.fixture
+def signer():
+    return TokenSigner()
+
+
+@pytest.fixture
+def obj():
+    return ConcreteObject(pk=12)
+
+
+class TestTokenSigner:
+    def test_sign_verify(self, signer, obj, caps_3):
+        value = signer.sign(obj, caps_3, receiver=1, depth=2)
+        token = signer.verify(value, target=obj)
+        assert isinstance(token, CapabilityToken)
+        assert ("caps_test.concreteobject", 12) == token.target
+        assert (1, 2) == (token.receiver, token.depth)
+        assert FrozenCapabilitySet(caps_3) == token.capabilities
+
+    def test_verify_tampered(self, signer, obj, caps_3):
+        value = signer.sign(obj, caps_3)
+        with pytest.raises(signing.BadSignature):
+            signer.verify(value[:-2] + "xx")
+
+    def test_verify_other_key(self, signer, obj, caps_3):
+        value = TokenSigner(key="other").sign(obj, caps_3)
+        with pytest.raises(signing.BadSignature):
+            signer.verify(value)
+
+    def test_verify_expired(self, signer, obj, caps_3):
+        value = signer.sign(obj, caps_3, expires=-1)
+        with pytest.raises(signing.SignatureExpired):
+            signer.verify(value)
+
+    def test_verify_wrong_target(self, signer, obj, caps_3):
+        value = signer.sign(obj, caps_3)
+        with pytest.raises(signing.BadSignature):
+            signer.verify(value, target=ConcreteObject(pk=13))
+
+    def test_verify_revoked(self, signer, obj, caps_3):
+        value = signer.sign(obj, caps_3)
+        revocation_epochs.increment(CapabilityToken.get_target(obj))
+        with pytest.raises(TokenRevoked):
+            signer.verify(value)
+        # minted after revocation
+        signer.verify(signer.sign(obj, caps_3))
+
+    def test_verify_missing_epoch(self, monkeypatch, signer, obj, caps_3):
+        monkeypatch.setattr(
+            revocation_epochs, "now", itertools.count(1).__next__
+        )
+        value = signer.sign(obj, caps_3)
+        revocation_epochs.increment(CapabilityToken.get_target(obj))
+        # entry evicted: tokens minted before are rejected
+        revocation_epochs.cache.clear()
+        with pytest.raises(TokenRevoked):
+            signer.verify(value)
+
+    def test_capability_set_get_token(self, signer, obj, caps_3):
+        value = CapabilitySet(caps_3).get_token(obj, signer=signer)
+        token = signer.verify(value, obj)
+        assert FrozenCapabilitySet(caps_3) == token.capabilities
+
+
+class TestReferenceToken:
+    def test_get_token(
+        self, capability_map, signer, refs_2, django_assert_num_queries
+    ):
+        ref, target = refs_2[0], refs_2[0].target
+        with django_assert_num_queries(0):
+            value = ref.get_token()
+            token = signer.verify(value, target)
+        assert ref.receiver_id == token.receiver
+        assert ref.depth == token.depth
+        assert ref.get_capability_set() == token.capabilities
+
+    def test_revoke(self, signer, refs_3, refs_2):
+        value = refs_2[0].get_token()
+        ConcreteReference.objects.revoke(refs_2[0])
+        with pytest.raises(TokenRevoked):
+            signer.verify(value)
+
+    def test_remove_capability(self, signer, refs_2, caps_names):
+        ref = refs_2[0]
+        value = ref.get_token()
+        ref.capabilities.remove(*ref.capabilities.filter(name=caps_names[0]))
+        with pytest.raises(TokenRevoked):
+            signer.verify(value)
+
+    def test_remove_capability_reverse(self, signer, refs_2):
+        ref = refs_2[0]
+        value = ref.get_token()
+        ref.capabilities.first().concreteobjectreference_set.clear()
+        with pytest.raises(TokenRevoked):
+            signer.verify(value)
+
+    def test_delete(self, signer, refs_2, refs_1):
+        value = refs_1[0].get_token()
+        refs_1[0].delete()
+        with pytest.raises(TokenRevoked):
+            signer.verify(value)
+
+
+class View:
+    action = "retrieve"
+
+
+class TestIsTokenAllowed:
+    def test_has_object_permission(self, rf, obj, signer):
+        name = "concreteobject_retrieve"
+        value = signer.sign(obj, [name])
+        request = rf.get("/", HTTP_AUTHORIZATION="Capability " + value)
+        permission = IsTokenAllowed()
+        assert permission.has_permission(request, View)
+        assert permission.has_object_permission(request, View, obj)
+        assert request.capability_token.target == (
+            "caps_test.concreteobject",
+            12,
+        )
+
+        other = ConcreteObject(pk=13)
+        assert not permission.has_object_permission(request, View, other)
+
+    def test_has_object_permission_query_param(self, rf, obj, signer):
+        value = signer.sign(obj, ["concreteobject_retrieve"])
+        request = rf.get("/", {"token": value})
+        assert IsTokenAllowed().has_object_permission(request, View, obj)
+
+    def test_has_object_permission_missing_capability(self, rf, obj, signer):
+        value = signer.sign(obj, ["concreteobject_update"])
+        request = rf.get("/", {"token": value})
+        assert not IsTokenAllowed().has_object_permission(request, View, obj)
+        permission = IsTokenAllowed("concreteobject_update")
+        assert permission.has_object_permission(request, View, obj)
+
+    def test_has_permission_invalid(self, rf):
+        assert not IsTokenAllowed().has_permission(rf.get("/"), View)
+        request = rf.get("/", {"token": "invalid"})
+        assert not IsTokenAllowed().has_permission(request, View)
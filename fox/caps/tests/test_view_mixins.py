@@ -1,8 +1,13 @@
 import pytest
+from django.contrib.auth.models import AnonymousUser
 from django.test import RequestFactory
+from django.views.generic.list import MultipleObjectMixin
 
 import fox.caps.views.mixins as mixins
+from fox.caps.cache import agent_cache
+from fox.caps.middleware import AgentMiddleware
 from fox.caps.models import Agent
+from .app.models import ConcreteObject, ConcreteReference
 
 factory = RequestFactory()
 
@@ -32,10 +37,36 @@ class TestBaseObjectMixin:
         assert base_object_mixin.get_agent() is agent
 
 
+class ListView(mixins.ObjectListMixin, MultipleObjectMixin):
+    model = ConcreteObject
+
+
+def list_response(request):
+    view = ListView()
+    view.request = request
+    return list(view.get_queryset())
+
+
 class TestObjectListMixin:
     def test_get_queryset(self):
         pass
 
+    def test_get_queryset_middleware(self, rf, user, agents):
+        agent_cache.cache.clear()
+        objs = ConcreteObject.objects.bulk_create(
+            ConcreteObject(name=str(i)) for i in range(2)
+        )
+        ConcreteReference.create(agents[0], objs[0], ["action"])
+        request = rf.get("/test")
+        request.user = user
+        assert [objs[0]] == AgentMiddleware(list_response)(request)
+
+    def test_get_queryset_middleware_no_agent(self, rf, agents):
+        agent_cache.cache.clear()
+        request = rf.get("/test")
+        request.user = AnonymousUser()
+        assert [] == AgentMiddleware(list_response)(request)
+
 
 class TestObjectDetailMixin:
     def test_get_object(self):
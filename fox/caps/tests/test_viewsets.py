@@ -0,0 +1,132 @@
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import mixins, serializers
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from fox.caps.cache import agent_cache
+from fox.caps.middleware import AgentMiddleware
+from fox.caps.models import Capability
+from fox.caps.permissions import IsActionAllowed
+from fox.caps.viewsets import ObjectViewSet
+from .app.models import ConcreteObject, ConcreteReference
+
+__all__ = ("TestObjectViewSetMixin",)
+
+
+class Serializer(serializers.ModelSerializer):
+    class Meta:
+        model = ConcreteObject
+        fields = ["id", "name"]
+
+
+class ViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, ObjectViewSet):
+    queryset = ConcreteObject.objects.all()
+    serializer_class = Serializer
+    permission_classes = [IsActionAllowed]
+    authentication_classes = []
+
+
+@pytest.fixture
+def get(agents):
+    factory = APIRequestFactory()
+
+    def get(actions, agent=agents[0], **kwargs):
+        request = factory.get("/test")
+        request.agent = agent
+        view = ViewSet.as_view(actions)
+        return view(request, **kwargs)
+
+    return get
+
+
+@pytest.fixture
+def get_middleware(user):
+    """Run view through `AgentMiddleware`, resolving request's agent."""
+    agent_cache.cache.clear()
+    factory = APIRequestFactory()
+
+    def get(actions, user=user, **kwargs):
+        request = factory.get("/test")
+        request.user = user
+        force_authenticate(request, user)
+        view = ViewSet.as_view(actions)
+        middleware = AgentMiddleware(lambda request: view(request, **kwargs))
+        return middleware(request)
+
+    return get
+
+
+@pytest.fixture
+def viewset_refs(agents, objects):
+    names = [
+        Capability.get_name(ConcreteObject, action)
+        for action in ("list", "retrieve")
+    ]
+    return [
+        ConcreteReference.create(agents[0], objects[0], names),
+        ConcreteReference.create(agents[0], objects[1], names[:1]),
+        ConcreteReference.create(agents[1], objects[2], names),
+    ]
+
+
+class TestObjectViewSetMixin:
+    def test_list(self, get, objects, viewset_refs):
+        response = get({"get": "list"})
+        assert 200 == response.status_code
+        ids = sorted(item["id"] for item in response.data)
+        assert [objects[0].pk, objects[1].pk] == ids
+
+    def test_list_num_queries(self, get, agents, objects, viewset_refs):
+        name = Capability.get_name(ConcreteObject, "list")
+        with CaptureQueriesContext(connection) as context:
+            get({"get": "list"})
+        count = len(context.captured_queries)
+
+        objs = ConcreteObject.objects.bulk_create(
+            ConcreteObject(name="extra_{}".format(i)) for i in range(10)
+        )
+        for obj in objs:
+            ConcreteReference.create(agents[0], obj, [name])
+        with CaptureQueriesContext(connection) as context:
+            response = get({"get": "list"})
+        assert 12 == len(response.data)
+        assert count == len(context.captured_queries)
+
+    def test_retrieve(self, get, objects, viewset_refs):
+        response = get({"get": "retrieve"}, ref=viewset_refs[0].ref)
+        assert 200 == response.status_code
+        assert objects[0].pk == response.data["id"]
+
+    def test_retrieve_not_allowed(self, get, viewset_refs):
+        # reference without retrieve capability
+        response = get({"get": "retrieve"}, ref=viewset_refs[1].ref)
+        assert 404 == response.status_code
+
+    def test_retrieve_other_receiver(self, get, viewset_refs):
+        response = get({"get": "retrieve"}, ref=viewset_refs[2].ref)
+        assert 404 == response.status_code
+
+    def test_retrieve_invalid_ref(self, get, viewset_refs):
+        response = get({"get": "retrieve"}, ref="invalid")
+        assert 404 == response.status_code
+
+    def test_list_middleware(self, get_middleware, objects, viewset_refs):
+        response = get_middleware({"get": "list"})
+        assert 200 == response.status_code
+        ids = sorted(item["id"] for item in response.data)
+        assert [objects[0].pk, objects[1].pk] == ids
+
+    def test_list_middleware_no_agent(self, get_middleware, viewset_refs):
+        response = get_middleware({"get": "list"}, user=AnonymousUser())
+        assert 200 == response.status_code
+        assert [] == response.data
+
+    def test_retrieve_middleware(self, get_middleware, objects, viewset_refs):
+        response = get_middleware({"get": "retrieve"}, ref=viewset_refs[0].ref)
+        assert 200 == response.status_code
+        assert objects[0].pk == response.data["id"]
+
+        response = get_middleware({"get": "retrieve"}, ref="invalid")
+        assert 404 == response.status_code
@@ -0,0 +1,238 @@
+"""Signed capability tokens, allowing permission checks without database
+access.
+
+A token encodes a target object, a receiver, a depth and capabilities as
+``(name, max_derive)`` couples. It is signed using Django's signing
+framework (HMAC with ``settings.SECRET_KEY``), and can expire.
+
+Tokens carry the revocation epoch of their target at minting time (see
+`RevocationEpochs`): epochs are incremented when target's references are
+revoked, deleted or lose capabilities, invalidating previously minted
+tokens. Verifying an epoch only requires a cache lookup.
+
+Example:
+
+    ```
+    token = reference.get_token(expires=3600)
+    # ...
+    data = verifier.verify(token, target=obj)
+    data.capabilities.get_capability("action")
+    ```
+"""
+from __future__ import annotations
+
+import time
+from typing import Union
+
+from django.core import signing
+from django.core.cache import caches
+
+from .models import FrozenCapabilitySet
+
+__all__ = (
+    "TokenRevoked",
+    "CapabilityToken",
+    "RevocationEpochs",
+    "TokenSigner",
+    "revocation_epochs",
+    "token_signer",
+)
+
+
+class TokenRevoked(signing.BadSignature):
+    """Token has been revoked."""
+
+
+class CapabilityToken:
+    """Decoded capability token."""
+
+    __slots__ = (
+        "target",
+        "receiver",
+        "depth",
+        "capabilities",
+        "epoch",
+        "expires",
+    )
+
+    def __init__(
+        self,
+        target: tuple[str, int],
+        capabilities: FrozenCapabilitySet,
+        receiver: int = None,
+        depth: int = 0,
+        epoch: int = 0,
+        expires: int = None,
+    ):
+        self.target = tuple(target)
+        """Target as ``(model label, primary key)``."""
+        self.capabilities = capabilities
+        self.receiver = receiver
+        """Receiver agent's primary key."""
+        self.depth = depth
+        self.epoch = epoch
+        """Revocation epoch of target at minting time."""
+        self.expires = expires
+        """Expiration UNIX timestamp."""
+
+    @staticmethod
+    def get_target(obj) -> tuple[str, int]:
+        """Return token target for provided object."""
+        return (obj._meta.label_lower, obj.pk)
+
+    def is_target(self, obj) -> bool:
+        """Return True if `obj` is token's target."""
+        return self.target == self.get_target(obj)
+
+    def get_capability(self, name: str):
+        """Return capability by name or None."""
+        return self.capabilities.get_capability(name)
+
+    def to_payload(self) -> dict:
+        """Return compact payload to sign."""
+        payload = {"t": list(self.target), "c": dict(self.capabilities.map)}
+        for key, value in (
+            ("r", self.receiver),
+            ("d", self.depth),
+            ("e", self.epoch),
+            ("x", self.expires),
+        ):
+            if value:
+                payload[key] = value
+        return payload
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> CapabilityToken:
+        """Return token from signed payload."""
+        return cls(
+            target=payload["t"],
+            capabilities=FrozenCapabilitySet.from_map(payload["c"]),
+            receiver=payload.get("r"),
+            depth=payload.get("d", 0),
+            epoch=payload.get("e", 0),
+            expires=payload.get("x"),
+        )
+
+
+class RevocationEpochs:
+    """Revocation epochs of targets, stored in Django cache framework.
+
+    Epochs are timestamps in milliseconds, incremented by
+    `fox.caps.receivers` when references are revoked, deleted or lose
+    capabilities. A missing entry (never written, expired or evicted) is
+    initialized to current time: tokens minted before it are rejected.
+    Cache must be shared between processes, otherwise tokens are rejected
+    by processes that did not mint them.
+    """
+
+    cache_alias = "default"
+    """Django cache alias."""
+    key_prefix = "fox.caps.epochs"
+    timeout = None
+    """Entries timeout in seconds (default: never expire)."""
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_key(self, target: tuple[str, int]) -> str:
+        return "{}:{}:{}".format(self.key_prefix, *target)
+
+    @staticmethod
+    def now() -> int:
+        """Return current epoch value."""
+        return time.time_ns() // 1_000_000
+
+    def get(self, target: tuple[str, int]) -> int:
+        """Return current epoch of target."""
+        key = self.get_key(target)
+        epoch = self.cache.get(key)
+        if epoch is None:
+            epoch = self.now()
+            if not self.cache.add(key, epoch, self.timeout):
+                # set meanwhile
+                epoch = self.cache.get(key, epoch)
+        return epoch
+
+    def increment(self, target: tuple[str, int]):
+        """Increment target's epoch, revoking its tokens."""
+        key = self.get_key(target)
+        epoch = max(self.now(), self.cache.get(key, 0) + 1)
+        self.cache.set(key, epoch, self.timeout)
+
+
+revocation_epochs = RevocationEpochs()
+"""Default revocation epochs instance."""
+
+
+class TokenSigner:
+    """Mint and verify capability tokens."""
+
+    salt = "fox.caps.tokens"
+    """Signing salt."""
+    epochs = revocation_epochs
+    """Revocation epochs. If None, tokens are not checked for
+    revocation."""
+
+    def __init__(self, key: str = None, salt: str = None):
+        self.key = key
+        if salt:
+            self.salt = salt
+
+    def sign(
+        self,
+        target,
+        capabilities,
+        receiver: int = None,
+        depth: int = 0,
+        expires: Union[int, float] = None,
+    ) -> str:
+        """Return a signed token.
+
+        :param target: target object, or ``(model label, pk)``.
+        :param capabilities: capability set or iterable of capabilities.
+        :param receiver: receiver agent's primary key.
+        :param depth: references' chain depth.
+        :param expires: token lifetime in seconds.
+        """
+        if not isinstance(target, tuple):
+            target = CapabilityToken.get_target(target)
+        if not isinstance(capabilities, FrozenCapabilitySet):
+            capabilities = FrozenCapabilitySet(capabilities)
+        token = CapabilityToken(
+            target,
+            capabilities,
+            receiver=receiver,
+            depth=depth,
+            epoch=self.epochs.get(target) if self.epochs else 0,
+            expires=expires and int(time.time() + expires),
+        )
+        return signing.dumps(
+            token.to_payload(), key=self.key, salt=self.salt, compress=True
+        )
+
+    def verify(self, token: str, target=None) -> CapabilityToken:
+        """Return decoded token, checking its signature, expiration and
+        revocation.
+
+        :param target: if provided, token must target this object.
+        :raises django.core.signing.BadSignature: invalid, expired \
+            (`SignatureExpired`) or revoked (`TokenRevoked`) token.
+        """
+        payload = signing.loads(token, key=self.key, salt=self.salt)
+        try:
+            token = CapabilityToken.from_payload(payload)
+        except (KeyError, TypeError, ValueError) as err:
+            raise signing.BadSignature("Invalid token payload") from err
+
+        if token.expires is not None and token.expires < time.time():
+            raise signing.SignatureExpired("Token expired")
+        if target is not None and not token.is_target(target):
+            raise signing.BadSignature("Token target mismatch")
+        if self.epochs and token.epoch < self.epochs.get(token.target):
+            raise TokenRevoked("Token revoked")
+        return token
+
+
+token_signer = TokenSigner()
+"""Default token signer."""
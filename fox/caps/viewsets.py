@@ -0,0 +1,48 @@
+"""Provide Django Rest Framework viewsets to work with capabilities."""
+from django.shortcuts import get_object_or_404
+from rest_framework.viewsets import GenericViewSet
+
+from fox.caps.filters import ActionAllowedFilterBackend, ReceiverFilterBackend
+from fox.caps.views.mixins import BaseObjectMixin
+
+__all__ = ("ObjectViewSetMixin", "ObjectViewSet")
+
+
+class ObjectViewSetMixin(BaseObjectMixin):
+    """Viewset mixin scoping queryset to request's agent in database.
+
+    Before view's `filter_backends`, queryset is filtered by
+    `capability_filter_backends`: objects are scoped to agent's references
+    (prefetched along with their capabilities), and to the ones on which
+    agent is allowed to run view's action. Permissions such as
+    `fox.caps.permissions.IsActionAllowed` then read prefetched
+    references, and list endpoints run a fixed number of queries.
+
+    Objects are looked up by their reference's ``ref`` on detail routes.
+    """
+
+    lookup_field = "ref"
+    capability_filter_backends = (
+        ReceiverFilterBackend,
+        ActionAllowedFilterBackend,
+    )
+    prefetch_capabilities = None
+    """Prefetch references' capabilities. If None, they are prefetched
+    only when reference model does not use its capability map."""
+
+    def filter_queryset(self, queryset):
+        for backend in self.capability_filter_backends:
+            queryset = backend().filter_queryset(self.request, queryset, self)
+        return super().filter_queryset(queryset)
+
+    def get_object(self):
+        """Return object of reference matching lookup argument, checking
+        object permissions."""
+        queryset = self.filter_queryset(self.get_queryset())
+        obj = get_object_or_404(queryset)
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+class ObjectViewSet(ObjectViewSetMixin, GenericViewSet):
+    """Generic viewset of `fox.caps.models.Object` models."""